@@ -7,6 +7,7 @@ from api.lib.permissions import IsOwnerOrReadOnly, IsSuperuserOrReadOnly
 from api.lib.query import sample_qs_optimizer, chemical_analyses_qs_optimizer
 
 from api.samples.lib.query import sample_query
+from apps.monitoring import metrics
 from api.samples.v1.serializers import (
     SampleSerializer,
     RockTypeSerializer,
@@ -182,6 +183,8 @@ class BulkUploadSampleViewSet(viewsets.ModelViewSet):
         p = Parser(template_instance) 
         JSON = p.parse(url)
         write_JSON(JSON)        
+        if JSON:
+            metrics.BULK_UPLOAD_ROWS.inc(len(JSON), template=template_name)
 
         return Response(JSON)
         
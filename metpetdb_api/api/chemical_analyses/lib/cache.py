@@ -0,0 +1,351 @@
+"""
+A columnar copy of the compositions of all chemical analyses, with their
+analysis, sample and mineral ids, as NumPy .npy files under
+settings.COMPOSITION_CACHE_DIR that every worker process memory-maps
+read-only, sharing the pages. Which analyses a request sees is always
+decided by the database; the cache only supplies their amounts.
+
+`python manage.py refresh_composition_cache` writes them: a full build
+into a new generation directory, or a patch of the analyses whose
+composition changed since the last refresh, rewriting their rows in place
+and appending new analyses into spare rows. manifest.json names the
+current generation and how many of its rows are in use, and is replaced
+atomically once the arrays are written. A full build happens when there is
+no cache yet, the columns changed, the spare rows ran out, the number of
+analyses doesn't match (deletions, bulk loads) or MAX_AGE passed. A cache
+not refreshed for MAX_AGE isn't used at all.
+"""
+import json
+import os
+import shutil
+import threading
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from api.chemical_analyses.lib.matrix import (
+    CompositionMatrix,
+    composition_matrix,
+)
+from apps.chemical_analyses.models import ChemicalAnalysis
+
+
+BATCH_SIZE = 50000
+
+# Spare rows for appends, as a fraction of the analyses at build time
+SPARE_FRACTION = 0.1
+MIN_SPARE = 1000
+
+MAX_AGE = timedelta(hours=24)
+
+# Changes are looked for this far back before the last refresh, so writes
+# committed after it with an earlier composition_updated aren't missed
+SYNC_MARGIN = timedelta(minutes=1)
+
+MANIFEST = 'manifest.json'
+
+# Ids are stored as their 36 character text, which sorts like the uuids
+_ID = 'S36'
+
+# name: (dtype, whether there is one value per column)
+ARRAYS = {
+    'ids': (_ID, False),
+    'sample_ids': (_ID, False),
+    'mineral_ids': (_ID, False),
+    'amounts': (np.float64, True),
+    # amounts outside their detection limits
+    'outside': (bool, True),
+}
+
+
+def cache_directory():
+    return getattr(settings, 'COMPOSITION_CACHE_DIR', None) or None
+
+
+def _read_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def _write_manifest(directory, manifest):
+    path = os.path.join(directory, MANIFEST)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f)
+    os.replace(path + '.tmp', path)
+
+
+def _array_path(directory, generation, name):
+    return os.path.join(directory, generation, name + '.npy')
+
+
+def _ids(values):
+    return np.array([str(value) if value else '' for value in values],
+                    dtype=_ID)
+
+
+def _lookup(order, sorted_ids, ids):
+    # the positions of `ids` among the ids sorted by `order`, -1 if absent
+    positions = np.full(len(ids), -1, dtype=int)
+    if len(sorted_ids):
+        found = np.minimum(np.searchsorted(sorted_ids, ids),
+                           len(sorted_ids) - 1)
+        hit = sorted_ids[found] == ids
+        positions[hit] = order[found[hit]]
+    return positions
+
+
+def _columns():
+    return composition_matrix(ChemicalAnalysis.objects.none(),
+                              drop_empty=False).columns
+
+
+def _read_rows(ids, columns):
+    """
+    The rows of the analyses with the given ids, in id order, as a dict of
+    arrays named as in ARRAYS; analyses deleted meanwhile are left out.
+    """
+    metadata = {
+        str(pk): row for pk, *row in
+        ChemicalAnalysis
+        .objects
+        .filter(pk__in=ids)
+        .values_list('pk', 'subsample__sample_id', 'mineral_id')}
+    qs = ChemicalAnalysis.objects.filter(pk__in=list(metadata))
+    raw = composition_matrix(qs, drop_empty=False)
+    masked = composition_matrix(qs, drop_empty=False, detection_limits=True)
+    if raw.columns != columns or masked.columns != columns:
+        raise _Rebuild()
+
+    masked_rows = {pk: i for i, pk in enumerate(masked.ids)}
+    keep = [i for i, pk in enumerate(raw.ids)
+            if pk in metadata and pk in masked_rows]
+    ids = [raw.ids[i] for i in keep]
+    amounts = raw.amounts[keep]
+    outside = (np.isnan(masked.amounts[[masked_rows[pk] for pk in ids]]) &
+               ~np.isnan(amounts))
+    return {
+        'ids': _ids(ids),
+        'sample_ids': _ids(metadata[pk][0] for pk in ids),
+        'mineral_ids': _ids(metadata[pk][1] for pk in ids),
+        'amounts': amounts,
+        'outside': outside,
+    }
+
+
+class _Rebuild(Exception):
+    pass
+
+
+def _close(arrays):
+    # writes the memory-mapped arrays out and drops them, which unmaps them
+    for array in arrays.values():
+        array.flush()
+    arrays.clear()
+
+
+def build(directory=None, batch_size=BATCH_SIZE):
+    """
+    Writes a new generation of the cache from the database and makes it
+    current; returns the number of analyses in it.
+    """
+    directory = directory or cache_directory()
+    synced = timezone.now() - SYNC_MARGIN
+    ids = [str(pk) for pk in (ChemicalAnalysis
+                              .objects
+                              .order_by('pk')
+                              .values_list('pk', flat=True))]
+    columns = _columns()
+    capacity = len(ids) + max(MIN_SPARE, int(len(ids) * SPARE_FRACTION))
+
+    generation = timezone.now().strftime('%Y%m%dT%H%M%S%f')
+    os.makedirs(os.path.join(directory, generation))
+    arrays = {
+        name: np.lib.format.open_memmap(
+            _array_path(directory, generation, name), mode='w+',
+            dtype=dtype,
+            shape=(capacity, len(columns)) if per_column else (capacity,))
+        for name, (dtype, per_column) in ARRAYS.items()}
+
+    rows = 0
+    try:
+        for start in range(0, len(ids), batch_size):
+            batch = _read_rows(ids[start:start + batch_size], columns)
+            n = len(batch['ids'])
+            for name, array in arrays.items():
+                array[rows:rows + n] = batch[name]
+            rows += n
+    except _Rebuild:
+        # the columns changed
+        _close(arrays)
+        shutil.rmtree(os.path.join(directory, generation))
+        return build(directory, batch_size)
+    _close(arrays)
+
+    previous = _read_manifest(directory)
+    _write_manifest(directory, {
+        'generation': generation,
+        'rows': rows,
+        'capacity': capacity,
+        'columns': columns,
+        'built': timezone.now().isoformat(),
+        'synced': synced.isoformat(),
+    })
+
+    # keep the previous generation for the workers still mapping it
+    keep = {generation, previous and previous['generation']}
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if os.path.isdir(path) and name not in keep:
+            shutil.rmtree(path, ignore_errors=True)
+    return rows
+
+
+def refresh(directory=None, batch_size=BATCH_SIZE):
+    """
+    Brings the cache up to date, by patching the current generation where
+    possible; returns ('build' or 'patch', number of analyses written).
+    """
+    directory = directory or cache_directory()
+    manifest = _read_manifest(directory)
+    if (manifest is None or
+            timezone.now() - parse_datetime(manifest['built']) > MAX_AGE or
+            _columns() != manifest['columns']):
+        return 'build', build(directory, batch_size)
+
+    synced = timezone.now() - SYNC_MARGIN
+    since = parse_datetime(manifest['synced'])
+    changed = [str(pk) for pk in (ChemicalAnalysis
+                                  .objects
+                                  .filter(composition_updated__gte=since)
+                                  .values_list('pk', flat=True))]
+
+    generation, rows = manifest['generation'], manifest['rows']
+    arrays = {name: np.load(_array_path(directory, generation, name),
+                            mmap_mode='r+')
+              for name in ARRAYS}
+    order = np.argsort(arrays['ids'][:rows])
+    sorted_ids = arrays['ids'][:rows][order]
+
+    written = 0
+    try:
+        for start in range(0, len(changed), batch_size):
+            batch = _read_rows(changed[start:start + batch_size],
+                               manifest['columns'])
+            positions = _lookup(order, sorted_ids, batch['ids'])
+            new = np.flatnonzero(positions < 0)
+            if rows + len(new) > manifest['capacity']:
+                raise _Rebuild()
+            positions[new] = np.arange(rows, rows + len(new))
+            for name, array in arrays.items():
+                array[positions] = batch[name]
+            rows += len(new)
+            written += len(positions)
+    except _Rebuild:
+        # the columns changed or the spare rows ran out
+        _close(arrays)
+        return 'build', build(directory, batch_size)
+    _close(arrays)
+
+    if ChemicalAnalysis.objects.count() != rows:
+        return 'build', build(directory, batch_size)
+
+    manifest.update({'rows': rows, 'synced': synced.isoformat()})
+    _write_manifest(directory, manifest)
+    return 'patch', written
+
+
+class CompositionCache(object):
+    """
+    The current generation of the cache, memory-mapped read-only.
+    """
+
+    def __init__(self, directory, manifest):
+        self.generation = manifest['generation']
+        self.columns = manifest['columns']
+        self.arrays = {name: np.load(_array_path(directory, self.generation,
+                                                 name), mmap_mode='r')
+                       for name in ARRAYS}
+        self.resize(manifest)
+
+    def resize(self, manifest):
+        self.rows = manifest['rows']
+        self.synced = parse_datetime(manifest['synced'])
+        self._order = None
+
+    def _sorted(self):
+        if self._order is None:
+            ids = self.arrays['ids'][:self.rows]
+            self._order = np.argsort(ids)
+            self._sorted_ids = ids[self._order]
+        return self._order, self._sorted_ids
+
+    def rows_of(self, ids):
+        """
+        The rows of the analyses with the given ids that are in the cache.
+        """
+        order, sorted_ids = self._sorted()
+        positions = _lookup(order, sorted_ids, _ids(ids))
+        return positions[positions >= 0]
+
+    def matrix(self, rows, drop_empty=True, detection_limits=False):
+        """
+        The CompositionMatrix of the given rows, in id order, like
+        composition_matrix would return for the same analyses.
+        """
+        rows = np.asarray(rows, dtype=int)
+        ids = self.arrays['ids'][rows]
+        order = np.argsort(ids)
+        rows = rows[order]
+
+        amounts = np.array(self.arrays['amounts'][rows])
+        if detection_limits:
+            amounts[self.arrays['outside'][rows]] = np.nan
+        columns = self.columns
+        if drop_empty and len(columns):
+            keep = ~np.isnan(amounts).all(axis=0)
+            columns = [column for column, k in zip(columns, keep) if k]
+            amounts = amounts[:, keep]
+        return CompositionMatrix(ids[order].astype(str).tolist(), columns,
+                                 amounts)
+
+
+_cache = None
+_cache_stat = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """
+    This process' mapping of the current cache, or None if the cache isn't
+    configured or built, or wasn't refreshed for MAX_AGE.
+    """
+    global _cache, _cache_stat
+    directory = cache_directory()
+    if directory is None:
+        return None
+    try:
+        stat = os.stat(os.path.join(directory, MANIFEST))
+    except OSError:
+        return None
+
+    with _cache_lock:
+        key = (stat.st_mtime_ns, stat.st_size)
+        if key != _cache_stat:
+            manifest = _read_manifest(directory)
+            if manifest is None:
+                return None
+            if (_cache is not None and
+                    _cache.generation == manifest['generation']):
+                _cache.resize(manifest)
+            else:
+                _cache = CompositionCache(directory, manifest)
+            _cache_stat = key
+        if timezone.now() - _cache.synced > MAX_AGE:
+            return None
+        return _cache
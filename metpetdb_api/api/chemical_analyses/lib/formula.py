@@ -0,0 +1,102 @@
+import re
+
+import numpy as np
+
+from apps.chemical_analyses.models import Oxide
+
+
+_OXYGENS_RE = re.compile(r'O(\d*)$')
+
+
+def oxygens_per_oxide(oxide):
+    """
+    The number of oxygens in one formula unit of `oxide`, from its cations
+    and oxidation state or, failing that, from its species (`Al2O3` -> 3).
+    """
+    if oxide.cations_per_oxide and oxide.oxidation_state:
+        return oxide.cations_per_oxide * oxide.oxidation_state / 2
+    match = _OXYGENS_RE.search(oxide.species or '')
+    if match is None:
+        return None
+    return int(match.group(1) or 1)
+
+
+class StructuralFormula(object):
+    """
+    Mineral formulae of a batch of analyses on an oxygen basis, computed
+    with array operations over a CompositionMatrix's oxide columns.
+
+    - `molar_proportions`: moles of each oxide per 100 g of analysis
+    - `cations`: cations of each oxide per formula unit
+    - `total_cations`: the sum of `cations` per analysis
+    - `oxide_total`: the sum of the oxide wt% per analysis
+    - `normalized`: the oxide wt% scaled to a 100% total
+
+    Analyses without any usable oxide get NaN cations and totals.
+    """
+
+    def __init__(self, matrix, oxygens):
+        oxides = Oxide.objects.select_related('element').in_bulk(
+            [column['id'] for column in matrix.columns
+             if column['type'] == 'oxide'])
+        oxides = {str(pk): oxide for pk, oxide in oxides.items()}
+
+        keep, weights, cations, oxygen_counts, columns = [], [], [], [], []
+        for i, column in enumerate(matrix.columns):
+            oxide = oxides.get(column['id'])
+            if oxide is None:
+                continue
+            n_oxygens = oxygens_per_oxide(oxide)
+            if not (oxide.weight and oxide.cations_per_oxide and n_oxygens):
+                continue
+            keep.append(i)
+            weights.append(oxide.weight)
+            cations.append(oxide.cations_per_oxide)
+            oxygen_counts.append(n_oxygens)
+            columns.append({'oxide': oxide.species,
+                            'cation': oxide.element.symbol,
+                            'oxidation_state': oxide.oxidation_state})
+
+        self.ids = matrix.ids
+        self.oxygens = oxygens
+        self.columns = columns
+
+        amounts = np.nan_to_num(matrix.amounts[:, keep])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.molar_proportions = amounts / np.array(weights)
+            oxygen = self.molar_proportions.dot(np.array(oxygen_counts))
+            factor = np.where(oxygen > 0, oxygens / oxygen, np.nan)
+            self.cations = (self.molar_proportions * np.array(cations) *
+                            factor[:, np.newaxis])
+            self.total_cations = self.cations.sum(axis=1)
+            self.oxide_total = np.where(oxygen > 0, amounts.sum(axis=1),
+                                        np.nan)
+            self.normalized = (100 * amounts /
+                               self.oxide_total[:, np.newaxis])
+
+    def to_json(self):
+        def column_lists(array):
+            return [_nullable(array[:, i]) for i in range(array.shape[1])]
+
+        return {
+            'ids': self.ids,
+            'oxygens': self.oxygens,
+            'columns': self.columns,
+            'molar_proportions': column_lists(self.molar_proportions),
+            'cations': column_lists(self.cations),
+            'total_cations': _nullable(self.total_cations),
+            'oxide_total': _nullable(self.oxide_total),
+            'normalized': column_lists(self.normalized),
+        }
+
+
+def _nullable(values):
+    return [None if np.isnan(v) else v for v in values.tolist()]
+
+
+def structural_formula(matrix, oxygens):
+    """
+    Recalculates the analyses of `matrix` (a CompositionMatrix) to cations
+    per formula unit on a basis of `oxygens` oxygens.
+    """
+    return StructuralFormula(matrix, oxygens)
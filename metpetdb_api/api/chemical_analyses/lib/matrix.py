@@ -0,0 +1,202 @@
+import json
+import struct
+
+import numpy as np
+from django.db import connection
+
+from apps.chemical_analyses.arrays import layout
+from apps.chemical_analyses.models import Element, Oxide
+from apps.chemical_analyses.units import (
+    DEFAULT_ELEMENT_UNIT,
+    DEFAULT_OXIDE_UNIT,
+)
+
+
+BATCH_SIZE = 5000
+
+
+class CompositionMatrix(object):
+    """
+    The amounts of a set of chemical analyses as a dense matrix: one row per
+    analysis (`ids`), one column per oxide or element (`columns`), NaN where
+    nothing was measured. Oxides are in wt%, elements in ppm.
+    """
+
+    def __init__(self, ids, columns, amounts):
+        self.ids = ids
+        self.columns = columns
+        self.amounts = amounts
+
+    def column(self, name):
+        for i, column in enumerate(self.columns):
+            if column['name'] == name:
+                return self.amounts[:, i]
+        raise KeyError(name)
+
+    def to_json(self):
+        """
+        Columnar JSON: the amounts of each column in `ids` order, with
+        nulls where nothing was measured.
+        """
+        values = []
+        for i in range(len(self.columns)):
+            column = self.amounts[:, i]
+            values.append([None if np.isnan(v) else v
+                           for v in column.tolist()])
+        return {'ids': self.ids, 'columns': self.columns, 'values': values}
+
+    def to_bytes(self):
+        """
+        A 4-byte little-endian header length, the JSON header (`ids` and
+        `columns`) and the amounts as little-endian float64s, column after
+        column, with NaN where nothing was measured.
+        """
+        header = json.dumps({'ids': self.ids,
+                             'columns': self.columns}).encode('utf-8')
+        data = np.asfortranarray(self.amounts, dtype='<f8').tobytes(order='F')
+        return struct.pack('<I', len(header)) + header + data
+
+
+def _columns():
+    oxides = Oxide.objects.exclude(species=None).order_by('order_id',
+                                                          'species')
+    elements = Element.objects.order_by('order_id', 'name')
+    return ([{'id': str(oxide.pk), 'name': oxide.species, 'type': 'oxide',
+              'unit': DEFAULT_OXIDE_UNIT} for oxide in oxides] +
+            [{'id': str(element.pk), 'name': element.symbol,
+              'type': 'element', 'unit': DEFAULT_ELEMENT_UNIT}
+             for element in elements])
+
+
+# Amounts outside an analysis' [min_amount, max_amount] detection range
+_OUTSIDE_DETECTION = '(amount < min_amount OR amount > max_amount)'
+
+
+def _batch_sql(detection_limits):
+    amount = 'canonical_amount'
+    if detection_limits:
+        amount = 'CASE WHEN {} THEN NULL ELSE {} END'.format(
+            _OUTSIDE_DETECTION, amount)
+    sql = """
+        SELECT chemical_analysis_id,
+               array_agg(column_id),
+               array_agg(amount)
+        FROM (
+            SELECT chemical_analysis_id, oxide_id::text AS column_id,
+                   {0} AS amount
+            FROM chemical_analysis_oxides
+            WHERE chemical_analysis_id = ANY(%s::uuid[])
+            UNION ALL
+            SELECT chemical_analysis_id, element_id::text, {0}
+            FROM chemical_analysis_elements
+            WHERE chemical_analysis_id = ANY(%s::uuid[])
+        ) amounts
+        GROUP BY chemical_analysis_id
+    """.format(amount)
+    return sql
+
+
+_ARRAYS_SQL = """
+    SELECT id, oxide_amounts, element_amounts
+    FROM chemical_analyses
+    WHERE id = ANY(%s::uuid[])
+"""
+
+# Served by the partial indexes of the rows outside their detection limits
+_OUTSIDE_DETECTION_SQL = """
+    SELECT chemical_analysis_id, oxide_id::text
+    FROM chemical_analysis_oxides
+    WHERE chemical_analysis_id = ANY(%s::uuid[])
+    AND {0}
+    UNION ALL
+    SELECT chemical_analysis_id, element_id::text
+    FROM chemical_analysis_elements
+    WHERE chemical_analysis_id = ANY(%s::uuid[])
+    AND {0}
+""".format(_OUTSIDE_DETECTION)
+
+
+def _read_rows(cursor, batch, rows, index, amounts, detection_limits):
+    cursor.execute(_batch_sql(detection_limits), [batch, batch])
+    for analysis_id, column_ids, values in cursor.fetchall():
+        cols, vals = [], []
+        for column_id, value in zip(column_ids, values):
+            # oxides without a species have no column
+            if column_id in index and value is not None:
+                cols.append(index[column_id])
+                vals.append(value)
+        amounts[rows[str(analysis_id)], cols] = vals
+
+
+def _slot_columns(slots, index):
+    # the matrix column of each array position, -1 for none
+    columns = np.full(max(slots, default=0) + 1, -1, dtype=int)
+    for slot, (column_id, name) in slots.items():
+        columns[slot] = index.get(column_id, -1)
+    return columns[1:]
+
+
+def _read_arrays(cursor, batch, rows, index, amounts, detection_limits,
+                 slots):
+    cursor.execute(_ARRAYS_SQL, [batch])
+    for analysis_id, *arrays in cursor.fetchall():
+        row = rows[str(analysis_id)]
+        for values, columns in zip(arrays, slots):
+            if not values:
+                continue
+            n = min(len(values), len(columns))
+            values = np.array(values[:n], dtype=float)
+            keep = (columns[:n] >= 0) & ~np.isnan(values)
+            amounts[row, columns[:n][keep]] = values[keep]
+
+    if detection_limits:
+        cursor.execute(_OUTSIDE_DETECTION_SQL, [batch, batch])
+        for analysis_id, column_id in cursor.fetchall():
+            if column_id in index:
+                amounts[rows[str(analysis_id)], index[column_id]] = np.nan
+
+
+def composition_matrix(qs, batch_size=BATCH_SIZE, drop_empty=True,
+                       detection_limits=False, source=None):
+    """
+    Builds the CompositionMatrix of the analyses in `qs`, in id order,
+    `batch_size` analyses per query. Columns nothing was measured for are
+    left out unless `drop_empty` is False. With `detection_limits`, amounts
+    outside their min_amount/max_amount detection range count as not
+    measured.
+
+    The amounts are read from the analyses' composition arrays (`source`
+    'arrays') when their layout allows, else from the amounts tables
+    ('rows').
+    """
+    slots = layout()
+    if source is None:
+        source = 'rows' if slots is None else 'arrays'
+    if source == 'arrays' and slots is None:
+        raise ValueError('The composition arrays need a distinct order_id '
+                         'for every oxide and element')
+
+    ids = [str(pk) for pk in qs.order_by('pk').values_list('pk', flat=True)]
+    columns = _columns()
+    index = {column['id']: i for i, column in enumerate(columns)}
+    rows = {pk: i for i, pk in enumerate(ids)}
+    amounts = np.full((len(ids), len(columns)), np.nan)
+    if source == 'arrays':
+        slot_columns = [_slot_columns(slots['oxide'], index),
+                        _slot_columns(slots['element'], index)]
+
+    with connection.cursor() as cursor:
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start:start + batch_size]
+            if source == 'arrays':
+                _read_arrays(cursor, batch, rows, index, amounts,
+                             detection_limits, slot_columns)
+            else:
+                _read_rows(cursor, batch, rows, index, amounts,
+                           detection_limits)
+
+    if drop_empty and len(columns):
+        keep = ~np.isnan(amounts).all(axis=0)
+        columns = [column for column, k in zip(columns, keep) if k]
+        amounts = amounts[:, keep]
+    return CompositionMatrix(ids, columns, amounts)
@@ -0,0 +1,179 @@
+"""
+Projection of analyses onto diagram axes, e.g. `SiO2` against
+`Na2O + K2O`, or the `Na2O + K2O`, `FeO`, `MgO` corners of an AFM ternary.
+
+An axis is an arithmetic expression (+, -, *, /, parentheses, numbers) of
+oxide species, in wt%, or of their molar amounts, `mol(Al2O3)`.
+"""
+import ast
+
+import numpy as np
+
+from apps.chemical_analyses.models import Oxide
+
+
+# ast.Num before Python 3.8, ast.Constant since
+_NUMBERS = tuple(getattr(ast, name) for name in ('Num', 'Constant')
+                 if hasattr(ast, name))
+
+# Limits on an axis expression, so that parsing and walking it stays far
+# from the recursion limit
+MAX_LENGTH = 256
+MAX_DEPTH = 32
+
+
+class Axis(object):
+
+    def __init__(self, expression):
+        if len(expression) > MAX_LENGTH:
+            raise ValueError('Axis longer than {} characters'
+                             .format(MAX_LENGTH))
+        try:
+            self.tree = ast.parse(expression, mode='eval').body
+        except (SyntaxError, TypeError, ValueError, RuntimeError,
+                MemoryError):
+            # RuntimeError covers RecursionError, which is Python 3.5+
+            raise ValueError('Invalid axis: {}'.format(expression))
+        self.expression = expression
+        self.species = set()
+        self._check(self.tree, 0)
+
+    def _check(self, node, depth):
+        if depth > MAX_DEPTH:
+            raise ValueError('Axis nested deeper than {} levels: {}'
+                             .format(MAX_DEPTH, self.expression))
+        if isinstance(node, ast.BinOp):
+            if not isinstance(node.op, (ast.Add, ast.Sub, ast.Mult,
+                                        ast.Div)):
+                raise ValueError('Unsupported operator in {}'
+                                 .format(self.expression))
+            self._check(node.left, depth + 1)
+            self._check(node.right, depth + 1)
+        elif isinstance(node, ast.UnaryOp) and isinstance(node.op,
+                                                          ast.USub):
+            self._check(node.operand, depth + 1)
+        elif (isinstance(node, _NUMBERS) and
+              type(ast.literal_eval(node)) in (int, float)):
+            pass
+        elif isinstance(node, ast.Name):
+            self.species.add(node.id)
+        elif (isinstance(node, ast.Call) and
+              isinstance(node.func, ast.Name) and node.func.id == 'mol' and
+              len(node.args) == 1 and isinstance(node.args[0], ast.Name) and
+              not node.keywords):
+            self.species.add(node.args[0].id)
+        else:
+            raise ValueError('Invalid axis: {}'.format(self.expression))
+
+    def evaluate(self, amounts, weights):
+        """
+        Evaluates the axis over whole columns: `amounts` maps species to
+        arrays of wt%, `weights` maps them to their molecular weights.
+        """
+        return self._evaluate(self.tree, amounts, weights)
+
+    def _evaluate(self, node, amounts, weights):
+        if isinstance(node, ast.BinOp):
+            left = self._evaluate(node.left, amounts, weights)
+            right = self._evaluate(node.right, amounts, weights)
+            if isinstance(node.op, ast.Add):
+                return left + right
+            if isinstance(node.op, ast.Sub):
+                return left - right
+            if isinstance(node.op, ast.Mult):
+                return left * right
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return left / right
+        if isinstance(node, ast.UnaryOp):
+            return -self._evaluate(node.operand, amounts, weights)
+        if isinstance(node, _NUMBERS):
+            return float(ast.literal_eval(node))
+        if isinstance(node, ast.Name):
+            return amounts[node.id]
+        species = node.args[0].id
+        if not weights.get(species):
+            raise ValueError('{} has no molecular weight'.format(species))
+        return amounts[species] / weights[species]
+
+
+def project(matrix, expressions, ternary=False):
+    """
+    Returns (ids, coordinates): the analyses of `matrix` (a
+    CompositionMatrix) that any of the axes' oxides were measured for, and
+    one column of coordinates per axis expression, vectorized over all
+    analyses. Oxides that weren't measured count as 0. For a ternary the
+    coordinates are normalized to fractions summing to 1. Points with an
+    undefined coordinate (e.g. a division by zero) are left out.
+    """
+    axes = [Axis(expression) for expression in expressions]
+    species = set.union(*[axis.species for axis in axes])
+
+    columns = {column['name']: i for i, column in enumerate(matrix.columns)
+               if column['type'] == 'oxide'}
+    weights = dict(Oxide.objects.filter(species__in=species)
+                   .values_list('species', 'weight'))
+    unknown = species - set(weights)
+    if unknown:
+        raise ValueError('Unknown oxides: {}'
+                         .format(', '.join(sorted(unknown))))
+
+    n = len(matrix.ids)
+    measured = np.zeros(n, dtype=bool)
+    amounts = {}
+    for name in species:
+        if name in columns:
+            column = matrix.amounts[:, columns[name]]
+            measured |= ~np.isnan(column)
+            amounts[name] = np.nan_to_num(column)
+        else:
+            amounts[name] = np.zeros(n)
+
+    # adding to zeros spreads an axis that is a constant over every row
+    coordinates = np.column_stack([
+        np.zeros(n) + axis.evaluate(amounts, weights)
+        for axis in axes]) if n else np.empty((0, len(axes)))
+    if ternary:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            coordinates = (coordinates /
+                           coordinates.sum(axis=1, keepdims=True))
+
+    keep = measured & np.isfinite(coordinates).all(axis=1)
+    ids = [pk for pk, k in zip(matrix.ids, keep) if k]
+    return ids, coordinates[keep]
+
+
+def decimate(coordinates, max_points, seed=0):
+    """
+    Thins `coordinates` to at most `max_points` rows, preserving density:
+    the points are binned on a grid, every occupied bin keeps at least one
+    point (so outliers survive) and the rest of the budget is shared in
+    proportion to the bins' counts. Returns the indexes of the kept rows
+    and, for each, the number of original points it stands for.
+    """
+    n, dims = coordinates.shape
+    if n <= max_points:
+        return np.arange(n), np.ones(n)
+
+    # at most half the budget goes to the one point every bin keeps
+    per_axis = max(1, int((max_points / 2) ** (1.0 / dims)))
+    low = coordinates.min(axis=0)
+    span = coordinates.max(axis=0) - low
+    span[span == 0] = 1
+    cells = np.minimum((coordinates - low) / span * per_axis,
+                       per_axis - 1).astype(int)
+    bins = np.ravel_multi_index(cells.T, (per_axis,) * dims)
+
+    _, bin_of, counts = np.unique(bins, return_inverse=True,
+                                  return_counts=True)
+    quota = 1 + (counts * (max_points - len(counts)) // n)
+
+    # a random order within each bin, then each bin's first `quota` points
+    order = np.lexsort((np.random.RandomState(seed).rand(n), bin_of))
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    rank = np.empty(n, dtype=int)
+    rank[order] = np.arange(n) - starts[bin_of[order]]
+    kept = np.flatnonzero(rank < quota[bin_of])
+
+    kept_per_bin = np.minimum(quota, counts)
+    weights = counts[bin_of[kept]] / kept_per_bin[bin_of[kept]]
+    return kept, weights
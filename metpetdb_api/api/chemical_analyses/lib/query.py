@@ -1,6 +1,119 @@
 from django.contrib.auth.models import AnonymousUser
 from django.db.models import Q
 
+from apps.chemical_analyses.units import (
+    DEFAULT_ELEMENT_UNIT,
+    DEFAULT_OXIDE_UNIT,
+    MASS_FRACTION_UNITS,
+    convert,
+)
+
+
+# (amounts table, foreign key, subquery resolving a name to ids, default unit)
+OXIDE_AMOUNTS = ('chemical_analysis_oxides', 'oxide_id',
+                 'SELECT id FROM oxides WHERE species = %s',
+                 DEFAULT_OXIDE_UNIT)
+ELEMENT_AMOUNTS = ('chemical_analysis_elements', 'element_id',
+                   'SELECT id FROM elements WHERE name = %s OR symbol = %s',
+                   DEFAULT_ELEMENT_UNIT)
+
+
+def _lookup_params(amounts, name):
+    return [name] * amounts[2].count('%s')
+
+
+def parse_ranges(value, default_unit):
+    """
+    Parses `SiO2:45:52,MgO:8:` into (name, low, high, unit) tuples; either
+    bound may be left out, and a unit may follow as `SiO2:45:52:wt%`.
+    """
+    ranges = []
+    for item in value.split(','):
+        parts = item.split(':')
+        if len(parts) not in (3, 4) or not parts[0]:
+            raise ValueError('Invalid range: {}. Expected name:min:max'
+                             .format(item))
+        unit = parts[3] if len(parts) == 4 and parts[3] else default_unit
+        if unit not in MASS_FRACTION_UNITS:
+            raise ValueError('Unknown measurement unit: {}'.format(unit))
+        try:
+            low, high = [float(bound) if bound else None
+                         for bound in parts[1:3]]
+        except ValueError:
+            raise ValueError('Invalid range: {}'.format(item))
+        ranges.append((parts[0], low, high, unit))
+    return ranges
+
+
+def _amount_in_range(qs, amounts, name, low, high, unit):
+    """
+    Semi-join on (<fk>, canonical_amount) keeping the analyses with an
+    amount of `name` between `low` and `high` `unit`, whatever unit the
+    amount was reported in.
+    """
+    table, fk, lookup, default_unit = amounts
+    params = _lookup_params(amounts, name)
+
+    clauses = []
+    for bound, operator in ((low, '>='), (high, '<=')):
+        if bound is not None:
+            clauses.append('AND a.canonical_amount {} %s'.format(operator))
+            params.append(convert(bound, unit, default_unit))
+
+    return qs.extra(where=["""
+            EXISTS (
+                SELECT 0
+                FROM {table} a
+                WHERE a.chemical_analysis_id = chemical_analyses.id
+                AND a.{fk} IN ({lookup})
+                AND a.canonical_amount IS NOT NULL
+                {clauses}
+            )
+         """.format(table=table, fk=fk, lookup=lookup,
+                    clauses=' '.join(clauses))], params=params)
+
+
+def _order_by_amount(qs, amounts, value):
+    """
+    Orders by the canonical amount of an oxide or element (`FeO`, or `-FeO`
+    for descending); analyses without it go last.
+    """
+    table, fk, lookup, default_unit = amounts
+    descending = value.startswith('-')
+    name = value.lstrip('-')
+
+    select = """
+        COALESCE((
+            SELECT a.canonical_amount
+            FROM {table} a
+            WHERE a.chemical_analysis_id = chemical_analyses.id
+            AND a.{fk} IN ({lookup})
+            LIMIT 1
+        ), '{missing}'::float8)
+    """.format(table=table, fk=fk, lookup=lookup,
+               missing='-Infinity' if descending else 'Infinity')
+    params = _lookup_params(amounts, name)
+
+    return qs.extra(select={'amount_order': select},
+                    select_params=params,
+                    order_by=['-amount_order' if descending
+                              else 'amount_order'])
+
+
+def table_sample(qs, percent):
+    """
+    Restricts `qs` to a repeatable random sample of about `percent`% of the
+    chemical_analyses table's pages.
+    """
+    if not 0 < percent <= 100:
+        raise ValueError('sample_percent must be between 0 and 100')
+    return qs.extra(where=["""
+            chemical_analyses.id IN (
+                SELECT id
+                FROM chemical_analyses TABLESAMPLE SYSTEM (%s) REPEATABLE (0)
+            )
+         """], params=[percent])
+
 
 def chemical_analysis_query(user, params, qs):
     if isinstance(user, AnonymousUser):
@@ -9,7 +122,20 @@ def chemical_analysis_query(user, params, qs):
         qs = qs.filter(Q(owner=user) | Q(public_data=True))
 
     if params.get('minerals'):
-        qs = qs.filter(mineral__name__in=params['minerals'].split(','))
+        minerals = params['minerals'].split(',')
+        if params.get('minerals_expand') == 'True':
+            # also match the minerals' group members and synonyms
+            qs = qs.extra(where=["""
+                    chemical_analyses.mineral_id IN (
+                        SELECT mc.descendant_id
+                        FROM mineral_closure mc
+                        INNER JOIN minerals m
+                        ON mc.ancestor_id = m.id
+                        WHERE m.name = ANY(%s)
+                    )
+                 """], params=[minerals])
+        else:
+            qs = qs.filter(mineral__name__in=minerals)
 
     if params.get('elements'):
         elements = params['elements'].split(',')
@@ -45,6 +171,32 @@ def chemical_analysis_query(user, params, qs):
         else:
             qs = qs.filter(oxides__species__in=params['oxides'].split(','))
 
+    if params.get('oxide_ranges'):
+        for name, low, high, unit in parse_ranges(params['oxide_ranges'],
+                                                  DEFAULT_OXIDE_UNIT):
+            qs = _amount_in_range(qs, OXIDE_AMOUNTS, name, low, high, unit)
+
+    if params.get('element_ranges'):
+        for name, low, high, unit in parse_ranges(params['element_ranges'],
+                                                  DEFAULT_ELEMENT_UNIT):
+            qs = _amount_in_range(qs, ELEMENT_AMOUNTS, name, low, high, unit)
+
+    if params.get('oxide_order'):
+        qs = _order_by_amount(qs, OXIDE_AMOUNTS, params['oxide_order'])
+    elif params.get('element_order'):
+        qs = _order_by_amount(qs, ELEMENT_AMOUNTS, params['element_order'])
+
+    if params.get('suggested_minerals'):
+        qs = qs.filter(suggested_mineral__name__in=(
+            params['suggested_minerals'].split(',')))
+
+    if params.get('min_suggestion_confidence'):
+        qs = qs.filter(suggested_mineral_confidence__gte=float(
+            params['min_suggestion_confidence']))
+
+    if params.get('good_totals') == 'True':
+        qs = qs.filter(total_ok=True)
+
     if params.get('subsample_ids'):
         qs = qs.filter(subsample_id__in=params.get('subsample_ids').split(','))
 
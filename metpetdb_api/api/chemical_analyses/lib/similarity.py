@@ -0,0 +1,247 @@
+"""
+Nearest-neighbour search over the oxide compositions of all chemical
+analyses.
+
+Each process keeps an index per distance metric: a k-d tree over the
+compositions as they were when it was built, plus a small brute-force
+buffer of analyses whose composition changed since (found through
+ChemicalAnalysis.composition_updated). A background thread brings the
+indexes up to date every SIMILARITY_INDEX_REFRESH_SECONDS, rebuilding the
+tree once the buffer grows past a fraction of it and at least every
+MAX_AGE. It never changes an index requests may be reading: it builds a new
+one and swaps it in, so requests never wait for a build.
+"""
+import copy
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from scipy.spatial import cKDTree
+
+from api.chemical_analyses.lib.cache import get_cache
+from api.chemical_analyses.lib.matrix import composition_matrix
+from apps.chemical_analyses.models import ChemicalAnalysis
+
+
+logger = logging.getLogger(__name__)
+
+METRICS = ('euclidean', 'logratio')
+
+# Amounts below this (wt%) are replaced by it before taking logarithms
+LOG_FLOOR = 0.01
+
+# Rebuild the tree once this fraction of it has changed
+REBUILD_FRACTION = 0.1
+
+# Rebuild from scratch after this long anyway, to pick up analyses loaded
+# without going through the API (bulk loads, the synthetic data generator)
+MAX_AGE = timedelta(hours=1)
+
+# Changes are looked for this far back before the last sync, so writes
+# committed after it with an earlier composition_updated aren't missed
+SYNC_MARGIN = timedelta(minutes=1)
+
+
+def transform(amounts, metric):
+    """
+    Maps oxide amounts (rows of wt%, NaN where not measured) to the space
+    `metric` is Euclidean in: wt% normalized to a 100% total, or their
+    centred log-ratios. Rows without any oxide become NaN.
+    """
+    amounts = np.clip(np.nan_to_num(amounts), 0, None)
+    total = amounts.sum(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vectors = np.where(total > 0, 100 * amounts / total, np.nan)
+    if metric == 'logratio':
+        vectors = np.log(np.maximum(vectors, LOG_FLOOR))
+        vectors -= vectors.mean(axis=1, keepdims=True)
+    return vectors
+
+
+class IndexNotReady(Exception):
+    pass
+
+
+class SimilarityIndex(object):
+    """
+    The index of one metric. Once built it is only read; synced() returns a
+    new index with the changes since.
+    """
+
+    def __init__(self, metric):
+        if metric not in METRICS:
+            raise ValueError('Unknown metric: {}'.format(metric))
+        self.metric = metric
+        self.synced_at = None
+
+    def _vectors(self, matrix):
+        oxides = [i for i, column in enumerate(matrix.columns)
+                  if column['type'] == 'oxide']
+        vectors = transform(matrix.amounts[:, oxides], self.metric)
+        usable = ~np.isnan(vectors).any(axis=1)
+        ids = [pk for pk, ok in zip(matrix.ids, usable) if ok]
+        return ([matrix.columns[i]['id'] for i in oxides], ids,
+                vectors[usable])
+
+    def build(self):
+        self.built = timezone.now()
+        synced_at = self.built - SYNC_MARGIN
+        cache = get_cache()
+        if cache is not None:
+            # start from the composition cache and sync what changed since
+            synced_at = cache.synced
+            matrix = cache.matrix(np.arange(cache.rows), drop_empty=False)
+        else:
+            matrix = composition_matrix(ChemicalAnalysis.objects.all(),
+                                        drop_empty=False)
+        self.columns, self.ids, vectors = self._vectors(matrix)
+        self.tree = cKDTree(vectors) if len(self.ids) else None
+        self.live = np.ones(len(self.ids), dtype=bool)
+        self.position = {pk: i for i, pk in enumerate(self.ids)}
+        self.buffer_ids = []
+        self.buffer = np.empty((0, len(self.columns)))
+        self.synced_at = synced_at
+        return self
+
+    def synced(self):
+        """
+        A new index with the analyses changed since this one was synced
+        moved into the buffer, or rebuilt if too many changed.
+        """
+        synced_at = timezone.now() - SYNC_MARGIN
+        changed = (ChemicalAnalysis
+                   .objects
+                   .filter(composition_updated__gte=self.synced_at))
+        if not changed.exists():
+            index = copy.copy(self)
+            index.synced_at = synced_at
+            return index
+        columns, ids, vectors = self._vectors(
+            composition_matrix(changed, drop_empty=False))
+        if columns != self.columns:
+            # an oxide was added or removed
+            return SimilarityIndex(self.metric).build()
+
+        # the tree, ids and positions are shared with this index, and
+        # never written to after build()
+        index = copy.copy(self)
+        index.live = self.live.copy()
+        changed_ids = set(str(pk) for pk in changed.values_list('pk',
+                                                                 flat=True))
+        for pk in changed_ids:
+            if pk in index.position:
+                index.live[index.position[pk]] = False
+        keep = [i for i, pk in enumerate(self.buffer_ids)
+                if pk not in changed_ids]
+        index.buffer_ids = [self.buffer_ids[i] for i in keep] + ids
+        index.buffer = np.vstack([self.buffer[keep], vectors])
+        index.synced_at = synced_at
+
+        if len(index.buffer_ids) > REBUILD_FRACTION * max(len(self.ids),
+                                                          1000):
+            return SimilarityIndex(self.metric).build()
+        return index
+
+    def vector(self, amounts):
+        """
+        The position of a composition, given as a vector of wt% in the
+        order of `self.columns`; raises a ValueError if it has no oxides.
+        """
+        vector = transform(np.array([amounts], dtype=float), self.metric)[0]
+        if np.isnan(vector).any():
+            raise ValueError('The composition has no oxides')
+        return vector
+
+    def query(self, vector, k):
+        """
+        Returns up to `k` (id, distance) pairs nearest to `vector`, closest
+        first.
+        """
+        results = []
+        if self.tree is not None:
+            n = min(k + (~self.live).sum(), len(self.ids))
+            distances, indexes = self.tree.query(vector, k=n)
+            for distance, i in zip(np.atleast_1d(distances),
+                                   np.atleast_1d(indexes)):
+                if i < len(self.ids) and self.live[i]:
+                    results.append((self.ids[i], float(distance)))
+        if self.buffer_ids:
+            distances = np.sqrt(((self.buffer - vector) ** 2).sum(axis=1))
+            results.extend(zip(self.buffer_ids, distances.tolist()))
+        results.sort(key=lambda result: result[1])
+        return results[:k]
+
+
+# The current index of every metric; entries are only ever replaced whole
+_indexes = {}
+
+_refresher = None
+_refresher_pid = None
+_refresher_lock = threading.Lock()
+
+
+def refresh_indexes():
+    """
+    Builds the index of every metric, or brings it up to date, and swaps
+    the new one in.
+    """
+    for metric in METRICS:
+        index = _indexes.get(metric)
+        if index is None or timezone.now() - index.built > MAX_AGE:
+            _indexes[metric] = SimilarityIndex(metric).build()
+        else:
+            _indexes[metric] = index.synced()
+
+
+def _refresh_forever(interval):
+    while True:
+        try:
+            refresh_indexes()
+        except Exception:
+            logger.exception('Unable to refresh the similarity indexes')
+        finally:
+            # this thread's own connection; don't keep it open in between
+            connection.close()
+        time.sleep(interval)
+
+
+def start_refreshing():
+    """
+    Starts this process' background refresher, unless it is running or
+    SIMILARITY_INDEX_REFRESH_SECONDS is 0.
+    """
+    global _refresher, _refresher_pid
+    interval = getattr(settings, 'SIMILARITY_INDEX_REFRESH_SECONDS', 30)
+    if not interval:
+        return
+    with _refresher_lock:
+        # a forked worker doesn't inherit its parent's thread
+        if (_refresher is not None and _refresher_pid == os.getpid() and
+                _refresher.is_alive()):
+            return
+        _refresher_pid = os.getpid()
+        _refresher = threading.Thread(target=_refresh_forever,
+                                      args=(interval,),
+                                      name='similarity-index',
+                                      daemon=True)
+        _refresher.start()
+
+
+def get_index(metric):
+    """
+    This process' current index for `metric`. Raises IndexNotReady while
+    the refresher is building the first one.
+    """
+    if metric not in METRICS:
+        raise ValueError('Unknown metric: {}'.format(metric))
+    start_refreshing()
+    index = _indexes.get(metric)
+    if index is None:
+        raise IndexNotReady('The similarity index is still being built')
+    return index
@@ -0,0 +1,71 @@
+import numpy as np
+
+
+DEFAULT_PERCENTILES = (5, 25, 50, 75, 95)
+
+
+def _value(value):
+    value = float(value)
+    return None if np.isnan(value) else value
+
+
+def correlation(amounts):
+    """
+    Pearson correlation of every pair of columns of `amounts`, over the
+    rows where both were measured; NaN for pairs with fewer than 3 such
+    rows or without variance.
+    """
+    measured = ~np.isnan(amounts)
+    values = np.nan_to_num(amounts)
+    n_columns = amounts.shape[1]
+    result = np.full((n_columns, n_columns), np.nan)
+    for i in range(n_columns):
+        both = measured[:, i:i + 1] & measured[:, i:]
+        n = both.sum(axis=0)
+        x = np.where(both, values[:, i:i + 1], 0)
+        y = np.where(both, values[:, i:], 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean_x = x.sum(axis=0) / n
+            mean_y = y.sum(axis=0) / n
+            dx = np.where(both, x - mean_x, 0)
+            dy = np.where(both, y - mean_y, 0)
+            r = ((dx * dy).sum(axis=0) /
+                 np.sqrt((dx ** 2).sum(axis=0) * (dy ** 2).sum(axis=0)))
+        r[n < 3] = np.nan
+        result[i, i:] = r
+        result[i:, i] = r
+    return result
+
+
+def composition_stats(matrix, percentiles=DEFAULT_PERCENTILES):
+    """
+    Per-column summary statistics and the correlation matrix of a
+    CompositionMatrix, ignoring amounts that weren't measured.
+    """
+    amounts = matrix.amounts
+    columns = []
+    for i, column in enumerate(matrix.columns):
+        values = amounts[:, i]
+        values = values[~np.isnan(values)]
+        stats = dict(column, count=len(values))
+        if len(values):
+            stats.update({
+                'mean': _value(values.mean()),
+                'std': _value(values.std(ddof=1)) if len(values) > 1
+                else None,
+                'min': _value(values.min()),
+                'max': _value(values.max()),
+                'median': _value(np.median(values)),
+                # keyed like `5` and `97.5`, however they were parsed
+                'percentiles': {
+                    '{:g}'.format(p): _value(v) for p, v in
+                    zip(percentiles, np.percentile(values, percentiles))},
+            })
+        columns.append(stats)
+
+    return {
+        'count': len(matrix.ids),
+        'columns': columns,
+        'correlation': [[_value(v) for v in row]
+                        for row in correlation(amounts)],
+    }
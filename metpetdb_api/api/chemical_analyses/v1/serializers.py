@@ -3,6 +3,7 @@ from rest_framework import serializers
 from api.lib.serializers import DynamicFieldsModelSerializer
 from api.samples.v1.serializers import MineralSerializer
 from api.users.v1.serializers import UserSerializer
+from apps.chemical_analyses.arrays import layout
 from apps.chemical_analyses.models import (
     ChemicalAnalysis,
     ChemicalAnalysisElement,
@@ -58,6 +59,7 @@ class ChemicalAnalysisOxideSerializer(DynamicFieldsModelSerializer):
 
 class ChemicalAnalysisSerializer(DynamicFieldsModelSerializer):
     mineral = MineralSerializer(read_only=True)
+    suggested_mineral = MineralSerializer(read_only=True)
     owner = UserSerializer(read_only=True)
     elements = ChemicalAnalysisElementSerializer(
         many=True,
@@ -70,9 +72,31 @@ class ChemicalAnalysisSerializer(DynamicFieldsModelSerializer):
         required=False
     )
 
+    # Only with ?include=composition: the canonical amounts (oxides in wt%,
+    # elements in ppm) and precisions by species/symbol, read from the
+    # composition arrays rather than the amounts tables
+    composition = serializers.SerializerMethodField()
+
     class Meta:
         model = ChemicalAnalysis
         depth = 1
+        read_only_fields = ('computed_total', 'total_ok',
+                            'composition_updated',
+                            'suggested_mineral_confidence')
+        exclude = ('oxide_amounts', 'oxide_precisions', 'element_amounts',
+                   'element_precisions')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        try:
+            include = self.context['request'].query_params.get('include')
+        except KeyError:
+            include = None
+        if 'composition' in (include or '').split(','):
+            self._layout = layout()
+        else:
+            self.fields.pop('composition', None)
 
     def is_valid(self, raise_exception=False):
         super().is_valid(raise_exception)
@@ -97,6 +121,30 @@ class ChemicalAnalysisSerializer(DynamicFieldsModelSerializer):
 
         return not bool(self._errors)
 
+    def get_composition(self, obj):
+        composition = {}
+        if self._layout is None:
+            for record in obj.chemicalanalysisoxide_set.all():
+                composition[record.oxide.species] = {
+                    'amount': record.canonical_amount,
+                    'precision': record.precision}
+            for record in obj.chemicalanalysiselement_set.all():
+                composition[record.element.symbol] = {
+                    'amount': record.canonical_amount,
+                    'precision': record.precision}
+            return composition
+
+        for prefix in ('oxide', 'element'):
+            amounts = getattr(obj, prefix + '_amounts') or []
+            precisions = getattr(obj, prefix + '_precisions') or []
+            for i, (amount, precision) in enumerate(zip(amounts,
+                                                        precisions)):
+                slot = self._layout[prefix].get(i + 1)
+                if slot is not None and amount is not None:
+                    composition[slot[1]] = {'amount': amount,
+                                            'precision': precision}
+        return composition
+
     def create(self, validated_data):
         if validated_data.get('chemicalanalysiselement_set'):
             del validated_data['chemicalanalysiselement_set']
@@ -0,0 +1,638 @@
+import json
+import shutil
+import struct
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+import numpy as np
+
+from django.contrib.gis.geos import Point
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient, APITestCase
+
+from api.chemical_analyses.lib import cache, similarity
+from api.chemical_analyses.lib.matrix import composition_matrix
+from apps.chemical_analyses import (
+    arrays,
+    canonical,
+    classification,
+    summaries,
+)
+from apps.chemical_analyses.models import (
+    ChemicalAnalysis,
+    ChemicalAnalysisOxide,
+    Element,
+    Oxide,
+)
+from apps.chemical_analyses.signals import composition_changed
+from apps.monitoring import metrics
+from apps.samples.models import (
+    Mineral,
+    MineralType,
+    RockType,
+    Sample,
+    Subsample,
+    SubsampleType,
+)
+from apps.users.models import User
+
+
+class ChemicalAnalysisAmountTests(APITestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user(email='owner@metpetdb.com',
+                                              password='owner',
+                                              is_active=True)
+        sample = Sample.objects.create(
+            number='s1',
+            public_data=True,
+            owner=self.owner,
+            rock_type=RockType.objects.create(name='Schist'),
+            location_coords=Point(-73.5, 43.5, srid=4326))
+        subsample = Subsample.objects.create(
+            name='s1a',
+            sample=sample,
+            public_data=True,
+            owner=self.owner,
+            subsample_type=SubsampleType.objects.create(name='Thin section'))
+
+        silicon = Element.objects.create(name='Silicon', symbol='Si',
+                                         atomic_number=14)
+        magnesium = Element.objects.create(name='Magnesium', symbol='Mg',
+                                           atomic_number=12)
+        self.sio2 = Oxide.objects.create(element=silicon, species='SiO2',
+                                         conversion_factor=1)
+        self.mgo = Oxide.objects.create(element=magnesium, species='MgO',
+                                        conversion_factor=1)
+
+        # (SiO2, MgO, unit)
+        compositions = {
+            'basalt': (48.0, 9.0, 'wt%'),
+            'andesite': (58.0, 4.0, 'wt%'),
+            'picrite': (46.0, 18.0, None),
+            'ppm basalt': (500000.0, 85000.0, 'ppm'),
+        }
+        self.analyses = {}
+        for i, (name, (sio2, mgo, unit)) in enumerate(compositions.items()):
+            analysis = ChemicalAnalysis.objects.create(subsample=subsample,
+                                                       public_data=True,
+                                                       owner=self.owner,
+                                                       description=name,
+                                                       spot_id=i)
+            ChemicalAnalysisOxide.objects.create(chemical_analysis=analysis,
+                                                 oxide=self.sio2,
+                                                 amount=sio2,
+                                                 measurement_unit=unit)
+            if name != 'andesite':
+                ChemicalAnalysisOxide.objects.create(
+                    chemical_analysis=analysis,
+                    oxide=self.mgo,
+                    amount=mgo,
+                    measurement_unit=unit)
+            self.analyses[name] = analysis
+
+    def _descriptions(self, query):
+        res = APIClient().get('/api/chemical_analyses/?' + query)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return [result['description'] for result
+                in json.loads(res.content.decode('utf-8'))['results']]
+
+
+    def test_oxide_ranges_are_unit_aware(self):
+        descriptions = self._descriptions('oxide_ranges=SiO2:45:52,MgO:8:')
+        self.assertEqual(set(descriptions),
+                         {'basalt', 'picrite', 'ppm basalt'})
+
+        descriptions = self._descriptions(
+            'oxide_ranges=SiO2:450000:520000:ppm,MgO::10')
+        self.assertEqual(set(descriptions), {'basalt', 'ppm basalt'})
+
+
+    def test_invalid_range_is_rejected(self):
+        res = APIClient().get('/api/chemical_analyses/?oxide_ranges=SiO2:a:b')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+    def test_order_by_oxide_amount(self):
+        self.assertEqual(self._descriptions('oxide_order=-MgO'),
+                         ['picrite', 'basalt', 'ppm basalt', 'andesite'])
+        self.assertEqual(self._descriptions('oxide_order=MgO'),
+                         ['ppm basalt', 'basalt', 'picrite', 'andesite'])
+
+
+    def test_matrix(self):
+        res = APIClient().get('/api/chemical_analyses/matrix/')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        matrix = json.loads(res.content.decode('utf-8'))
+
+        self.assertEqual([column['name'] for column in matrix['columns']],
+                         ['MgO', 'SiO2'])
+        rows = {str(analysis.pk): name
+                for name, analysis in self.analyses.items()}
+        amounts = {rows[pk]: (mgo, sio2) for pk, mgo, sio2
+                   in zip(matrix['ids'], *matrix['values'])}
+        self.assertEqual(amounts['andesite'], (None, 58.0))
+        self.assertAlmostEqual(amounts['ppm basalt'][0], 8.5)
+        self.assertAlmostEqual(amounts['ppm basalt'][1], 50.0)
+
+
+    @override_settings(CHEMICAL_ANALYSIS_MATRIX_MAX_ROWS=3)
+    def test_matrix_row_limit(self):
+        res = APIClient().get('/api/chemical_analyses/matrix/')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        res = APIClient().get('/api/chemical_analyses/structural_formula/'
+                              '?oxygens=6')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        res = APIClient().get('/api/chemical_analyses/matrix/'
+                              '?oxide_ranges=SiO2:45:52')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            len(json.loads(res.content.decode('utf-8'))['ids']), 3)
+
+
+    def test_binary_matrix(self):
+        res = APIClient().get('/api/chemical_analyses/matrix/'
+                              '?oxide_ranges=SiO2:45:52&binary=True')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        length, = struct.unpack('<I', res.content[:4])
+        header = json.loads(res.content[4:4 + length].decode('utf-8'))
+        amounts = np.frombuffer(res.content[4 + length:], dtype='<f8')
+        amounts = amounts.reshape((len(header['ids']),
+                                   len(header['columns'])), order='F')
+
+        self.assertEqual(len(header['ids']), 3)
+        sio2 = [column['name'] for column in header['columns']].index('SiO2')
+        self.assertTrue(((amounts[:, sio2] >= 45) &
+                         (amounts[:, sio2] <= 52)).all())
+
+
+    def test_structural_formula(self):
+        Oxide.objects.filter(pk=self.sio2.pk).update(
+            weight=60.084, cations_per_oxide=1, oxidation_state=4)
+        Oxide.objects.filter(pk=self.mgo.pk).update(
+            weight=40.304, cations_per_oxide=1, oxidation_state=2)
+
+        res = APIClient().get('/api/chemical_analyses/structural_formula/'
+                              '?oxygens=4')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        formula = json.loads(res.content.decode('utf-8'))
+
+        charges = [column['oxidation_state'] for column in formula['columns']]
+        for i in range(len(formula['ids'])):
+            # the cations' charges balance the oxygens'
+            charge = sum(cations[i] * charge for cations, charge
+                         in zip(formula['cations'], charges))
+            self.assertAlmostEqual(charge, 8)
+
+        res = APIClient().get('/api/chemical_analyses/structural_formula/')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+    def test_totals_are_computed_on_write(self):
+        client = APIClient()
+        client.credentials(
+            HTTP_AUTHORIZATION='Token ' + self.owner.auth_token.key)
+        subsample = self.analyses['basalt'].subsample
+
+        ids = {}
+        for name, (sio2, mgo) in (('good', (55.0, 44.5)),
+                                  ('bad', (50.0, 40.0))):
+            res = client.post('/api/chemical_analyses/', {
+                'spot_id': 100,
+                'description': name,
+                'owner': str(self.owner.pk),
+                'subsample_id': str(subsample.pk),
+                'oxides': [
+                    {'id': str(oxide.pk), 'amount': amount,
+                     'precision': None, 'precision_type': None,
+                     'measurement_unit': 'wt%', 'min_amount': None,
+                     'max_amount': None}
+                    for oxide, amount in ((self.sio2, sio2),
+                                          (self.mgo, mgo))
+                ],
+            })
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+            ids[name] = res.data['id']
+
+        good = ChemicalAnalysis.objects.get(pk=ids['good'])
+        self.assertAlmostEqual(good.computed_total, 99.5)
+        self.assertTrue(good.total_ok)
+        self.assertFalse(ChemicalAnalysis.objects.get(pk=ids['bad']).total_ok)
+
+        self.assertEqual(self._descriptions('good_totals=True'), ['good'])
+
+
+    def test_rejected_writes_leave_nothing_behind(self):
+        client = APIClient()
+        client.credentials(
+            HTTP_AUTHORIZATION='Token ' + self.owner.auth_token.key)
+        oxides = [
+            {'id': str(oxide_id), 'amount': 50.0, 'precision': None,
+             'precision_type': None, 'measurement_unit': 'wt%',
+             'min_amount': None, 'max_amount': None}
+            for oxide_id in (self.sio2.pk, 'not-an-oxide')
+        ]
+        count = ChemicalAnalysis.objects.count()
+
+        res = client.post('/api/chemical_analyses/', {
+            'spot_id': 100,
+            'description': 'rejected',
+            'owner': str(self.owner.pk),
+            'subsample_id': str(self.analyses['basalt'].subsample_id),
+            'oxides': oxides,
+        })
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(ChemicalAnalysis.objects.count(), count)
+
+        analysis = self.analyses['basalt']
+        res = client.put(
+            '/api/chemical_analyses/{}/'.format(analysis.pk),
+            {'description': 'rejected', 'oxides': oxides}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        analysis.refresh_from_db()
+        self.assertEqual(analysis.description, 'basalt')
+        self.assertTrue(analysis.chemicalanalysisoxide_set.exists())
+
+
+    def test_stats_respect_detection_limits(self):
+        ChemicalAnalysisOxide.objects.filter(
+            chemical_analysis=self.analyses['basalt'],
+            oxide=self.sio2).update(min_amount=49)
+
+        res = APIClient().get('/api/chemical_analyses/stats/'
+                              '?percentiles=50')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        stats = json.loads(res.content.decode('utf-8'))
+
+        names = [column['name'] for column in stats['columns']]
+        sio2 = stats['columns'][names.index('SiO2')]
+        self.assertEqual(sio2['count'], 3)
+        self.assertAlmostEqual(sio2['mean'], (58 + 46 + 50) / 3)
+        self.assertAlmostEqual(sio2['percentiles']['50'], 50)
+        self.assertEqual(len(stats['correlation']), len(names))
+        self.assertAlmostEqual(stats['correlation'][0][0], 1)
+
+        for query, keys in (('', ['25', '5', '50', '75', '95']),
+                            ('?percentiles=5,97.5', ['5', '97.5'])):
+            res = APIClient().get('/api/chemical_analyses/stats/' + query)
+            stats = json.loads(res.content.decode('utf-8'))
+            self.assertEqual(sorted(stats['columns'][0]['percentiles']),
+                             keys)
+
+
+    @override_settings(SIMILARITY_INDEX_REFRESH_SECONDS=0)
+    def test_similar_analyses(self):
+        similarity._indexes.clear()
+        res = APIClient().get('/api/chemical_analyses/similar/'
+                              '?composition=SiO2:100')
+        self.assertEqual(res.status_code,
+                         status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        similarity.refresh_indexes()
+        index = similarity.get_index('euclidean')
+        res = APIClient().get(
+            '/api/chemical_analyses/similar/?k=2&id={}'.format(
+                self.analyses['basalt'].pk))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [result['chemical_analysis']['description'] for result
+             in json.loads(res.content.decode('utf-8'))],
+            ['ppm basalt', 'picrite'])
+
+        res = APIClient().get('/api/chemical_analyses/similar/'
+                              '?k=1&metric=logratio&composition=SiO2:100')
+        self.assertEqual(
+            json.loads(res.content.decode('utf-8'))[0]
+            ['chemical_analysis']['description'], 'andesite')
+
+        # a sync swaps in a new index and leaves the one in use alone
+        composition_changed.send(sender=ChemicalAnalysis,
+                                 chemical_analysis_ids=[
+                                     self.analyses['andesite'].pk])
+        similarity.refresh_indexes()
+        self.assertIsNot(similarity.get_index('euclidean'), index)
+        self.assertTrue(index.live.all())
+        self.assertEqual(similarity.get_index('euclidean').buffer_ids,
+                         [str(self.analyses['andesite'].pk)])
+
+
+    def test_projection(self):
+        Oxide.objects.filter(pk=self.sio2.pk).update(weight=60.084)
+        Oxide.objects.filter(pk=self.mgo.pk).update(weight=40.304)
+
+        res = APIClient().get('/api/chemical_analyses/projection/',
+                              {'x': 'SiO2', 'y': 'mol(MgO) / mol(SiO2)'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        projection = json.loads(res.content.decode('utf-8'))
+        self.assertEqual(projection['count'], 4)
+        points = {pk: (x, y) for pk, x, y in
+                  zip(projection['ids'], projection['coordinates']['x'],
+                      projection['coordinates']['y'])}
+        x, y = points[str(self.analyses['basalt'].pk)]
+        self.assertAlmostEqual(x, 48)
+        self.assertAlmostEqual(y, (9 / 40.304) / (48 / 60.084))
+        self.assertEqual(points[str(self.analyses['andesite'].pk)][1], 0)
+
+        res = APIClient().get('/api/chemical_analyses/projection/',
+                              {'x': 'SiO2', 'y': '1'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            json.loads(res.content.decode('utf-8'))['coordinates']['y'],
+            [1.0] * 4)
+
+        res = APIClient().get('/api/chemical_analyses/projection/',
+                              {'a': 'SiO2', 'b': 'MgO', 'c': 'MgO',
+                               'max_points': 2})
+        projection = json.loads(res.content.decode('utf-8'))
+        self.assertEqual(projection['count'], 4)
+        self.assertEqual(len(projection['ids']), 2)
+        self.assertEqual(sum(projection['weights']), 4)
+        for a, b, c in zip(*[projection['coordinates'][name]
+                             for name in 'abc']):
+            self.assertAlmostEqual(a + b + c, 1)
+
+        res = APIClient().get('/api/chemical_analyses/projection/',
+                              {'x': 'SiO2', 'y': 'Foo2O'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        res = APIClient().get('/api/chemical_analyses/projection/',
+                              {'x': 'SiO2', 'y': '__import__("os")'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        for y in ('-' * 1000 + 'SiO2', '+'.join(['SiO2'] * 50000),
+                  '-' * 200 + 'SiO2', '+'.join(['SiO2'] * 40)):
+            res = APIClient().get('/api/chemical_analyses/projection/',
+                                  {'x': 'SiO2', 'y': y})
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+    def test_composition_summaries(self):
+        client = APIClient()
+        client.credentials(
+            HTTP_AUTHORIZATION='Token ' + self.owner.auth_token.key)
+        garnet = Mineral.objects.create(name='Garnet')
+        for name in ('basalt', 'ppm basalt'):
+            res = client.put(
+                '/api/chemical_analyses/{}/'.format(self.analyses[name].pk),
+                {'mineral_id': str(garnet.pk)}, format='json')
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        res = APIClient().get('/api/samples/?include=composition_summary')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        summary = {row['oxide']: row for row in json.loads(
+            res.content.decode('utf-8'))['results'][0]['composition_summary']}
+        self.assertEqual(summary['MgO']['mineral'], 'Garnet')
+        self.assertEqual(summary['MgO']['count'], 2)
+        self.assertAlmostEqual(summary['MgO']['mean'], 8.75)
+        self.assertAlmostEqual(summary['SiO2']['mean'], 49)
+
+        def count(query):
+            res = APIClient().get('/api/samples/?' + query)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            return json.loads(res.content.decode('utf-8'))['count']
+
+        self.assertEqual(count('composition_ranges=Garnet:MgO:8:9'), 1)
+        self.assertEqual(count('composition_ranges=Garnet:MgO:9:'), 0)
+        self.assertEqual(
+            count('composition_ranges=Garnet:MgO:80000:90000:ppm'), 1)
+
+        self.analyses['basalt'].delete()
+        res = APIClient().get('/api/samples/?include=composition_summary')
+        summary = {row['oxide']: row for row in json.loads(
+            res.content.decode('utf-8'))['results'][0]['composition_summary']}
+        self.assertEqual(summary['MgO']['count'], 1)
+        self.assertIsNone(summary['MgO']['stddev'])
+
+        res = client.put(
+            '/api/chemical_analyses/{}/'.format(
+                self.analyses['ppm basalt'].pk),
+            {'public_data': False}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        res = APIClient().get('/api/samples/?include=composition_summary')
+        self.assertEqual(json.loads(res.content.decode('utf-8'))
+                         ['results'][0]['composition_summary'], [])
+        self.assertEqual(count('composition_ranges=Garnet:MgO::'), 0)
+
+        # concurrent writes to the sample's analyses wait for each other
+        with CaptureQueriesContext(connection) as queries:
+            summaries.refresh_samples([self.analyses['basalt']
+                                       .subsample.sample_id])
+        self.assertIn('FOR UPDATE', queries[0]['sql'])
+
+
+    def test_canonical_amounts(self):
+        self.assertAlmostEqual(
+            ChemicalAnalysisOxide.objects.get(
+                chemical_analysis=self.analyses['ppm basalt'],
+                oxide=self.sio2).canonical_amount, 50)
+
+        self.mgo.weight = 40.0
+        self.mgo.save()
+        andesite_mgo = ChemicalAnalysisOxide.objects.create(
+            chemical_analysis=self.analyses['andesite'], oxide=self.mgo,
+            amount=2000, measurement_unit='umol')
+        self.assertAlmostEqual(andesite_mgo.canonical_amount, 8)
+
+        # a new molecular weight converts the molar amounts again
+        self.mgo.weight = 40.304
+        self.mgo.save()
+        andesite_mgo.refresh_from_db()
+        self.assertAlmostEqual(andesite_mgo.canonical_amount, 8.0608)
+        self.assertEqual(self._descriptions('oxide_ranges=MgO:8:8.1'),
+                         ['andesite'])
+
+        # an empty unit is the default one, in SQL as in Python
+        picrite_mgo = ChemicalAnalysisOxide.objects.get(
+            chemical_analysis=self.analyses['picrite'], oxide=self.mgo)
+        picrite_mgo.measurement_unit = ''
+        picrite_mgo.save()
+        self.assertAlmostEqual(picrite_mgo.canonical_amount, 18)
+        ChemicalAnalysisOxide.objects.filter(pk=picrite_mgo.pk).update(
+            canonical_amount=None)
+        canonical.backfill()
+        picrite_mgo.refresh_from_db()
+        self.assertAlmostEqual(picrite_mgo.canonical_amount, 18)
+
+
+    def test_composition_arrays(self):
+        Oxide.objects.filter(pk=self.sio2.pk).update(order_id=1)
+        Oxide.objects.filter(pk=self.mgo.pk).update(order_id=2)
+        for order_id, element in enumerate(Element.objects.all(), 1):
+            Element.objects.filter(pk=element.pk).update(order_id=order_id)
+        arrays.rebuild_all()
+
+        basalt = ChemicalAnalysis.objects.get(pk=self.analyses['basalt'].pk)
+        self.assertEqual(basalt.oxide_amounts, [48.0, 9.0])
+        self.assertIsNone(basalt.element_amounts)
+        andesite = ChemicalAnalysis.objects.get(
+            pk=self.analyses['andesite'].pk)
+        self.assertEqual(andesite.oxide_amounts, [58.0, None])
+
+        qs = ChemicalAnalysis.objects.all()
+        ChemicalAnalysisOxide.objects.filter(
+            chemical_analysis=self.analyses['picrite'],
+            oxide=self.mgo).update(min_amount=20)
+        for detection_limits in (False, True):
+            rows = composition_matrix(qs, detection_limits=detection_limits,
+                                      source='rows')
+            from_arrays = composition_matrix(
+                qs, detection_limits=detection_limits, source='arrays')
+            self.assertEqual(rows.columns, from_arrays.columns)
+            np.testing.assert_array_equal(rows.amounts, from_arrays.amounts)
+
+        res = APIClient().get('/api/chemical_analyses/',
+                              {'include': 'composition'})
+        compositions = {
+            result['description']: result['composition'] for result
+            in json.loads(res.content.decode('utf-8'))['results']}
+        self.assertEqual(compositions['andesite'],
+                         {'SiO2': {'amount': 58.0, 'precision': None}})
+        self.assertAlmostEqual(compositions['ppm basalt']['MgO']['amount'],
+                               8.5)
+
+
+    def test_composition_arrays_follow_renumbering_and_deletes(self):
+        Oxide.objects.filter(pk=self.sio2.pk).update(order_id=1)
+        Oxide.objects.filter(pk=self.mgo.pk).update(order_id=2)
+        for order_id, element in enumerate(Element.objects.all(), 1):
+            Element.objects.filter(pk=element.pk).update(order_id=order_id)
+        arrays.rebuild_all()
+
+        def oxide_amounts(name):
+            return ChemicalAnalysis.objects.get(
+                pk=self.analyses[name].pk).oxide_amounts
+
+        def assert_arrays_match_rows():
+            qs = ChemicalAnalysis.objects.all()
+            rows = composition_matrix(qs, source='rows')
+            from_arrays = composition_matrix(qs, source='arrays')
+            self.assertEqual(rows.columns, from_arrays.columns)
+            np.testing.assert_array_equal(rows.amounts, from_arrays.amounts)
+
+        sio2 = Oxide.objects.get(pk=self.sio2.pk)
+        sio2.order_id = 3
+        sio2.save()
+        self.assertEqual(oxide_amounts('basalt'), [None, 9.0, 48.0])
+        mgo = Oxide.objects.get(pk=self.mgo.pk)
+        mgo.order_id = 1
+        mgo.save()
+        self.assertEqual(oxide_amounts('basalt'), [9.0, None, 48.0])
+        assert_arrays_match_rows()
+
+        ChemicalAnalysisOxide.objects.get(
+            chemical_analysis=self.analyses['basalt'],
+            oxide=self.mgo).delete()
+        self.assertEqual(oxide_amounts('basalt'), [None, None, 48.0])
+        assert_arrays_match_rows()
+
+
+    def test_composition_cache(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        ChemicalAnalysisOxide.objects.filter(
+            chemical_analysis=self.analyses['picrite'],
+            oxide=self.mgo).update(min_amount=20)
+
+        with override_settings(COMPOSITION_CACHE_DIR=directory):
+            self.assertIsNone(cache.get_cache())
+            with mock.patch.object(metrics.CACHE_REQUESTS, 'inc') as inc:
+                APIClient().get('/api/chemical_analyses/stats/')
+                self.assertEqual(cache.refresh(), ('build', 4))
+                APIClient().get('/api/chemical_analyses/stats/')
+            self.assertEqual(
+                inc.call_args_list,
+                [mock.call(cache='composition', result='miss'),
+                 mock.call(cache='composition', result='hit')])
+            composition_cache = cache.get_cache()
+            qs = ChemicalAnalysis.objects.all()
+            for detection_limits in (False, True):
+                cached = composition_cache.matrix(
+                    composition_cache.rows_of(qs.values_list('pk', flat=True)),
+                    detection_limits=detection_limits)
+                matrix = composition_matrix(qs,
+                                            detection_limits=detection_limits)
+                self.assertEqual(cached.ids, matrix.ids)
+                self.assertEqual(cached.columns, matrix.columns)
+                np.testing.assert_array_equal(cached.amounts, matrix.amounts)
+
+            client = APIClient()
+            client.credentials(
+                HTTP_AUTHORIZATION='Token ' + self.owner.auth_token.key)
+            res = client.put(
+                '/api/chemical_analyses/{}/'.format(
+                    self.analyses['andesite'].pk),
+                {'public_data': False}, format='json')
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            kind, _ = cache.refresh()
+            self.assertEqual(kind, 'patch')
+
+            res = APIClient().get('/api/chemical_analyses/stats/')
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            stats = json.loads(res.content.decode('utf-8'))
+            self.assertEqual(stats['count'], 3)
+            res = APIClient().get('/api/chemical_analyses/projection/',
+                                  {'x': 'SiO2', 'y': 'MgO',
+                                   'minerals': 'Garnet'})
+            self.assertEqual(json.loads(res.content.decode('utf-8'))['count'],
+                             0)
+
+            # visibility comes from the database, not the last refresh
+            res = client.put(
+                '/api/chemical_analyses/{}/'.format(
+                    self.analyses['basalt'].pk),
+                {'public_data': False}, format='json')
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            res = APIClient().get('/api/chemical_analyses/stats/')
+            stats = json.loads(res.content.decode('utf-8'))
+            self.assertEqual(stats['count'], 2)
+
+            manifest = cache._read_manifest(directory)
+            manifest['synced'] = (timezone.now() - cache.MAX_AGE -
+                                  timedelta(minutes=1)).isoformat()
+            cache._write_manifest(directory, manifest)
+            self.assertIsNone(cache.get_cache())
+
+
+    def test_mineral_classification(self):
+        subsample = self.analyses['basalt'].subsample
+        references = {
+            'Quartz': [(100.0, None)] * classification.MIN_REFERENCES,
+            'Forsterite': [(40.0 + i % 3, 48.0 + i % 4)
+                           for i in range(classification.MIN_REFERENCES)],
+        }
+        for name, compositions in references.items():
+            mineral = Mineral.objects.create(name=name)
+            mineral_type = MineralType.objects.create(name=name)
+            mineral_type.oxides.add(self.sio2)
+            if name == 'Forsterite':
+                mineral_type.oxides.add(self.mgo)
+            for i, (sio2, mgo) in enumerate(compositions):
+                analysis = ChemicalAnalysis.objects.create(
+                    subsample=subsample, public_data=True, owner=self.owner,
+                    mineral=mineral, spot_id=100 + i)
+                ChemicalAnalysisOxide.objects.create(
+                    chemical_analysis=analysis, oxide=self.sio2, amount=sio2)
+                if mgo is not None:
+                    ChemicalAnalysisOxide.objects.create(
+                        chemical_analysis=analysis, oxide=self.mgo,
+                        amount=mgo)
+
+        self.assertEqual(classification.classify_all(batch_size=7), 1)
+        andesite = ChemicalAnalysis.objects.get(
+            pk=self.analyses['andesite'].pk)
+        self.assertEqual(andesite.suggested_mineral.name, 'Quartz')
+        self.assertGreater(andesite.suggested_mineral_confidence, 0.99)
+        picrite = ChemicalAnalysis.objects.get(pk=self.analyses['picrite'].pk)
+        self.assertIsNone(picrite.suggested_mineral)
+        self.assertIsNone(ChemicalAnalysis.objects.filter(
+            mineral__name='Quartz').first().suggested_mineral)
+
+        self.assertEqual(
+            self._descriptions('suggested_minerals=Quartz'
+                               '&min_suggestion_confidence=0.9'),
+            ['andesite'])
@@ -1,7 +1,25 @@
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from django.http import HttpResponse
 from rest_framework import permissions, status, viewsets
+from rest_framework.decorators import list_route
 from rest_framework.response import Response
 
-from api.chemical_analyses.lib.query import chemical_analysis_query
+from api.chemical_analyses.lib.cache import cache_directory, get_cache
+from api.chemical_analyses.lib.formula import structural_formula
+from api.chemical_analyses.lib.matrix import composition_matrix
+from api.chemical_analyses.lib.projection import decimate, project
+from api.chemical_analyses.lib.query import (
+    chemical_analysis_query,
+    table_sample,
+)
+from api.chemical_analyses.lib.similarity import IndexNotReady, get_index
+from api.chemical_analyses.lib.stats import (
+    DEFAULT_PERCENTILES,
+    composition_stats,
+)
 from api.chemical_analyses.v1.serializers import (
     ChemicalAnalysisSerializer,
     ElementSerializer,
@@ -9,9 +27,12 @@ from api.chemical_analyses.v1.serializers import (
 )
 
 from api.lib.permissions import IsOwnerOrReadOnly, IsSuperuserOrReadOnly
-from api.lib.query import sample_qs_optimizer, chemical_analyses_qs_optimizer
+from api.lib.query import chemical_analyses_qs_optimizer, get_objects_by_ids
 from api.samples.lib.query import sample_query
 
+from apps.chemical_analyses.signals import composition_changed
+from apps.chemical_analyses.summaries import refresh_samples
+from apps.monitoring.metrics import CACHE_REQUESTS, EXPORT_BYTES
 from apps.samples.models import Sample, Mineral, Subsample
 from apps.chemical_analyses.models import (
     ChemicalAnalysis,
@@ -28,25 +49,59 @@ class ChemicalAnalysisViewSet(viewsets.ModelViewSet):
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,
                           IsOwnerOrReadOnly,)
 
+    def get_queryset(self):
+        return chemical_analyses_qs_optimizer(self.request.query_params,
+                                              ChemicalAnalysis.objects.all())
+
     def get_serializer(self, *args, **kwargs):
         if self.request.method == 'PUT':
             kwargs['partial'] = True
         return super().get_serializer(*args, **kwargs)
 
-    def list(self, request, *args, **kwargs):
+    def _filtered_queryset(self, request):
         params = request.query_params
 
         if params.get('sample_filters') == 'True':
             sample_qs = Sample.objects.all()
-            sample_qs = sample_qs_optimizer(params, sample_qs)
             sample_ids = sample_query(request.user,
                                       params,
                                       sample_qs).values_list('id')
-            qs = ChemicalAnalysis.objects.filter(
+            return ChemicalAnalysis.objects.filter(
                 subsample__sample_id__in=sample_ids)
-        else:
-            qs = self.get_queryset().distinct()
-            qs = chemical_analysis_query(request.user, params, qs)
+
+        qs = ChemicalAnalysis.objects.all().distinct()
+        return chemical_analysis_query(request.user, params, qs)
+
+    def _export_matrix(self, qs):
+        # the matrix is built in memory in one piece, so exports are limited
+        # to CHEMICAL_ANALYSIS_MATRIX_MAX_ROWS analyses
+        max_rows = getattr(settings, 'CHEMICAL_ANALYSIS_MATRIX_MAX_ROWS',
+                           100000)
+        count = qs.count()
+        if count > max_rows:
+            raise ValueError('{} analyses match; filter them down to at most '
+                             '{}'.format(count, max_rows))
+        return composition_matrix(qs)
+
+    def _analysis_matrix(self, qs, detection_limits=False):
+        # Reads the compositions from the composition cache when there is
+        # one; which analyses are visible is still up to the database
+        cache = get_cache()
+        if cache_directory() is not None:
+            CACHE_REQUESTS.inc(
+                cache='composition', result='miss' if cache is None else 'hit')
+        if cache is None:
+            return composition_matrix(qs, detection_limits=detection_limits)
+        return cache.matrix(cache.rows_of(qs.values_list('pk', flat=True)),
+                            detection_limits=detection_limits)
+
+    def list(self, request, *args, **kwargs):
+        params = request.query_params
+
+        try:
+            qs = self._filtered_queryset(request)
+        except ValueError as err:
+            return Response(data={'error': err.args}, status=400)
 
         qs = chemical_analyses_qs_optimizer(params, qs)
 
@@ -58,34 +113,221 @@ class ChemicalAnalysisViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(qs, many=True)
         return Response(serializer.data)
 
-
-    def _handle_elements(self, instance, params):
-        to_add = []
-        for record in params['elements']:
+    @list_route()
+    def matrix(self, request, *args, **kwargs):
+        """
+        The amounts of the filtered analyses as one header of oxide/element
+        columns and a dense matrix, as columnar JSON or, with
+        `?binary=True`, in the binary layout of CompositionMatrix.to_bytes.
+        At most CHEMICAL_ANALYSIS_MATRIX_MAX_ROWS analyses are exported.
+        """
+        try:
+            matrix = self._export_matrix(self._filtered_queryset(request))
+        except ValueError as err:
+            return Response(data={'error': err.args}, status=400)
+
+        if request.query_params.get('binary') == 'True':
+            content = matrix.to_bytes()
+            EXPORT_BYTES.inc(len(content), view='chemicalanalysis-matrix')
+            return HttpResponse(content,
+                                content_type='application/octet-stream')
+        return Response(matrix.to_json())
+
+    @list_route()
+    def structural_formula(self, request, *args, **kwargs):
+        """
+        Cations per formula unit of the filtered analyses on the basis of
+        `?oxygens=` oxygens (e.g. 12 for garnet).
+        """
+        try:
+            oxygens = float(request.query_params['oxygens'])
+            if oxygens <= 0:
+                raise ValueError
+        except (KeyError, ValueError):
+            return Response(
+                data={'error': 'oxygens must be a positive number'},
+                status=400)
+
+        try:
+            matrix = self._export_matrix(self._filtered_queryset(request))
+        except ValueError as err:
+            return Response(data={'error': err.args}, status=400)
+
+        formula = structural_formula(matrix, oxygens)
+        return Response(formula.to_json())
+
+    @list_route()
+    def stats(self, request, *args, **kwargs):
+        """
+        Summary statistics and correlations of the amounts of the filtered
+        analyses, leaving out amounts outside their detection limits.
+        `?sample_percent=` estimates them from a TABLESAMPLE of the table.
+        """
+        params = request.query_params
+        percentiles = DEFAULT_PERCENTILES
+        try:
+            qs = self._filtered_queryset(request)
+            if params.get('percentiles'):
+                percentiles = [float(p)
+                               for p in params['percentiles'].split(',')]
+            if not all(0 <= p <= 100 for p in percentiles):
+                raise ValueError('percentiles must be between 0 and 100')
+            if params.get('sample_percent'):
+                qs = table_sample(qs, float(params['sample_percent']))
+        except ValueError as err:
+            return Response(data={'error': err.args}, status=400)
+
+        matrix = self._analysis_matrix(qs, detection_limits=True)
+        return Response(composition_stats(matrix, percentiles))
+
+    @list_route()
+    def projection(self, request, *args, **kwargs):
+        """
+        The filtered analyses projected onto diagram axes: `?x=` and `?y=`
+        for a binary diagram, or the corners `?a=`, `?b=` and `?c=` of a
+        ternary, each an expression of oxides such as `Na2O + K2O` or
+        `mol(Al2O3) / (mol(CaO) + mol(Na2O) + mol(K2O))`. With
+        `?max_points=` the points are thinned to that budget, each kept
+        point weighted by how many it stands for.
+        """
+        params = request.query_params
+        if params.get('a') or params.get('b') or params.get('c'):
+            names, ternary = ('a', 'b', 'c'), True
+        else:
+            names, ternary = ('x', 'y'), False
+        if not all(params.get(name) for name in names):
+            return Response(
+                data={'error': 'Either x and y or a, b and c are required'},
+                status=400)
+
+        try:
+            max_points = None
+            if params.get('max_points'):
+                max_points = int(params['max_points'])
+                if max_points < 1:
+                    raise ValueError('max_points must be positive')
+            qs = self._filtered_queryset(request)
+            ids, coordinates = project(self._analysis_matrix(qs),
+                                       [params[name] for name in names],
+                                       ternary)
+        except ValueError as err:
+            return Response(data={'error': err.args}, status=400)
+
+        count = len(ids)
+        if max_points is not None:
+            kept, weights = decimate(coordinates, max_points)
+            ids = [ids[i] for i in kept]
+            coordinates = coordinates[kept]
+        else:
+            weights = [1] * count
+
+        return Response({
+            'count': count,
+            'axes': {name: params[name] for name in names},
+            'ids': ids,
+            'coordinates': {name: coordinates[:, i].tolist()
+                            for i, name in enumerate(names)},
+            'weights': [float(weight) for weight in weights],
+        })
+
+    def _composition_vector(self, request, index):
+        """
+        The wt% of `index.columns` given by `?id=` (an analysis the user can
+        see) or `?composition=SiO2:48.5,MgO:9`.
+        """
+        params = request.query_params
+        if params.get('id'):
             try:
-                to_add.append({
-                    'element': Element.objects.get(pk=record['id']),
-                    'amount': record['amount'],
-                    'precision': record['precision'],
-                    'precision_type': record['precision_type'],
-                    'measurement_unit': record['measurement_unit'],
-                    'min_amount': record['min_amount'],
-                    'max_amount': record['max_amount']
-                })
-            except Element.DoesNotExist:
-                return Response(
-                    data={'error': 'Invalid element id'},
-                    status=400)
+                pk = uuid.UUID(params['id'])
+            except ValueError:
+                pk = None
+            qs = chemical_analysis_query(
+                request.user, {}, ChemicalAnalysis.objects.filter(pk=pk))
+            matrix = composition_matrix(qs, drop_empty=False)
+            if pk is None or not matrix.ids:
+                raise ValueError('Invalid chemical analysis id: {}'
+                                 .format(params['id']))
+            amounts = dict(zip([column['id'] for column in matrix.columns],
+                               matrix.amounts[0]))
+            return [amounts.get(column_id) for column_id in index.columns]
+
+        if params.get('composition'):
+            species = {str(pk): name for pk, name in Oxide.objects.filter(
+                pk__in=index.columns).values_list('pk', 'species')}
+            amounts = {}
+            for item in params['composition'].split(','):
+                name, _, amount = item.partition(':')
+                amounts[name] = float(amount)
+            unknown = set(amounts) - set(species.values())
+            if unknown:
+                raise ValueError('Unknown oxides: {}'
+                                 .format(', '.join(sorted(unknown))))
+            return [amounts.get(species.get(column_id), 0)
+                    for column_id in index.columns]
+
+        raise ValueError('Either id or composition is required')
+
+    @list_route()
+    def similar(self, request, *args, **kwargs):
+        """
+        The `?k=` (10) analyses, among the filtered ones, nearest to an
+        analysis (`?id=`) or a composition (`?composition=`) in oxide
+        space, under `?metric=euclidean` (of normalized wt%) or `logratio`.
+        """
+        params = request.query_params
+        try:
+            k = int(params.get('k', 10))
+            if not 0 < k <= 1000:
+                raise ValueError('k must be between 1 and 1000')
+            index = get_index(params.get('metric', 'euclidean'))
+            vector = index.vector(self._composition_vector(request, index))
+            qs = self._filtered_queryset(request)
+        except IndexNotReady as err:
+            return Response(data={'error': err.args}, status=503,
+                            headers={'Retry-After': '30'})
+        except ValueError as err:
+            return Response(data={'error': err.args}, status=400)
+
+        # ask the index for more candidates until enough of them pass the
+        # filters (or there are no more)
+        n = k * 4
+        while True:
+            candidates = index.query(vector, n)
+            ids = [pk for pk, distance in candidates
+                   if pk != params.get('id', '').lower()]
+            visible = set(str(pk) for pk in qs.filter(pk__in=ids)
+                          .values_list('pk', flat=True))
+            nearest = [(pk, distance) for pk, distance in candidates
+                       if pk in visible][:k]
+            if len(nearest) == k or len(candidates) < n:
+                break
+            n *= 4
+
+        analyses = chemical_analyses_qs_optimizer(
+            params,
+            ChemicalAnalysis.objects.filter(pk__in=[pk for pk, _ in nearest]))
+        analyses = {str(analysis.pk): analysis for analysis in analyses}
+        return Response([
+            {'distance': distance,
+             'chemical_analysis': self.get_serializer(analyses[pk]).data}
+            for pk, distance in nearest if pk in analyses
+        ])
+
+
+    def _handle_elements(self, instance, records):
+        elements = get_objects_by_ids(Element,
+                                      [record['id'] for record in records],
+                                      'element')
 
         (ChemicalAnalysisElement
          .objects
          .filter(chemical_analysis=instance)
          .delete())
 
-        for record in to_add:
-            ChemicalAnalysisElement.objects.create(
+        rows = [
+            ChemicalAnalysisElement(
                 chemical_analysis=instance,
-                element=record['element'],
+                element=element,
                 amount=record['amount'],
                 precision=record['precision'],
                 precision_type=record['precision_type'],
@@ -93,35 +335,28 @@ class ChemicalAnalysisViewSet(viewsets.ModelViewSet):
                 min_amount=record['min_amount'],
                 max_amount=record['max_amount']
             )
+            for element, record in zip(elements, records)
+        ]
+        # bulk_create doesn't call save()
+        for row in rows:
+            row.set_canonical_amount()
+        ChemicalAnalysisElement.objects.bulk_create(rows)
 
 
-    def _handle_oxides(self, instance, params):
-        to_add = []
-        for record in params['oxides']:
-            try:
-                to_add.append({
-                    'oxide': Oxide.objects.get(pk=record['id']),
-                    'amount': record['amount'],
-                    'precision': record['precision'],
-                    'precision_type': record['precision_type'],
-                    'measurement_unit': record['measurement_unit'],
-                    'min_amount': record['min_amount'],
-                    'max_amount': record['max_amount']
-                })
-            except Oxide.DoesNotExist:
-                return Response(
-                    data={'error': 'Invalid oxide id'},
-                    status=400)
+    def _handle_oxides(self, instance, records):
+        oxides = get_objects_by_ids(Oxide,
+                                    [record['id'] for record in records],
+                                    'oxide')
 
         (ChemicalAnalysisOxide
          .objects
          .filter(chemical_analysis=instance)
          .delete())
 
-        for record in to_add:
-            ChemicalAnalysisOxide.objects.create(
+        rows = [
+            ChemicalAnalysisOxide(
                 chemical_analysis=instance,
-                oxide=record['oxide'],
+                oxide=oxide,
                 amount=record['amount'],
                 precision=record['precision'],
                 precision_type=record['precision_type'],
@@ -129,50 +364,42 @@ class ChemicalAnalysisViewSet(viewsets.ModelViewSet):
                 min_amount=record['min_amount'],
                 max_amount=record['max_amount']
             )
+            for oxide, record in zip(oxides, records)
+        ]
+        # bulk_create doesn't call save()
+        for row in rows:
+            row.set_canonical_amount()
+        ChemicalAnalysisOxide.objects.bulk_create(rows)
 
 
     def perform_create(self, serializer):
         return serializer.save()
 
 
+    def _reject(self, error):
+        # called inside transaction.atomic(), so a rejected write leaves
+        # nothing behind
+        transaction.set_rollback(True)
+        return Response(data={'error': error}, status=400)
+
+
+    @transaction.atomic
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         instance = self.perform_create(serializer)
 
-        if request.data.get('elements'):
-            for record in request.data.get('elements'):
-                try:
-                    ChemicalAnalysisElement.objects.create(
-                        chemical_analysis=instance,
-                        element=Element.objects.get(pk=record['id']),
-                        amount=record['amount'],
-                        precision=record['precision'],
-                        precision_type=record['precision_type'],
-                        measurement_unit=record['measurement_unit'],
-                        min_amount=record['min_amount'],
-                        max_amount=record['max_amount'],
-                    )
-                except Element.DoesNotExist:
-                    return Response(data={'error': 'Invalid element id'},
-                                    status=400)
-
-        if request.data.get('oxides'):
-            for record in request.data.get('oxides'):
-                try:
-                    ChemicalAnalysisOxide.objects.create(
-                        chemical_analysis=instance,
-                        oxide=Oxide.objects.get(pk=record['id']),
-                        amount=record['amount'],
-                        precision=record['precision'],
-                        precision_type=record['precision_type'],
-                        measurement_unit=record['measurement_unit'],
-                        min_amount=record['min_amount'],
-                        max_amount=record['max_amount'],
-                    )
-                except Oxide.DoesNotExist:
-                    return Response(data={'error': 'Invalid oxide id'},
-                                    status=400)
+        try:
+            if request.data.get('elements'):
+                self._handle_elements(instance, request.data['elements'])
+            if request.data.get('oxides'):
+                self._handle_oxides(instance, request.data['oxides'])
+        except ValueError as err:
+            return self._reject(err.args)
+
+        if request.data.get('elements') or request.data.get('oxides'):
+            composition_changed.send(sender=ChemicalAnalysis,
+                                     chemical_analysis_ids=[instance.pk])
 
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data,
@@ -180,10 +407,12 @@ class ChemicalAnalysisViewSet(viewsets.ModelViewSet):
                         headers=headers)
 
 
+    @transaction.atomic
     def update(self, request, *args, **kwargs):
         params = request.data
         partial = kwargs.pop('partial', False)
         instance = self.get_object()
+        previous_sample_id = instance.subsample.sample_id
         serializer = self.get_serializer(instance,
                                          data=request.data,
                                          partial=partial)
@@ -194,29 +423,39 @@ class ChemicalAnalysisViewSet(viewsets.ModelViewSet):
             try:
                 mineral = Mineral.objects.get(pk=params['mineral_id'])
             except Mineral.DoesNotExist:
-                return Response(data={'error': 'Invalid mineral id'},
-                                status=400)
+                return self._reject('Invalid mineral id')
             else:
                 instance.mineral = mineral
 
         if 'subsample_id' in params:
             try:
                 subsample = Subsample.objects.get(pk=params['subsample_id'])
-            except Mineral.DoesNotExist:
-                return Response(data={'error': 'Invalid subsample id'},
-                                status=400)
+            except Subsample.DoesNotExist:
+                return self._reject('Invalid subsample id')
             else:
                 instance.subsample = subsample
 
-        if 'elements' in params:
-            self._handle_elements(instance, params)
-
-        if 'oxides' in params:
-            self._handle_oxides(instance, params)
+        try:
+            if 'elements' in params:
+                self._handle_elements(instance, params['elements'])
+            if 'oxides' in params:
+                self._handle_oxides(instance, params['oxides'])
+        except ValueError as err:
+            return self._reject(err.args)
 
         instance.save()
-        # refresh the data before returning a response
-        serializer = self.get_serializer(instance)
+        # after saving, so the stale computed fields of `instance` don't
+        # overwrite what the receivers store
+        if any(key in params for key in ('elements', 'oxides', 'mineral_id',
+                                         'subsample_id', 'public_data')):
+            composition_changed.send(sender=ChemicalAnalysis,
+                                     chemical_analysis_ids=[instance.pk])
+        if instance.subsample.sample_id != previous_sample_id:
+            refresh_samples([previous_sample_id])
+
+        # refresh the data before returning a response; the instance's
+        # prefetched relations are stale by now
+        serializer = self.get_serializer(self.get_object())
         return Response(serializer.data)
 
 
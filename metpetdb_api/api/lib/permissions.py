@@ -1,3 +1,5 @@
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
 from rest_framework import permissions
 
 
@@ -74,3 +76,28 @@ class UserPermission(permissions.BasePermission):
                 has_perm = True
 
         return has_perm
+
+
+class IsSuperuser(permissions.BasePermission):
+    """
+    Custom permission to only allow superusers, e.g. for operational
+    endpoints that expose other users' queries.
+    """
+
+    def has_permission(self, request, view):
+        return bool(request.user and request.user.is_superuser)
+
+
+class IsSuperuserOrMetricsScraper(permissions.BasePermission):
+    """
+    Custom permission to only allow superusers, and scrapers sending the
+    METRICS_TOKEN setting as an `Authorization: Bearer <token>` header.
+    """
+
+    def has_permission(self, request, view):
+        token = getattr(settings, 'METRICS_TOKEN', '')
+        if token and constant_time_compare(
+                request.META.get('HTTP_AUTHORIZATION', ''),
+                'Bearer ' + token):
+            return True
+        return bool(request.user and request.user.is_superuser)
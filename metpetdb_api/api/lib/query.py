@@ -1,30 +1,81 @@
+import uuid
+
+from django.db.models import Prefetch
+
+from apps.chemical_analyses.arrays import layout
+from apps.chemical_analyses.models import (
+    ChemicalAnalysis,
+    CompositionSummary,
+)
+from apps.samples.models import Subsample
+
+
+def _subsample_ids_prefetch():
+    # SampleSerializer only needs the ids of a sample's subsamples and
+    # chemical analyses, so don't load the rest of their columns.
+    return Prefetch(
+        'subsamples',
+        queryset=(Subsample
+                  .objects
+                  .only('id', 'sample_id')
+                  .prefetch_related(Prefetch(
+                      'chemical_analyses',
+                      queryset=(ChemicalAnalysis
+                                .objects
+                                .only('id', 'subsample_id')))))
+    )
+
+
 def sample_qs_optimizer(params, qs):
+    if 'composition_summary' in (params.get('include') or '').split(','):
+        qs = qs.prefetch_related(Prefetch(
+            'composition_summaries',
+            queryset=(CompositionSummary
+                      .objects
+                      .select_related('mineral', 'oxide')
+                      .order_by('mineral__name', 'oxide__species'))))
+
     try:
         fields = params.get('fields').split(',')
-        if 'rock_types' in fields:
+        if 'rock_type' in fields:
             qs = qs.select_related('rock_type')
+        if 'collector_id' in fields:
+            qs = qs.select_related('collector_id')
         if 'metamorphic_grades' in fields:
             qs = qs.prefetch_related('metamorphic_grades')
         if 'metamorphic_regions' in fields:
             qs = qs.prefetch_related('metamorphic_regions')
         if 'minerals' in fields:
             qs = qs.prefetch_related('samplemineral_set__mineral')
+        if 'references' in fields:
+            qs = qs.prefetch_related('references')
         if 'owner' in fields:
             qs = qs.prefetch_related('owner')
+        if 'subsample_ids' in fields or 'chemical_analyses_ids' in fields:
+            qs = qs.prefetch_related(_subsample_ids_prefetch())
     except AttributeError:
-        qs = qs.select_related('rock_type')
+        qs = qs.select_related('rock_type', 'collector_id')
         qs = qs.prefetch_related('metamorphic_grades',
                                  'metamorphic_regions',
                                  'samplemineral_set__mineral',
-                                 'owner')
+                                 'references',
+                                 'owner',
+                                 _subsample_ids_prefetch())
     return qs
 
 
 def chemical_analyses_qs_optimizer(params, qs):
+    if ('composition' in (params.get('include') or '').split(',') and
+            layout() is None):
+        # ChemicalAnalysisSerializer reads the composition from the amounts
+        # tables when the composition arrays can't be used
+        qs = qs.prefetch_related('chemicalanalysiselement_set__element',
+                                 'chemicalanalysisoxide_set__oxide')
+
     try:
         fields = params.get('fields').split(',')
 
-        for field in ('mineral', 'owner', 'subsample'):
+        for field in ('mineral', 'suggested_mineral', 'owner', 'subsample'):
             if field in fields:
                 qs = qs.select_related(field)
 
@@ -33,7 +84,27 @@ def chemical_analyses_qs_optimizer(params, qs):
         if 'oxides' in fields:
             qs = qs.prefetch_related('chemicalanalysisoxide_set__oxide')
     except AttributeError:
-        qs = qs.select_related('mineral', 'owner', 'subsample')
+        qs = qs.select_related('mineral', 'suggested_mineral', 'owner',
+                               'subsample')
         qs = qs.prefetch_related('chemicalanalysiselement_set__element',
                                  'chemicalanalysisoxide_set__oxide')
     return qs
+
+
+def get_objects_by_ids(model, ids, name):
+    """
+    Fetches the objects with the given ids in a single query, in the order
+    of `ids`; raises a ValueError naming the first id that is malformed or
+    doesn't exist.
+    """
+    for id in ids:
+        try:
+            uuid.UUID(str(id))
+        except ValueError:
+            raise ValueError('Invalid {} id: {}'.format(name, id))
+
+    objects = {str(pk): obj for pk, obj in model.objects.in_bulk(ids).items()}
+    for id in ids:
+        if str(id) not in objects:
+            raise ValueError('Invalid {} id: {}'.format(name, id))
+    return [objects[str(id)] for id in ids]
@@ -0,0 +1,155 @@
+from collections import Counter
+
+from django.contrib.gis.geos import Point
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from apps.chemical_analyses.models import (
+    ChemicalAnalysis,
+    ChemicalAnalysisElement,
+    ChemicalAnalysisOxide,
+    Element,
+    Oxide,
+)
+from apps.monitoring.slow_queries import fingerprint
+from apps.samples.models import (
+    Collector,
+    Country,
+    GeoReference,
+    MetamorphicGrade,
+    MetamorphicRegion,
+    Mineral,
+    Reference,
+    Region,
+    RockType,
+    Sample,
+    SampleMineral,
+    Subsample,
+    SubsampleType,
+)
+from apps.users.models import User
+
+
+def build_dataset(size, owner, prefix='x'):
+    """
+    Creates `size` public objects of every model the API serves, all owned
+    by `owner`, with every sample, subsample and chemical analysis linked to
+    `size` of each of their related objects.
+    """
+    names = ['{}{}'.format(prefix, i) for i in range(size)]
+
+    def lookup(model, **fields):
+        return model.objects.bulk_create(
+            [model(name=name, **fields) for name in names])
+
+    for name in names:
+        User.objects.create_user(email='{}@metpetdb.com'.format(name),
+                                 name=name,
+                                 is_active=True)
+    rock_types = lookup(RockType)
+    subsample_types = lookup(SubsampleType)
+    minerals = lookup(Mineral)
+    metamorphic_regions = lookup(MetamorphicRegion)
+    metamorphic_grades = lookup(MetamorphicGrade)
+    georeferences = lookup(GeoReference)
+    lookup(Region)
+    lookup(Reference)
+    lookup(Collector)
+    lookup(Country)
+
+    elements = Element.objects.bulk_create(
+        [Element(name=name, symbol='{}{}'.format(prefix, i)[:4],
+                 atomic_number=i + 1, weight=1.0)
+         for i, name in enumerate(names)])
+    oxides = Oxide.objects.bulk_create(
+        [Oxide(element=element, species=name, weight=1.0,
+               cations_per_oxide=1, conversion_factor=1.0)
+         for element, name in zip(elements, names)])
+
+    samples = Sample.objects.bulk_create(
+        [Sample(number=name,
+                public_data=True,
+                owner=owner,
+                collector_id=owner,
+                rock_type=rock_types[i],
+                location_coords=Point(i, i, srid=4326),
+                aliases=[name],
+                regions=[name])
+         for i, name in enumerate(names)])
+    SampleMineral.objects.bulk_create(
+        [SampleMineral(sample=sample, mineral=mineral, amount='x')
+         for sample in samples for mineral in minerals])
+    for sample in samples:
+        sample.metamorphic_regions = metamorphic_regions
+        sample.metamorphic_grades = metamorphic_grades
+        sample.references = georeferences
+
+    subsamples = Subsample.objects.bulk_create(
+        [Subsample(name=name,
+                   sample=sample,
+                   public_data=True,
+                   owner=owner,
+                   subsample_type=subsample_types[i])
+         for i, (sample, name) in enumerate(zip(samples, names))])
+
+    chemical_analyses = [
+        ChemicalAnalysis.objects.create(subsample=subsample,
+                                        public_data=True,
+                                        owner=owner,
+                                        mineral=minerals[i],
+                                        spot_id=i)
+        for i, subsample in enumerate(subsamples)]
+    ChemicalAnalysisElement.objects.bulk_create(
+        [ChemicalAnalysisElement(chemical_analysis=chemical_analysis,
+                                 element=element,
+                                 amount=1.0,
+                                 canonical_amount=1.0)
+         for chemical_analysis in chemical_analyses for element in elements])
+    ChemicalAnalysisOxide.objects.bulk_create(
+        [ChemicalAnalysisOxide(chemical_analysis=chemical_analysis,
+                               oxide=oxide,
+                               amount=1.0,
+                               canonical_amount=1.0)
+         for chemical_analysis in chemical_analyses for oxide in oxides])
+
+    return {
+        'samples': samples,
+        'subsamples': subsamples,
+        'chemical_analyses': chemical_analyses,
+        'minerals': minerals,
+        'metamorphic_regions': metamorphic_regions,
+        'metamorphic_grades': metamorphic_grades,
+        'elements': elements,
+        'oxides': oxides,
+    }
+
+
+class QueryCountMixin(object):
+    """
+    Assertions that a request's number of queries doesn't grow with the
+    amount of data it returns or writes.
+    """
+
+    def capture_queries(self, func, *args, **kwargs):
+        with CaptureQueriesContext(connection) as queries:
+            response = func(*args, **kwargs)
+        return response, [query['sql'] for query in queries.captured_queries]
+
+    def assertConstantQueries(self, small, large, msg=''):
+        """
+        Fails if `large` (the SQL issued with more data) made more queries
+        than `small`, listing the statements that were repeated more often.
+        """
+        if len(large) <= len(small):
+            return
+
+        before = Counter(fingerprint(sql) for sql in small)
+        after = Counter(fingerprint(sql) for sql in large)
+        examples = {fingerprint(sql): sql for sql in large}
+        lines = ['{}: {} queries grew to {}'.format(msg, len(small),
+                                                    len(large))]
+        for key, count in after.most_common():
+            if count > before[key]:
+                lines.append('  {} -> {}: {}'.format(before[key], count,
+                                                     examples[key][:300]))
+        self.fail('\n'.join(lines))
@@ -0,0 +1,70 @@
+import os
+
+from django.http import FileResponse, HttpResponse
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from api.lib.permissions import IsSuperuser, IsSuperuserOrMetricsScraper
+from apps.monitoring import metrics, profiling
+from apps.monitoring.slow_queries import worst_query_shapes
+
+
+class SlowQueryView(APIView):
+    permission_classes = (IsSuperuser,)
+
+    def get(self, request, format=None):
+        try:
+            limit = int(request.query_params.get('limit', 20))
+        except ValueError:
+            return Response(data={'error': 'Invalid limit'}, status=400)
+
+        return Response({'query_shapes': list(worst_query_shapes(limit))})
+
+
+class MetricsView(APIView):
+    """
+    Prometheus scrape target; aggregates the metrics of every worker process
+    on this host.
+    """
+    permission_classes = (IsSuperuserOrMetricsScraper,)
+
+    def get(self, request, format=None):
+        return HttpResponse(metrics.exposition(),
+                            content_type='text/plain; version=0.0.4; '
+                                         'charset=utf-8')
+
+
+class ProfileView(APIView):
+    """
+    Returns a stored profile: the raw pstats file (or tracemalloc snapshot,
+    with `?kind=memory`), or a plain-text summary with `?summary=True`.
+    """
+    permission_classes = (IsSuperuser,)
+
+    def get(self, request, profile_id, format=None):
+        kind = request.query_params.get('kind', 'cpu')
+        path = profiling.profile_path(profile_id, kind)
+        if path is None or not os.path.exists(path):
+            return Response(data={'error': 'Invalid profile id'}, status=404)
+
+        if request.query_params.get('summary') == 'True':
+            return HttpResponse(profiling.summary(profile_id, kind),
+                                content_type='text/plain; charset=utf-8')
+
+        response = FileResponse(open(path, 'rb'),
+                                content_type='application/octet-stream')
+        response['Content-Disposition'] = (
+            'attachment; filename="{}"'.format(os.path.basename(path)))
+        return response
+
+
+class SampledStacksView(APIView):
+    """
+    Returns the stacks collected by the sampling profiler of every worker, in
+    the folded format read by flamegraph.pl.
+    """
+    permission_classes = (IsSuperuser,)
+
+    def get(self, request, format=None):
+        return HttpResponse(profiling.sampled_stacks(),
+                            content_type='text/plain; charset=utf-8')
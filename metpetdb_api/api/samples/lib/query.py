@@ -4,6 +4,98 @@ from django.contrib.auth.models import AnonymousUser
 from django.contrib.gis.geos import Polygon, GEOSException
 from django.db.models import Q
 
+from api.chemical_analyses.lib.query import parse_ranges
+from apps.chemical_analyses.units import DEFAULT_OXIDE_UNIT, convert
+
+
+def parse_composition_ranges(value):
+    """
+    Parses `Garnet:MgO:5:10,Garnet:CaO::3` into (mineral, oxide, low, high)
+    tuples, with the bounds converted to wt%; a unit may follow as
+    `Garnet:MgO:5:10:wt%`.
+    """
+    ranges = []
+    for item in value.split(','):
+        mineral, _, oxide_range = item.partition(':')
+        if not mineral:
+            raise ValueError('Invalid range: {}. Expected '
+                             'mineral:oxide:min:max'.format(item))
+        (oxide, low, high, unit), = parse_ranges(oxide_range,
+                                                 DEFAULT_OXIDE_UNIT)
+        low, high = [None if bound is None
+                     else convert(bound, unit, DEFAULT_OXIDE_UNIT)
+                     for bound in (low, high)]
+        ranges.append((mineral, oxide, low, high))
+    return ranges
+
+
+def parse_abundance_ranges(value):
+    """
+    Parses `Garnet:20:,Quartz::5` into (mineral, low, high) tuples of modal
+    abundances in percent; either bound may be left out.
+    """
+    ranges = []
+    for item in value.split(','):
+        parts = item.split(':')
+        if len(parts) != 3 or not parts[0]:
+            raise ValueError('Invalid range: {}. Expected mineral:min:max'
+                             .format(item))
+        try:
+            low, high = [float(bound) if bound else None
+                         for bound in parts[1:]]
+        except ValueError:
+            raise ValueError('Invalid range: {}'.format(item))
+        ranges.append((parts[0], low, high))
+    return ranges
+
+
+def match_identifiers(qs, identifiers):
+    """
+    Keeps the samples whose number or one of whose aliases is in
+    `identifiers`, case-insensitively, as a single array overlap backed by
+    the samples_identifiers_gin index.
+    """
+    return qs.extra(where=["""
+            lower_array(array_append(samples.aliases, samples.number))
+            && lower_array(%s::text[])
+         """], params=[list(identifiers)])
+
+
+# How ?text_match= compares the free-text filters (collectors, countries,
+# location_names, regions) with the samples' values: as given, after
+# normalize_text (case, accents and whitespace folded), or by pg_trgm
+# similarity of the normalized values
+TEXT_MATCH_MODES = ('exact', 'normalized', 'fuzzy')
+
+
+def _match_text(qs, column, values, mode):
+    expression = 'normalize_text(samples.{})'.format(column)
+    if mode == 'normalized':
+        return qs.extra(where=[
+            '{} = ANY(normalize_text_array(%s::text[]))'.format(expression)
+        ], params=[values])
+    # one similarity test per value, so each can use the trigram index
+    return qs.extra(where=['({})'.format(' OR '.join(
+        '{} %% normalize_text(%s)'.format(expression) for _ in values))
+    ], params=values)
+
+
+def _match_regions(qs, regions, mode):
+    if mode == 'normalized':
+        return qs.extra(where=["""
+                normalize_text_array(samples.regions)
+                && normalize_text_array(%s::text[])
+             """], params=[regions])
+    # the known region names similar to any of `regions`
+    return qs.extra(where=["""
+            normalize_text_array(samples.regions) && ARRAY(
+                SELECT normalize_text(r.name)
+                FROM regions r
+                WHERE {}
+            )
+         """.format(' OR '.join('normalize_text(r.name) %% normalize_text(%s)'
+                                for _ in regions))], params=regions)
+
 
 def sample_query(user, params, qs):
     if isinstance(user, AnonymousUser):
@@ -11,17 +103,40 @@ def sample_query(user, params, qs):
     else:
         qs = qs.filter(Q(owner=user) | Q(public_data=True))
 
+    text_match = params.get('text_match') or 'exact'
+    if text_match not in TEXT_MATCH_MODES:
+        raise ValueError('text_match must be one of {}'.format(
+            ', '.join(TEXT_MATCH_MODES)))
+
     if params.get('ids'):
         qs = qs.filter(pk__in=params['ids'].split(','))
 
     if params.get('collectors'):
-        qs = qs.filter(collector_name__in=params['collectors'].split(','))
+        collectors = params['collectors'].split(',')
+        if text_match == 'exact':
+            qs = qs.filter(collector_name__in=collectors)
+        else:
+            qs = _match_text(qs, 'collector_name', collectors, text_match)
 
     if params.get('numbers'):
         qs = qs.filter(number__in=params['numbers'].split(','))
 
+    if params.get('numbers_or_aliases'):
+        qs = match_identifiers(qs, params['numbers_or_aliases'].split(','))
+
     if params.get('countries'):
-        qs = qs.filter(country__in=params['countries'].split(','))
+        countries = params['countries'].split(',')
+        if text_match == 'exact':
+            qs = qs.filter(country__in=countries)
+        else:
+            qs = _match_text(qs, 'country', countries, text_match)
+
+    if params.get('location_names'):
+        location_names = params['location_names'].split(',')
+        if text_match == 'exact':
+            qs = qs.filter(location_name__in=location_names)
+        else:
+            qs = _match_text(qs, 'location_name', location_names, text_match)
 
     if params.get('location_bbox'):
         bbox  = Polygon.from_bbox(params['location_bbox'].split(','))
@@ -45,21 +160,93 @@ def sample_query(user, params, qs):
 
     if params.get('minerals'):
         minerals = params['minerals'].split(',')
+        if params.get('minerals_expand') == 'True':
+            # also match the minerals' group members and synonyms
+            join = """
+                INNER JOIN mineral_closure mc
+                ON sm.mineral_id = mc.descendant_id
+                INNER JOIN minerals m
+                ON mc.ancestor_id = m.id
+            """
+        else:
+            join = """
+                INNER JOIN minerals m
+                ON sm.mineral_id = m.id
+            """
         if params.get('minerals_and') == 'True':
             for mineral in minerals:
                 qs = qs.extra(where=["""
                         EXISTS (
                             SELECT 0
                             FROM sample_minerals sm
-                            INNER JOIN minerals m
-                            ON sm.mineral_id = m.id
+                            {}
                             WHERE samples.id = sm.sample_id
                             AND m.name = %s
                         )
-                     """], params=[mineral])
+                     """.format(join)], params=[mineral])
+        elif params.get('minerals_expand') == 'True':
+            qs = qs.extra(where=["""
+                    EXISTS (
+                        SELECT 0
+                        FROM sample_minerals sm
+                        {}
+                        WHERE samples.id = sm.sample_id
+                        AND m.name = ANY(%s)
+                    )
+                 """.format(join)], params=[minerals])
         else:
             qs = qs.filter(minerals__name__in=minerals)
 
+    if params.get('abundance_ranges'):
+        # the sample lists the mineral with a modal abundance known to be
+        # within the range
+        for mineral, low, high in parse_abundance_ranges(
+                params['abundance_ranges']):
+            where = ['m.name = %s']
+            where_params = [mineral]
+            if low is not None:
+                where.append('sm.amount_min >= %s')
+                where_params.append(low)
+            if high is not None:
+                where.append('sm.amount_max <= %s')
+                where_params.append(high)
+            qs = qs.extra(where=["""
+                    EXISTS (
+                        SELECT 0
+                        FROM sample_minerals sm
+                        INNER JOIN minerals m
+                        ON sm.mineral_id = m.id
+                        WHERE samples.id = sm.sample_id
+                        AND {}
+                    )
+                 """.format(' AND '.join(where))], params=where_params)
+
+    if params.get('composition_ranges'):
+        # the mean amount of an oxide over the sample's analyses of a
+        # mineral, from the composition_summaries rollup
+        for mineral, oxide, low, high in parse_composition_ranges(
+                params['composition_ranges']):
+            where = ['m.name = %s', 'o.species = %s']
+            where_params = [mineral, oxide]
+            if low is not None:
+                where.append('cs.mean >= %s')
+                where_params.append(low)
+            if high is not None:
+                where.append('cs.mean <= %s')
+                where_params.append(high)
+            qs = qs.extra(where=["""
+                    EXISTS (
+                        SELECT 0
+                        FROM composition_summaries cs
+                        INNER JOIN minerals m
+                        ON cs.mineral_id = m.id
+                        INNER JOIN oxides o
+                        ON cs.oxide_id = o.id
+                        WHERE samples.id = cs.sample_id
+                        AND {}
+                    )
+                 """.format(' AND '.join(where))], params=where_params)
+
     if params.get('owners'):
         qs = qs.filter(owner__name__in=params['owners'].split(','))
 
@@ -70,7 +257,11 @@ def sample_query(user, params, qs):
         qs = qs.filter(references__name__in=params['references'].split(','))
 
     if params.get('regions'):
-        qs = qs.filter(regions__overlap=params['regions'].split(','))
+        regions = params['regions'].split(',')
+        if text_match == 'exact':
+            qs = qs.filter(regions__overlap=regions)
+        else:
+            qs = _match_regions(qs, regions, text_match)
 
     if params.get('rock_types'):
         qs = qs.filter(rock_type__name__in=params['rock_types'].split(','))
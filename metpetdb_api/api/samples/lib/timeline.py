@@ -0,0 +1,77 @@
+"""
+The distribution of the collection dates of a set of samples, for the
+date-range slider of the search interface.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+
+from apps.monitoring import metrics
+from apps.samples.models import Sample
+
+
+# Bucket: its size in days, the unit of Sample.date_precision
+BUCKETS = {'month': 31, 'year': 365}
+
+
+def timeline(ids_qs, bucket):
+    """
+    Counts the samples with a pk in `ids_qs` and a collection_date per
+    `bucket` (month or year), with one grouped query. A sample whose
+    date_precision is coarser than a month is counted in its year even in
+    a monthly timeline, under the bucket's `resolution`; precisions coarser
+    than a year aren't placed and are only counted as `imprecise`.
+    """
+    if bucket not in BUCKETS:
+        raise ValueError('bucket must be one of {}'.format(
+            ', '.join(sorted(BUCKETS))))
+
+    # the coarser of `bucket` and the precision the date is known to
+    precision = 'coalesce(samples.date_precision, 1)'
+    resolution = "CASE WHEN {} > {} THEN 'year' ELSE '{}' END".format(
+        precision, BUCKETS['month'], bucket)
+    qs = (Sample
+          .objects
+          .filter(pk__in=ids_qs, collection_date__isnull=False)
+          .extra(select={
+              'resolution': resolution,
+              'start': """
+                  CASE WHEN {} > {} THEN NULL
+                  ELSE date_trunc({}, samples.collection_date) END
+              """.format(precision, BUCKETS['year'], resolution),
+          })
+          .values('resolution', 'start')
+          .annotate(count=Count('id'))
+          .order_by('start', 'resolution'))
+
+    buckets, imprecise = [], 0
+    for row in qs:
+        if row['start'] is None:
+            imprecise += row['count']
+        else:
+            buckets.append({'start': row['start'].date().isoformat(),
+                            'resolution': row['resolution'],
+                            'count': row['count']})
+    return {'bucket': bucket, 'buckets': buckets, 'imprecise': imprecise}
+
+
+def cached_timeline(user, params, ids_qs, bucket):
+    """
+    timeline(), cached for settings.SAMPLE_TIMELINE_CACHE_SECONDS per user
+    and query string, as the slider asks again whenever a filter changes.
+    """
+    key = 'sample_timeline:{}'.format(hashlib.sha1(json.dumps([
+        str(user.pk) if user.is_authenticated() else None,
+        sorted((name, params.getlist(name)) for name in params),
+    ]).encode('utf-8')).hexdigest())
+    result = cache.get(key)
+    if result is None:
+        metrics.CACHE_REQUESTS.inc(cache='sample_timeline', result='miss')
+        result = timeline(ids_qs, bucket)
+        cache.set(key, result, settings.SAMPLE_TIMELINE_CACHE_SECONDS)
+    else:
+        metrics.CACHE_REQUESTS.inc(cache='sample_timeline', result='hit')
+    return result
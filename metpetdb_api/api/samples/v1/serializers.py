@@ -3,7 +3,6 @@ from rest_framework import serializers
 from api.lib.serializers import DynamicFieldsModelSerializer
 from api.users.v1.serializers import UserSerializer
 
-from apps.chemical_analyses.models import ChemicalAnalysis
 from apps.samples.models import (
     MetamorphicGrade,
     MetamorphicRegion,
@@ -42,7 +41,9 @@ class SampleMineralSerializer(DynamicFieldsModelSerializer):
                       )
     class Meta:
         model = SampleMineral
-        fields = ('id', 'name', 'amount', 'real_mineral_id',)
+        fields = ('id', 'name', 'amount', 'amount_min', 'amount_max',
+                  'real_mineral_id',)
+        read_only_fields = ('amount_min', 'amount_max')
 
 
 class SampleSerializer(DynamicFieldsModelSerializer):
@@ -50,14 +51,28 @@ class SampleSerializer(DynamicFieldsModelSerializer):
                                        many=True)
     owner = UserSerializer(read_only=True)
 
-    # TODO: figure out if there is a better, more efficient way to do this
+    # These read from the subsamples prefetched by sample_qs_optimizer, so
+    # that listing samples doesn't cost two queries per sample.
     subsample_ids = serializers.SerializerMethodField()
     chemical_analyses_ids = serializers.SerializerMethodField()
 
+    # Only with ?include=composition_summary
+    composition_summary = serializers.SerializerMethodField()
+
     class Meta:
         model = Sample
         depth = 1
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        try:
+            include = self.context['request'].query_params.get('include')
+        except KeyError:
+            include = None
+        if 'composition_summary' not in (include or '').split(','):
+            self.fields.pop('composition_summary', None)
+
     def is_valid(self, raise_exception=False):
         super().is_valid(raise_exception)
 
@@ -92,13 +107,22 @@ class SampleSerializer(DynamicFieldsModelSerializer):
         return instance
 
     def get_subsample_ids(self, obj):
-        return Subsample.objects.filter(sample_id=obj.pk).values_list('id',
-                                                                      flat=True)
+        return [subsample.pk for subsample in obj.subsamples.all()]
 
     def get_chemical_analyses_ids(self, obj):
-        subsample_ids = obj.subsamples.values_list('id', flat=True)
-        return ChemicalAnalysis.objects.filter(
-            subsample_id__in=subsample_ids).values_list('id', flat=True)
+        return [chemical_analysis.pk
+                for subsample in obj.subsamples.all()
+                for chemical_analysis in subsample.chemical_analyses.all()]
+
+    def get_composition_summary(self, obj):
+        return [{'mineral_id': summary.mineral_id,
+                 'mineral': summary.mineral.name,
+                 'oxide_id': summary.oxide_id,
+                 'oxide': summary.oxide.species,
+                 'count': summary.count,
+                 'mean': summary.mean,
+                 'stddev': summary.stddev}
+                for summary in obj.composition_summaries.all()]
 
 
 class SubsampleSerializer(DynamicFieldsModelSerializer):
@@ -1,16 +1,25 @@
 import json
 import random
 from copy import deepcopy
+from datetime import datetime
+from unittest import mock
 
+from django.contrib.gis.geos import Point
+from django.core.cache import cache
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APIClient, APITestCase
 
+from apps.monitoring import metrics
 from apps.samples.models import (
     GeoReference,
     MetamorphicGrade,
     MetamorphicRegion,
     Mineral,
+    MineralRelationship,
+    Region,
     RockType,
+    Sample,
 )
 from apps.users.models import User
 
@@ -175,3 +184,187 @@ class SampleTests(APITestCase):
 
         res = client.post('/samples/', self.sample_data)
         self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+    def test_minerals_expand_to_group_members_and_synonyms(self):
+        client = APIClient()
+        client.credentials(
+            HTTP_AUTHORIZATION='Token ' + self.contributor1.auth_token.key
+        )
+        # minerals[4] is a group with member minerals[0], whose synonym
+        # minerals[5] is what the sample lists
+        MineralRelationship.objects.create(parent_mineral=self.minerals[4],
+                                           child_mineral=self.minerals[0])
+        sample_data = deepcopy(self.sample_data)
+        sample_data['minerals'] = [{"id": str(self.minerals[5].pk),
+                                    "amount": "x"}]
+        res = client.post('/api/samples/', sample_data)
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+        def numbers(params):
+            res = client.get('/api/samples/', params)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            return [sample['number'] for sample
+                    in json.loads(res.content.decode('utf-8'))['results']]
+
+        group = self.minerals[4].name
+        self.assertEqual(numbers({'minerals': group}), [])
+        for name in (group, self.minerals[0].name, self.minerals[5].name):
+            self.assertEqual(numbers({'minerals': name,
+                                      'minerals_expand': 'True'}),
+                             [sample_data['number']])
+        self.assertEqual(numbers({'minerals': self.minerals[1].name,
+                                  'minerals_expand': 'True'}), [])
+
+
+    def test_abundance_ranges(self):
+        client = APIClient()
+        client.credentials(
+            HTTP_AUTHORIZATION='Token ' + self.contributor1.auth_token.key
+        )
+        sample_data = deepcopy(self.sample_data)
+        sample_data['minerals'] = [
+            {"id": str(self.minerals[0].pk), "amount": "20-30%"},
+            {"id": str(self.minerals[1].pk), "amount": "tr"},
+            {"id": str(self.minerals[2].pk), "amount": "x"},
+        ]
+        res = client.post('/api/samples/', sample_data)
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        res = client.get('/api/samples/{}/'.format(
+            json.loads(res.content.decode('utf-8'))['id']))
+        bounds = {mineral['id']: (mineral['amount_min'],
+                                  mineral['amount_max'])
+                  for mineral in json.loads(res.content.decode('utf-8'))[
+                      'minerals']}
+        self.assertEqual(bounds[str(self.minerals[0].pk)], (20, 30))
+        self.assertEqual(bounds[str(self.minerals[1].pk)], (0, 1))
+        self.assertEqual(bounds[str(self.minerals[2].pk)], (None, None))
+
+        def count(abundance_ranges):
+            res = client.get('/api/samples/',
+                             {'abundance_ranges': abundance_ranges})
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            return json.loads(res.content.decode('utf-8'))['count']
+
+        first, second, third = [mineral.name for mineral in self.minerals[:3]]
+        self.assertEqual(count('{}:20:'.format(first)), 1)
+        self.assertEqual(count('{}:25:'.format(first)), 0)
+        self.assertEqual(count('{}:15:40,{}::2'.format(first, second)), 1)
+        self.assertEqual(count('{}:0:'.format(third)), 0)
+        res = client.get('/api/samples/', {'abundance_ranges': first})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+    def test_lookup_by_number_or_alias(self):
+        client = APIClient()
+        client.credentials(
+            HTTP_AUTHORIZATION='Token ' + self.contributor1.auth_token.key
+        )
+        sample_data = deepcopy(self.sample_data)
+        sample_data['number'] = 'MT-001'
+        sample_data['aliases'] = ['Legacy 17', 'mt001']
+        res = client.post('/api/samples/', sample_data)
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        sample_id = json.loads(res.content.decode('utf-8'))['id']
+
+        res = client.get('/api/samples/', {'numbers_or_aliases': 'legacy 17'})
+        self.assertEqual(
+            [sample['id'] for sample
+             in json.loads(res.content.decode('utf-8'))['results']],
+            [sample_id])
+
+        res = client.post('/api/samples/lookup/',
+                          {'identifiers': ['mt-001', 'MT001', 'nope']})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        lookup = json.loads(res.content.decode('utf-8'))
+        self.assertEqual(lookup['matches'], {'mt-001': [sample_id],
+                                             'MT001': [sample_id]})
+        self.assertEqual(lookup['missing'], ['nope'])
+
+        res = client.post('/api/samples/lookup/', {'identifiers': 'MT-001'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+    def test_normalized_and_fuzzy_text_matching(self):
+        client = APIClient()
+        client.credentials(
+            HTTP_AUTHORIZATION='Token ' + self.contributor1.auth_token.key
+        )
+        Region.objects.create(name='Green Mountains')
+        sample_data = deepcopy(self.sample_data)
+        sample_data.update(country='Vermont ', collector_name='José Smith',
+                           regions=['Green Mountains'])
+        res = client.post('/api/samples/', sample_data)
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+        def count(params):
+            res = client.get('/api/samples/', params)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            return json.loads(res.content.decode('utf-8'))['count']
+
+        self.assertEqual(count({'countries': 'vermont'}), 0)
+        self.assertEqual(count({'countries': 'vermont',
+                                'text_match': 'normalized'}), 1)
+        self.assertEqual(count({'collectors': 'jose  smith',
+                                'text_match': 'normalized'}), 1)
+        self.assertEqual(count({'countries': 'Vermnt',
+                                'text_match': 'normalized'}), 0)
+        self.assertEqual(count({'countries': 'Maine,Vermnt',
+                                'text_match': 'fuzzy'}), 1)
+        self.assertEqual(count({'regions': 'green mountain',
+                                'text_match': 'fuzzy'}), 1)
+        self.assertEqual(count({'regions': 'GREEN MOUNTAINS',
+                                'text_match': 'normalized'}), 1)
+
+        res = client.get('/api/samples/', {'countries': 'Vermont',
+                                       'text_match': 'sloppy'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+    def test_timeline(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        # (collection date, date_precision in days)
+        dates = [((2001, 3, 5), 1), ((2001, 3, 20), None), ((2001, 7, 1), 31),
+                 ((2001, 9, 9), 365), ((2002, 1, 1), 3650), (None, None)]
+        for i, (date, precision) in enumerate(dates):
+            Sample.objects.create(
+                number='T{}'.format(i),
+                public_data=True,
+                owner=self.contributor1,
+                rock_type=self.rock_type,
+                collection_date=(timezone.make_aware(datetime(*date),
+                                                     timezone.utc)
+                                 if date else None),
+                date_precision=precision,
+                location_coords=Point(0, 0, srid=4326))
+
+        with mock.patch.object(metrics.CACHE_REQUESTS, 'inc') as inc:
+            res = APIClient().get('/api/samples/timeline/',
+                                  {'bucket': 'month'})
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            cached = APIClient().get('/api/samples/timeline/',
+                                     {'bucket': 'month'})
+        self.assertEqual(cached.content, res.content)
+        self.assertEqual(
+            inc.call_args_list,
+            [mock.call(cache='sample_timeline', result='miss'),
+             mock.call(cache='sample_timeline', result='hit')])
+        timeline = json.loads(res.content.decode('utf-8'))
+        self.assertEqual(
+            [(bucket['start'], bucket['resolution'], bucket['count'])
+             for bucket in timeline['buckets']],
+            [('2001-01-01', 'year', 1), ('2001-03-01', 'month', 2),
+             ('2001-07-01', 'month', 1)])
+        self.assertEqual(timeline['imprecise'], 1)
+
+        res = APIClient().get('/api/samples/timeline/',
+                              {'numbers': 'T0,T3,T4'})
+        timeline = json.loads(res.content.decode('utf-8'))
+        self.assertEqual(
+            [(bucket['start'], bucket['count'])
+             for bucket in timeline['buckets']], [('2001-01-01', 2)])
+        self.assertEqual(timeline['imprecise'], 1)
+
+        res = APIClient().get('/api/samples/timeline/', {'bucket': 'week'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
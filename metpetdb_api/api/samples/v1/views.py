@@ -1,12 +1,18 @@
 from rest_framework import permissions, status, viewsets
+from rest_framework.decorators import list_route
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from api.chemical_analyses.lib.query import chemical_analysis_query
 from api.lib.permissions import IsOwnerOrReadOnly, IsSuperuserOrReadOnly
-from api.lib.query import sample_qs_optimizer, chemical_analyses_qs_optimizer
+from api.lib.query import (
+    chemical_analyses_qs_optimizer,
+    get_objects_by_ids,
+    sample_qs_optimizer,
+)
 
-from api.samples.lib.query import sample_query
+from api.samples.lib.query import match_identifiers, sample_query
+from api.samples.lib.timeline import cached_timeline
 from api.samples.v1.serializers import (
     SampleSerializer,
     RockTypeSerializer,
@@ -37,12 +43,20 @@ from apps.samples.models import (
 )
 
 
+# The most identifiers a single lookup resolves
+MAX_LOOKUP_IDENTIFIERS = 10000
+
+
 class SampleViewSet(viewsets.ModelViewSet):
     queryset = Sample.objects.all()
     serializer_class = SampleSerializer
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,
                           IsOwnerOrReadOnly,)
 
+    def get_queryset(self):
+        return sample_qs_optimizer(self.request.query_params,
+                                   Sample.objects.all())
+
     def get_serializer(self, *args, **kwargs):
         if self.request.method == 'PUT':
             kwargs['partial'] = True
@@ -61,7 +75,7 @@ class SampleViewSet(viewsets.ModelViewSet):
                   .objects
                   .filter(subsamples__chemical_analyses__id__in=chem_ids))
         else:
-            qs = self.get_queryset().distinct()
+            qs = Sample.objects.all().distinct()
             try:
                 qs = sample_query(request.user, params, qs)
             except ValueError as err:
@@ -81,46 +95,89 @@ class SampleViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 
+    @list_route()
+    def timeline(self, request, *args, **kwargs):
+        """
+        Counts of the filtered samples per `?bucket=` (month or year) of
+        their collection date, for the date-range slider.
+        """
+        params = request.query_params
+        try:
+            ids = sample_query(request.user, params,
+                               Sample.objects.all()).values('pk')
+            result = cached_timeline(request.user, params, ids,
+                                     params.get('bucket') or 'year')
+        except ValueError as err:
+            return Response(data={'error': err.args}, status=400)
+        return Response(result)
+
+    @list_route(methods=['post'], permission_classes=(permissions.AllowAny,))
+    def lookup(self, request, *args, **kwargs):
+        """
+        Resolves the sample numbers or aliases POSTed as `{"identifiers":
+        [...]}`, case-insensitively, to the ids of the visible samples
+        they name, in one query however many there are.
+        """
+        identifiers = request.data.get('identifiers')
+        if (not isinstance(identifiers, list) or
+                not all(isinstance(identifier, str)
+                        for identifier in identifiers)):
+            return Response(
+                data={'error': 'identifiers must be a list of strings'},
+                status=400
+            )
+        if len(identifiers) > MAX_LOOKUP_IDENTIFIERS:
+            return Response(
+                data={'error': 'At most {} identifiers can be looked up '
+                               'at once'.format(MAX_LOOKUP_IDENTIFIERS)},
+                status=400
+            )
+
+        requested = {}
+        for identifier in identifiers:
+            requested.setdefault(identifier.lower(), []).append(identifier)
+        qs = match_identifiers(sample_query(request.user, {},
+                                            Sample.objects.all()),
+                               identifiers)
+        matches = {}
+        for pk, number, aliases in qs.values_list('pk', 'number', 'aliases'):
+            names = set(name.lower() for name in [number] + (aliases or []))
+            for name in names:
+                for identifier in requested.get(name, ()):
+                    matches.setdefault(identifier, []).append(str(pk))
+
+        return Response({
+            'matches': matches,
+            'missing': [identifier for identifier in identifiers
+                        if identifier not in matches],
+        })
+
+
     def _handle_metamorphic_regions(self, instance, ids):
-        metamorphic_regions = []
-        for id in ids:
-            try:
-                metamorphic_region = MetamorphicRegion.objects.get(pk=id)
-            except:
-                raise ValueError('Invalid metamorphic_region id: {}'
-                                 .format(id))
-            else:
-                metamorphic_regions.append(metamorphic_region)
-        instance.metamorphic_regions = metamorphic_regions
+        instance.metamorphic_regions = get_objects_by_ids(MetamorphicRegion,
+                                                          ids,
+                                                          'metamorphic_region')
 
 
     def _handle_metamorphic_grades(self, instance, ids):
-        metamorphic_grades = []
-        for id in ids:
-            try:
-                metamorphic_grade = MetamorphicGrade.objects.get(pk=id)
-            except:
-                raise ValueError('Invalid metamorphic_grade id: {}'.format(id))
-            else:
-                metamorphic_grades.append(metamorphic_grade)
-        instance.metamorphic_grades = metamorphic_grades
+        instance.metamorphic_grades = get_objects_by_ids(MetamorphicGrade,
+                                                         ids,
+                                                         'metamorphic_grade')
 
 
     def _handle_minerals(self, instance, minerals):
-        to_add = []
-        for record in minerals:
-            try:
-                to_add.append(
-                    {'mineral': Mineral.objects.get(pk=record['id']),
-                     'amount': record['amount']})
-            except Mineral.DoesNotExist:
-                raise ValueError('Invalid mineral id: {}'.format(record['id']))
-
+        mineral_objs = get_objects_by_ids(Mineral,
+                                          [record['id'] for record in minerals],
+                                          'mineral')
+
+        rows = [SampleMineral(sample=instance,
+                              mineral=mineral,
+                              amount=record['amount'])
+                for mineral, record in zip(mineral_objs, minerals)]
+        for row in rows:
+            row.set_amount_bounds()
         SampleMineral.objects.filter(sample=instance).delete()
-        for record in to_add:
-            SampleMineral.objects.create(sample=instance,
-                                         mineral=record['mineral'],
-                                         amount=record['amount'])
+        SampleMineral.objects.bulk_create(rows)
 
 
     def _handle_references(self, instance, references):
@@ -254,13 +311,21 @@ class SampleViewSet(viewsets.ModelViewSet):
             self._handle_references(instance, params['references'])
 
         instance.save()
-        # refresh the data before returning a response
-        serializer = self.get_serializer(instance)
+        # refresh the data before returning a response; the instance's
+        # prefetched relations are stale by now
+        serializer = self.get_serializer(self.get_object())
         return Response(serializer.data)
 
 
 class SubsampleViewSet(viewsets.ModelViewSet):
-    queryset = Subsample.objects.all()
+    queryset = (Subsample
+                .objects
+                .all()
+                .select_related('sample', 'owner', 'subsample_type')
+                .prefetch_related('sample__metamorphic_regions',
+                                  'sample__metamorphic_grades',
+                                  'sample__minerals',
+                                  'sample__references'))
     serializer_class = SubsampleSerializer
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,
                           IsOwnerOrReadOnly,)
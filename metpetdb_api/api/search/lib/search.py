@@ -0,0 +1,82 @@
+"""
+Full-text search over samples, georeferences, minerals and rock types,
+through the search_vector columns (see the samples app's
+0007_search_vectors migration) and their GIN indexes.
+"""
+from django.db import connection
+
+
+# type: (table, title column, the columns a snippet is taken from,
+#        extra condition)
+SOURCES = {
+    'sample': ('samples', 'number',
+               ('number', 'location_name', 'description'),
+               '(t.public_data OR t.owner_id = %(user_id)s)'),
+    'reference': ('georeferences', 'coalesce(title, name)',
+                  ('title', 'first_author', 'journal_name', 'doi',
+                   'full_text'), None),
+    'mineral': ('minerals', 'name', ('name',), None),
+    'rock_type': ('rock_types', 'name', ('name',), None),
+}
+
+MAX_LIMIT = 100
+
+# Words match whether or not they are stemmed, as identifiers and names
+# are indexed with the 'simple' configuration
+_QUERY = ("(plainto_tsquery('english', %(q)s) || "
+          "plainto_tsquery('simple', %(q)s))")
+
+
+def _hits_sql(kind):
+    table, title, _, condition = SOURCES[kind]
+    return """
+        SELECT '{kind}' AS type, t.id, {title} AS title,
+               ts_rank(t.search_vector, {query}) AS rank
+        FROM {table} t
+        WHERE t.search_vector @@ {query}
+        {condition}
+    """.format(kind=kind, title=title, query=_QUERY, table=table,
+               condition='AND ' + condition if condition else '')
+
+
+def _document_sql(kind):
+    table, _, columns, _ = SOURCES[kind]
+    return "(SELECT concat_ws(' ', {}) FROM {} WHERE id = hit.id)".format(
+        ', '.join(columns), table)
+
+
+def search(user, q, types=None, limit=20):
+    """
+    The best `limit` matches of `q` among the given types (all of SOURCES by
+    default), best first, as dicts with type, id, title, rank and a
+    snippet with the matching words in <b></b>. Only samples `user` can
+    see are included.
+    """
+    types = types or sorted(SOURCES)
+    unknown = set(types) - set(SOURCES)
+    if unknown:
+        raise ValueError('Unknown types: {}'.format(
+            ', '.join(sorted(unknown))))
+    if not 1 <= limit <= MAX_LIMIT:
+        raise ValueError('limit must be between 1 and {}'.format(MAX_LIMIT))
+
+    # snippets only for the hits returned, as ts_headline reparses the text
+    sql = """
+        SELECT hit.type, hit.id, hit.title, hit.rank,
+               ts_headline('english', CASE hit.type {documents} END, {query},
+                           'MaxFragments=2, MaxWords=20, MinWords=5')
+        FROM ({hits} ORDER BY rank DESC LIMIT %(limit)s) hit
+        ORDER BY hit.rank DESC, hit.type, hit.title
+    """.format(
+        documents=' '.join("WHEN '{}' THEN {}".format(kind,
+                                                      _document_sql(kind))
+                           for kind in types),
+        query=_QUERY,
+        hits=' UNION ALL '.join(_hits_sql(kind) for kind in types))
+
+    user_id = str(user.pk) if user.is_authenticated() else None
+    with connection.cursor() as cursor:
+        cursor.execute(sql, {'q': q, 'limit': limit, 'user_id': user_id})
+        return [{'type': kind, 'id': str(pk), 'title': title, 'rank': rank,
+                 'snippet': snippet}
+                for kind, pk, title, rank, snippet in cursor.fetchall()]
@@ -0,0 +1,63 @@
+import json
+
+from django.contrib.gis.geos import Point
+from rest_framework import status
+from rest_framework.test import APIClient, APITestCase
+
+from apps.samples.models import GeoReference, Mineral, RockType, Sample
+from apps.users.models import User
+
+
+class SearchTests(APITestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user(email='owner@metpetdb.com',
+                                              password='owner',
+                                              is_active=True)
+        schist = RockType.objects.create(name='Schist')
+        for number, public in (('VT-1', True), ('VT-2', False)):
+            Sample.objects.create(
+                number=number,
+                public_data=public,
+                owner=self.owner,
+                rock_type=schist,
+                location_name='Gile Mountain',
+                description='Coarse garnets overgrowing the foliation',
+                location_coords=Point(-72.5, 43.9, srid=4326))
+        GeoReference.objects.create(name='Smith 2001',
+                                    title='Garnet zoning in pelites',
+                                    first_author='Smith')
+        Mineral.objects.create(name='Garnet')
+
+    def _search(self, params, client=None):
+        res = (client or APIClient()).get('/api/search/', params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return json.loads(res.content.decode('utf-8'))['results']
+
+
+    def test_ranked_typed_hits(self):
+        hits = self._search({'q': 'garnet'})
+        self.assertEqual(sorted((hit['type'], hit['title']) for hit in hits),
+                         [('mineral', 'Garnet'),
+                          ('reference', 'Garnet zoning in pelites'),
+                          ('sample', 'VT-1')])
+        self.assertEqual([hit['rank'] for hit in hits],
+                         sorted((hit['rank'] for hit in hits), reverse=True))
+        sample, = [hit for hit in hits if hit['type'] == 'sample']
+        self.assertIn('<b>garnets</b>', sample['snippet'])
+
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' +
+                           self.owner.auth_token.key)
+        hits = self._search({'q': 'gile mountain', 'types': 'sample'},
+                            client)
+        self.assertEqual(sorted(hit['title'] for hit in hits),
+                         ['VT-1', 'VT-2'])
+        self.assertEqual(self._search({'q': 'vt-2'}), [])
+
+
+    def test_invalid_searches_are_rejected(self):
+        for params in ({}, {'q': ' '}, {'q': 'garnet', 'types': 'rock'},
+                       {'q': 'garnet', 'limit': 0}):
+            res = APIClient().get('/api/search/', params)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,24 @@
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from api.search.lib.search import search
+
+
+class SearchView(APIView):
+    def get(self, request, format=None):
+        """
+        Ranked full-text matches of `?q=` among samples, references,
+        minerals and rock types; `?types=sample,reference` narrows the
+        types and `?limit=` sets how many hits are returned.
+        """
+        params = request.query_params
+        if not params.get('q', '').strip():
+            return Response(data={'error': 'q is required'}, status=400)
+
+        try:
+            types = params['types'].split(',') if params.get('types') else None
+            limit = int(params.get('limit') or 20)
+            hits = search(request.user, params['q'], types, limit)
+        except ValueError as err:
+            return Response(data={'error': err.args}, status=400)
+        return Response({'results': hits})
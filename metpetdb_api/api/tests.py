@@ -0,0 +1,387 @@
+import os
+import shutil
+import tempfile
+import tracemalloc
+import uuid
+from unittest import mock
+
+from django.db import connection
+from django.test import override_settings
+from rest_framework import status
+from rest_framework.test import APIClient, APITestCase
+
+from api.lib.testing import QueryCountMixin, build_dataset
+from apps.monitoring import (
+    context,
+    metrics,
+    profiling,
+    query_plans,
+    slow_queries,
+)
+from apps.monitoring.models import SlowQuery
+from apps.users.models import User
+from metpetdb_api.urls import router
+
+
+SMALL = 2
+LARGE = 10
+
+
+def _element_records(elements):
+    return [{'id': str(element.pk),
+             'amount': 1.0,
+             'precision': None,
+             'precision_type': None,
+             'measurement_unit': 'ppm',
+             'min_amount': None,
+             'max_amount': None} for element in elements]
+
+
+class QueryCountTests(QueryCountMixin, APITestCase):
+    """
+    The number of queries each viewset action makes must not depend on how
+    many objects it returns or how many related objects it writes.
+    """
+
+    def setUp(self):
+        self.superuser = User.objects.create_superuser(
+            email='superuser1@metpetb.com',
+            password='superuser1',
+            is_active=True
+        )
+        self.client = APIClient()
+        self.client.credentials(
+            HTTP_AUTHORIZATION='Token ' + self.superuser.auth_token.key
+        )
+
+    def _readable_viewsets(self):
+        for prefix, viewset, base_name in router.registry:
+            if 'get' in viewset.http_method_names:
+                yield prefix, viewset
+
+    def _read_queries(self, dataset):
+        by_model = {type(objs[0]): objs for objs in dataset.values()}
+        queries = {}
+        for prefix, viewset in self._readable_viewsets():
+            res, queries[(prefix, 'list')] = self.capture_queries(
+                self.client.get, '/api/{}/?page_size=1000'.format(prefix))
+            self.assertEqual(res.status_code, status.HTTP_200_OK, prefix)
+
+            model = viewset.queryset.model
+            obj = by_model.get(model, [model.objects.last()])[-1]
+            res, queries[(prefix, 'retrieve')] = self.capture_queries(
+                self.client.get, '/api/{}/{}/'.format(prefix, obj.pk))
+            self.assertEqual(res.status_code, status.HTTP_200_OK, prefix)
+        return queries
+
+    def test_reads_make_a_constant_number_of_queries(self):
+        small = self._read_queries(build_dataset(SMALL, self.superuser, 'a'))
+        large = self._read_queries(build_dataset(LARGE, self.superuser, 'b'))
+
+        for key in sorted(small):
+            self.assertConstantQueries(small[key], large[key],
+                                       '{} {}'.format(*key))
+
+    def _sample_data(self, dataset, size):
+        return {
+            'number': 'q{}'.format(size),
+            'owner': str(self.superuser.pk),
+            'rock_type_id': str(dataset['samples'][0].rock_type_id),
+            'location_coords': 'SRID=4326;POINT (-118.4 49.1)',
+            'minerals': [{'id': str(mineral.pk), 'amount': 'x'}
+                         for mineral in dataset['minerals'][:size]],
+            'metamorphic_grade_ids': [
+                str(grade.pk)
+                for grade in dataset['metamorphic_grades'][:size]],
+            'metamorphic_region_ids': [
+                str(region.pk)
+                for region in dataset['metamorphic_regions'][:size]],
+        }
+
+    def _chemical_analysis_data(self, dataset, size):
+        return {
+            'spot_id': size,
+            'owner': str(self.superuser.pk),
+            'subsample_id': str(dataset['subsamples'][0].pk),
+            'mineral_id': str(dataset['minerals'][0].pk),
+            'elements': _element_records(dataset['elements'][:size]),
+            'oxides': _element_records(dataset['oxides'][:size]),
+        }
+
+    def _write_queries(self, prefix, data):
+        res, create = self.capture_queries(
+            self.client.post, '/api/{}/'.format(prefix), data)
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED, res.data)
+
+        res, update = self.capture_queries(
+            self.client.put, '/api/{}/{}/'.format(prefix, res.data['id']),
+            data)
+        self.assertEqual(res.status_code, status.HTTP_200_OK, res.data)
+        return create, update
+
+    def test_sample_writes_make_a_constant_number_of_queries(self):
+        dataset = build_dataset(LARGE, self.superuser)
+        small = self._write_queries('samples',
+                                    self._sample_data(dataset, SMALL))
+        large = self._write_queries('samples',
+                                    self._sample_data(dataset, LARGE))
+
+        self.assertConstantQueries(small[0], large[0], 'samples create')
+        self.assertConstantQueries(small[1], large[1], 'samples update')
+
+    def test_chemical_analysis_writes_make_a_constant_number_of_queries(self):
+        dataset = build_dataset(LARGE, self.superuser)
+        small = self._write_queries(
+            'chemical_analyses', self._chemical_analysis_data(dataset, SMALL))
+        large = self._write_queries(
+            'chemical_analyses', self._chemical_analysis_data(dataset, LARGE))
+
+        self.assertConstantQueries(small[0], large[0],
+                                   'chemical_analyses create')
+        self.assertConstantQueries(small[1], large[1],
+                                   'chemical_analyses update')
+
+
+class MonitoringTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='contributor1@metpetb.com',
+            password='contributor1',
+            is_active=True
+        )
+        self.superuser = User.objects.create_superuser(
+            email='superuser1@metpetb.com',
+            password='superuser1',
+            is_active=True
+        )
+
+    def _client(self, user=None):
+        client = APIClient()
+        if user is not None:
+            client.credentials(
+                HTTP_AUTHORIZATION='Token ' + user.auth_token.key)
+        return client
+
+    def _queued_slow_queries(self):
+        records = []
+        while not slow_queries._queue.empty():
+            records.append(slow_queries._queue.get_nowait())
+        return records
+
+    @override_settings(SLOW_QUERY_THRESHOLD_MS=20)
+    def test_slow_queries_are_recorded(self):
+        self._queued_slow_queries()
+        # store the records on this thread, inside the test's transaction
+        with mock.patch.object(slow_queries, '_ensure_worker'):
+            context.set_request_context('SampleViewSet.list', 'minerals')
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                    cursor.execute('SELECT pg_sleep(%s)', [0.05])
+            finally:
+                context.clear_request_context()
+        records = self._queued_slow_queries()
+
+        self.assertEqual([record['sql'] for record in records],
+                         ['SELECT pg_sleep(%s)'])
+        self.assertEqual(records[0]['view_name'], 'SampleViewSet.list')
+        self.assertEqual(records[0]['query_shape'], 'minerals')
+        self.assertGreaterEqual(records[0]['duration'], 50)
+
+        slow_queries._store(records[0])
+        slow_queries._store(dict(records[0], params='[0.06]'))
+        shape, = slow_queries.worst_query_shapes()
+        self.assertEqual(shape['count'], 2)
+        self.assertEqual(shape['sql'], 'SELECT pg_sleep(%s)')
+        self.assertEqual(shape['view_name'], 'SampleViewSet.list')
+        self.assertIsNone(SlowQuery.objects.first().plan)
+
+    def test_fingerprints_ignore_literals_and_in_lists(self):
+        self.assertEqual(
+            slow_queries.fingerprint(
+                "SELECT * FROM samples WHERE number = 'a' AND id IN (%s)"),
+            slow_queries.fingerprint(
+                "SELECT *  FROM samples\nWHERE number = 'b''c' "
+                "AND id IN (%s, %s, %s)"))
+        self.assertNotEqual(
+            slow_queries.fingerprint('SELECT * FROM samples'),
+            slow_queries.fingerprint('SELECT * FROM subsamples'))
+
+    def test_long_query_shapes_fit_their_column(self):
+        params = {'p{:03d}'.format(i): '1' for i in range(200)}
+        shape = context.query_shape(params)
+        self.assertEqual(len(shape), context.MAX_QUERY_SHAPE_LENGTH)
+        self.assertTrue(shape.startswith('p000&p001&'))
+
+        slow_queries._store({'alias': 'default', 'duration': 600.0,
+                             'sql': 'SELECT 1', 'params': None,
+                             'statement': None, 'view_name': None,
+                             'query_shape': shape})
+        self.assertEqual(SlowQuery.objects.get().query_shape, shape)
+
+    def test_slow_queries_are_for_superusers_only(self):
+        res = self._client().get('/api/_slow_queries/')
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+        res = self._client(self.user).get('/api/_slow_queries/')
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+        res = self._client(self.superuser).get('/api/_slow_queries/')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, {'query_shapes': []})
+        res = self._client(self.superuser).get(
+            '/api/_slow_queries/?limit=x')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def _in_metrics_file(self, path):
+        # makes the metrics of this process go to `path`
+        metrics._values = metrics._ValueFile(path)
+        metrics._values_pid = os.getpid()
+
+    def test_metrics_add_up_across_processes(self):
+        metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, metrics_dir)
+        self.addCleanup(setattr, metrics, '_values', None)
+
+        with override_settings(METRICS_DIR=metrics_dir):
+            for pid, latency in ((1, 0.02), (2, 0.2)):
+                self._in_metrics_file(
+                    os.path.join(metrics_dir, 'values_{}.db'.format(pid)))
+                metrics.CACHE_REQUESTS.inc(cache='timeline', result='hit')
+                metrics.REQUEST_LATENCY.observe(
+                    latency, view='SampleViewSet.list', filter_shape='')
+            metrics.CACHE_REQUESTS.inc(cache='timeline', result='miss')
+            lines = metrics.exposition().splitlines()
+            totals = metrics.collect()
+
+        self.assertIn('# TYPE metpetdb_cache_requests_total counter', lines)
+        self.assertIn('metpetdb_cache_requests_total'
+                      '{cache="timeline",result="hit"} 2.0', lines)
+        self.assertIn('metpetdb_cache_requests_total'
+                      '{cache="timeline",result="miss"} 1.0', lines)
+
+        series = 'filter_shape="",le="{}",view="SampleViewSet.list"'
+        self.assertIn('# TYPE metpetdb_request_duration_seconds histogram',
+                      lines)
+        for le, count in (('0.01', 0), ('0.025', 1), ('0.25', 2),
+                          ('+Inf', 2)):
+            line = 'metpetdb_request_duration_seconds_bucket{{{}}} {}'.format(
+                series.format(le), float(count))
+            if count:
+                self.assertIn(line, lines)
+            else:
+                self.assertNotIn(line, lines)
+        labels = (('filter_shape', ''), ('view', 'SampleViewSet.list'))
+        self.assertEqual(
+            totals[('metpetdb_request_duration_seconds_count', labels)], 2)
+        self.assertAlmostEqual(
+            totals[('metpetdb_request_duration_seconds_sum', labels)], 0.22)
+
+    def test_filter_shapes_only_name_known_filters(self):
+        self.assertEqual(
+            context.filter_shape({'rock_types': 'x', 'minerals': 'y',
+                                  'page': '2', 'include': 'composition'}),
+            'minerals&rock_types')
+        self.assertEqual(
+            context.filter_shape({'minerals': 'y', 'a': '1', 'b': '2'}),
+            'minerals&other')
+
+    @override_settings(METRICS_TOKEN='scraper-token')
+    def test_metrics_are_for_superusers_and_scrapers(self):
+        res = self._client().get('/api/_metrics')
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+        res = self._client(self.user).get('/api/_metrics')
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+        res = self._client().get('/api/_metrics',
+                                 HTTP_AUTHORIZATION='Bearer wrong-token')
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        res = self._client(self.superuser).get('/api/_metrics')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        res = self._client().get('/api/_metrics',
+                                 HTTP_AUTHORIZATION='Bearer scraper-token')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIn(b'# TYPE metpetdb_request_duration_seconds histogram',
+                      res.content)
+
+    def _profile_dir(self):
+        profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, profile_dir)
+        return profile_dir
+
+    def test_superusers_can_profile_requests(self):
+        with override_settings(PROFILE_DIR=self._profile_dir()):
+            res = self._client(self.user).get('/api/_slow_queries/',
+                                              HTTP_X_PROFILE='cpu')
+            self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+            self.assertNotIn('X-Profile-Id', res)
+
+            for mode in ('cpu', 'memory'):
+                res = self._client(self.superuser).get(
+                    '/api/_slow_queries/', HTTP_X_PROFILE=mode)
+                self.assertEqual(res.status_code, status.HTTP_200_OK)
+                self.assertFalse(tracemalloc.is_tracing())
+                res = self._client(self.superuser).get(
+                    '/api/_profiles/{}/'.format(res['X-Profile-Id']),
+                    {'kind': mode, 'summary': 'True'})
+                self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+            res = self._client(self.user).get(
+                '/api/_profiles/{}/'.format(uuid.uuid4().hex))
+            self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_profile_modes_are_validated(self):
+        with override_settings(PROFILE_DIR=self._profile_dir()):
+            res = self._client(self.superuser).get('/api/_slow_queries/',
+                                                   HTTP_X_PROFILE='yes')
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+            # only one request at a time can trace memory
+            with profiling._memory_lock:
+                res = self._client(self.superuser).get(
+                    '/api/_slow_queries/?_profile=memory')
+                self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+                res = self._client(self.superuser).get(
+                    '/api/_slow_queries/?_profile=cpu')
+                self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_only_the_latest_profiles_are_kept(self):
+        profile_dir = self._profile_dir()
+        ids = [uuid.uuid4().hex for _ in range(3)]
+        for age, profile_id in enumerate(reversed(ids)):
+            for extension in ('prof', 'tracemalloc'):
+                path = os.path.join(profile_dir,
+                                    '{}.{}'.format(profile_id, extension))
+                open(path, 'w').close()
+                os.utime(path, (1000 - age, 1000 - age))
+        sampled = os.path.join(profile_dir, 'sampled_1.folded')
+        open(sampled, 'w').close()
+
+        with override_settings(PROFILE_DIR=profile_dir, PROFILE_MAX_COUNT=2):
+            profiling._remove_old_profiles()
+        self.assertEqual(
+            sorted(os.listdir(profile_dir)),
+            sorted(['{}.{}'.format(profile_id, extension)
+                    for profile_id in ids[1:]
+                    for extension in ('prof', 'tracemalloc')] +
+                   ['sampled_1.folded']))
+
+    def test_every_query_plan_case_is_explained(self):
+        build_dataset(SMALL, self.superuser)
+        results, regressions, _, _ = query_plans.run({})
+
+        self.assertEqual(
+            sorted(results),
+            sorted(query_plans.cases(query_plans.default_params())))
+        self.assertTrue(set(query_plans.REQUIRED_INDEXES) <= set(results))
+        # the small dataset is scanned everywhere, and without snapshots
+        # those scans are regressions unless expected
+        for name, tables in regressions.items():
+            scans = query_plans.sequential_scans(results[name]['plan'])
+            expected = query_plans.EXPECTED_SEQUENTIAL_SCANS.get(name, set())
+            self.assertEqual(set(tables), scans - expected)
+        for name in query_plans.EXPECTED_SEQUENTIAL_SCANS:
+            self.assertIn(name, results)
+
+        _, regressions, _, _ = query_plans.run(results)
+        self.assertEqual(regressions, {})
@@ -0,0 +1 @@
+default_app_config = 'apps.chemical_analyses.apps.ChemicalAnalysesConfig'
@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class ChemicalAnalysesConfig(AppConfig):
+    name = 'apps.chemical_analyses'
+
+    def ready(self):
+        # connect the signal receivers
+        from apps.chemical_analyses import signals  # noqa
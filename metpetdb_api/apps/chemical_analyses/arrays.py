@@ -0,0 +1,113 @@
+"""
+Maintains the composition arrays of ChemicalAnalysis (oxide_amounts,
+oxide_precisions, element_amounts, element_precisions): the canonical
+amounts and precisions of an analysis' oxide and element rows, the one of
+the oxide or element with order_id n at (1-based) index n.
+
+Reading a composition from them costs one row of chemical_analyses instead
+of a join to the amounts tables. Readers check layout() first and use the
+amounts tables when order_id can't position every oxide or element.
+Saving an oxide or element with a new order_id rebuilds every analysis'
+arrays; after renumbering them with QuerySet.update() or SQL, run
+`rebuild_composition_arrays`.
+"""
+from django.db import connection, transaction
+
+from apps.chemical_analyses.models import Element, Oxide
+
+
+BATCH_SIZE = 10000
+
+_MIN_ID = '00000000-0000-0000-0000-000000000000'
+_MAX_ID = 'ffffffff-ffff-ffff-ffff-ffffffffffff'
+
+# (array column prefix, amounts table, foreign key, reference table)
+ARRAYS = (
+    ('oxide', 'chemical_analysis_oxides', 'oxide_id', 'oxides'),
+    ('element', 'chemical_analysis_elements', 'element_id', 'elements'),
+)
+
+
+def _slots(rows):
+    slots = {}
+    for pk, name, order_id in rows:
+        if order_id is None or order_id < 1 or order_id in slots:
+            return None
+        slots[order_id] = (str(pk), name)
+    return slots
+
+
+def layout():
+    """
+    {'oxide': {order_id: (id, species)}, 'element': {order_id: (id,
+    symbol)}}, or None if an oxide (with a species) or element has no
+    order_id or shares it with another.
+    """
+    oxides = _slots(Oxide.objects.exclude(species=None)
+                    .values_list('id', 'species', 'order_id'))
+    elements = _slots(Element.objects.values_list('id', 'symbol',
+                                                  'order_id'))
+    if oxides is None or elements is None:
+        return None
+    return {'oxide': oxides, 'element': elements}
+
+
+def _array_sql(table, fk, reference, column):
+    return """
+        CASE WHEN EXISTS (
+            SELECT 0 FROM {table} a WHERE a.chemical_analysis_id = ca.id
+        ) THEN ARRAY(
+            SELECT a.{column}
+            FROM generate_series(1, (SELECT MAX(order_id)
+                                     FROM {reference})) slot
+            LEFT JOIN ({table} a
+                       INNER JOIN {reference} r ON r.id = a.{fk})
+            ON r.order_id = slot AND a.chemical_analysis_id = ca.id
+            ORDER BY slot
+        ) END
+    """.format(table=table, fk=fk, reference=reference, column=column)
+
+
+def _update_sql(where):
+    assignments = []
+    for prefix, table, fk, reference in ARRAYS:
+        assignments.append('{}_amounts = {}'.format(
+            prefix, _array_sql(table, fk, reference, 'canonical_amount')))
+        assignments.append('{}_precisions = {}'.format(
+            prefix, _array_sql(table, fk, reference, 'precision')))
+    return 'UPDATE chemical_analyses ca SET {} WHERE {}'.format(
+        ', '.join(assignments), where)
+
+
+def sync_arrays(chemical_analysis_ids):
+    """
+    Rewrites the composition arrays of the given analyses from their rows.
+    """
+    if not chemical_analysis_ids:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(_update_sql('ca.id = ANY(%s::uuid[])'),
+                       [[str(pk) for pk in chemical_analysis_ids]])
+
+
+def rebuild_all(batch_size=BATCH_SIZE, progress=None):
+    """
+    Rewrites every analysis' composition arrays, `batch_size` analyses (in
+    id order) per transaction.
+    """
+    sql = _update_sql('ca.id > %s AND ca.id <= %s')
+    last = _MIN_ID
+    with connection.cursor() as cursor:
+        while True:
+            cursor.execute('SELECT id FROM chemical_analyses WHERE id > %s '
+                           'ORDER BY id OFFSET %s LIMIT 1',
+                           [last, batch_size - 1])
+            row = cursor.fetchone()
+            upper = str(row[0]) if row else _MAX_ID
+            with transaction.atomic():
+                cursor.execute(sql, [last, upper])
+            if progress is not None:
+                progress(upper)
+            if row is None:
+                return
+            last = upper
@@ -0,0 +1,90 @@
+"""
+Maintains ChemicalAnalysisOxide/Element.canonical_amount, the amount
+converted from its measurement_unit to the canonical unit of its table
+(wt% for oxides, ppm for elements), in bulk.
+
+Rows saved one at a time set it themselves; this backfills rows written
+around the ORM (and the existing rows, from migration 0009) and recomputes
+molar amounts when an Oxide's or Element's weight changes.
+"""
+from django.db import connection, transaction
+
+from apps.chemical_analyses.units import (
+    DEFAULT_ELEMENT_UNIT,
+    DEFAULT_OXIDE_UNIT,
+    MOLAR_UNITS,
+    sql_to_unit,
+)
+
+
+BATCH_SIZE = 50000
+
+_MIN_ID = '00000000-0000-0000-0000-000000000000'
+_MAX_ID = 'ffffffff-ffff-ffff-ffff-ffffffffffff'
+
+# (amounts table, foreign key, reference table, canonical unit)
+TABLES = (
+    ('chemical_analysis_oxides', 'oxide_id', 'oxides', DEFAULT_OXIDE_UNIT),
+    ('chemical_analysis_elements', 'element_id', 'elements',
+     DEFAULT_ELEMENT_UNIT),
+)
+
+
+def _update_sql(table, where):
+    table, fk, reference, unit = table
+    amount, params = sql_to_unit('a.amount', 'a.measurement_unit', unit,
+                                 unit, weight='r.weight')
+    sql = """
+        UPDATE {table} a
+        SET canonical_amount = {amount}
+        FROM {reference} r
+        WHERE r.id = a.{fk}
+        AND {where}
+        AND a.canonical_amount IS DISTINCT FROM {amount}
+    """.format(table=table, fk=fk, reference=reference, amount=amount,
+               where=where)
+    return sql, params
+
+
+def refresh_reference(table, reference_id):
+    """
+    Recomputes the molar amounts of one oxide or element (`table` is one of
+    TABLES) after its weight changed; returns the ids of the analyses whose
+    amounts changed.
+    """
+    sql, params = _update_sql(
+        table, 'r.id = %s AND a.measurement_unit = ANY(%s)')
+    with connection.cursor() as cursor:
+        cursor.execute(sql + ' RETURNING a.chemical_analysis_id',
+                       params + [str(reference_id), sorted(MOLAR_UNITS)] +
+                       params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def backfill(batch_size=BATCH_SIZE, progress=None):
+    """
+    Recomputes canonical_amount for every row of both amounts tables,
+    `batch_size` rows (in id order) per transaction; returns the number of
+    rows changed.
+    """
+    changed = 0
+    with connection.cursor() as cursor:
+        for table in TABLES:
+            sql, params = _update_sql(table, 'a.id > %s AND a.id <= %s')
+            last = _MIN_ID
+            while True:
+                cursor.execute('SELECT id FROM {} WHERE id > %s '
+                               'ORDER BY id OFFSET %s LIMIT 1'
+                               .format(table[0]),
+                               [last, batch_size - 1])
+                row = cursor.fetchone()
+                upper = str(row[0]) if row else _MAX_ID
+                with transaction.atomic():
+                    cursor.execute(sql, params + [last, upper] + params)
+                    changed += cursor.rowcount
+                if progress is not None:
+                    progress(table[0], upper, changed)
+                if row is None:
+                    break
+                last = upper
+    return changed
@@ -0,0 +1,212 @@
+"""
+Suggests a mineral for chemical analyses from their oxide composition.
+
+The candidates are the minerals named like a MineralType. A candidate's
+reference composition is learnt from the analyses already assigned to it:
+the mean and spread of their oxide proportions (wt% closed to 100) over
+the oxides its MineralType links, every other oxide being expected at
+zero. Each analysis is scored against every reference at once, as matrix
+products over a batch of analyses, and gets the most likely candidate with
+its probability among all candidates as the confidence; analyses far from
+every reference get no suggestion.
+"""
+import numpy as np
+from django.db import connection, transaction
+
+from api.chemical_analyses.lib.matrix import composition_matrix
+from apps.chemical_analyses.models import ChemicalAnalysis
+from apps.samples.models import Mineral, MineralType
+
+
+BATCH_SIZE = 20000
+
+_MIN_ID = '00000000-0000-0000-0000-000000000000'
+_MAX_ID = 'ffffffff-ffff-ffff-ffff-ffffffffffff'
+
+# What migrate_legacy_chemical_analyses assigns to analyses of a whole rock,
+# which are classified like the analyses without a mineral
+UNASSIGNED_MINERALS = ('Bulk Rock',)
+
+# Candidates need this many assigned analyses to learn a reference from
+MIN_REFERENCES = 10
+
+# Lower bound on a reference's standard deviation per oxide, in wt%
+MIN_SPREAD = 0.5
+
+# Analyses further than this from every reference, as the root mean square
+# of their per-oxide deviations in standard deviations, get no suggestion
+MAX_DISTANCE = 3.0
+
+
+def _batches(batch_size):
+    # (lower, upper] id bounds of `batch_size` analyses each, in id order
+    last = _MIN_ID
+    with connection.cursor() as cursor:
+        while True:
+            cursor.execute('SELECT id FROM chemical_analyses WHERE id > %s '
+                           'ORDER BY id OFFSET %s LIMIT 1',
+                           [last, batch_size - 1])
+            row = cursor.fetchone()
+            upper = str(row[0]) if row else _MAX_ID
+            yield last, upper
+            if row is None:
+                return
+            last = upper
+
+
+def _proportions(last, upper):
+    """
+    (ids, mineral ids, oxide ids, proportions) of the analyses with an id in
+    (last, upper] and any oxide; unmeasured oxides count as zero.
+    """
+    qs = ChemicalAnalysis.objects.filter(pk__gt=last, pk__lte=upper)
+    matrix = composition_matrix(qs, drop_empty=False)
+    oxides = [i for i, column in enumerate(matrix.columns)
+              if column['type'] == 'oxide']
+    amounts = np.nan_to_num(matrix.amounts[:, oxides])
+    totals = amounts.sum(axis=1)
+    measured = totals > 0
+
+    minerals = dict((str(pk), mineral_id and str(mineral_id))
+                    for pk, mineral_id in qs.values_list('pk', 'mineral_id'))
+    ids = [pk for pk, ok in zip(matrix.ids, measured) if ok]
+    return (ids, [minerals.get(pk) for pk in ids],
+            [matrix.columns[i]['id'] for i in oxides],
+            amounts[measured] / totals[measured, np.newaxis] * 100)
+
+
+class References(object):
+    """
+    The reference compositions of the candidate minerals over `oxides`.
+    """
+
+    def __init__(self, candidates, oxides, means, spreads):
+        self.candidates = candidates
+        self.oxides = oxides
+        self.means = means
+        self.spreads = spreads
+
+    def distances(self, proportions):
+        """
+        The squared distances of every row of `proportions` to every
+        reference, in standard deviations summed over the oxides.
+        """
+        weights = 1 / self.spreads ** 2
+        return (np.dot(proportions ** 2, weights.T) -
+                2 * np.dot(proportions, (self.means * weights).T) +
+                (self.means ** 2 * weights).sum(axis=1))
+
+    def classify(self, proportions):
+        """
+        The index of the most likely candidate per row (-1 when it isn't
+        near enough) and its probability among the candidates.
+        """
+        distances = np.maximum(self.distances(proportions), 0)
+        # log-likelihoods under independent normal distributions per oxide
+        scores = -distances / 2 - np.log(self.spreads).sum(axis=1)
+        nearest = scores.argmax(axis=1)
+        rows = np.arange(len(scores))
+        likelihoods = np.exp(scores - scores[rows, nearest][:, np.newaxis])
+        confidence = 1 / likelihoods.sum(axis=1)
+        far = distances[rows, nearest] / len(self.oxides) > MAX_DISTANCE ** 2
+        nearest[far] = -1
+        confidence[far] = np.nan
+        return nearest, confidence
+
+
+def learn(batch_size=BATCH_SIZE):
+    """
+    Learns the references from the analyses assigned to a candidate, or
+    returns None when no mineral has enough of them.
+    """
+    types = {}
+    for mineral_type in MineralType.objects.prefetch_related('oxides'):
+        types[mineral_type.name] = set(str(oxide.pk) for oxide
+                                       in mineral_type.oxides.all())
+    minerals = dict((str(pk), name) for pk, name in (
+        Mineral.objects
+        .filter(name__in=list(types))
+        .exclude(name__in=UNASSIGNED_MINERALS)
+        .values_list('pk', 'name')))
+    codes = dict((pk, i) for i, pk in enumerate(sorted(minerals)))
+
+    oxides = sums = squares = counts = None
+    for last, upper in _batches(batch_size):
+        _, mineral_ids, batch_oxides, proportions = _proportions(last, upper)
+        if oxides is None:
+            oxides = batch_oxides
+            sums = np.zeros((len(codes), len(oxides)))
+            squares = np.zeros((len(codes), len(oxides)))
+            counts = np.zeros(len(codes))
+        assigned = [i for i, pk in enumerate(mineral_ids) if pk in codes]
+        rows = [codes[mineral_ids[i]] for i in assigned]
+        np.add.at(sums, rows, proportions[assigned])
+        np.add.at(squares, rows, proportions[assigned] ** 2)
+        np.add.at(counts, rows, 1)
+
+    if oxides is None:
+        return None
+    usable = counts >= MIN_REFERENCES
+    if not usable.any():
+        return None
+
+    candidates = [pk for pk, i in sorted(codes.items(), key=lambda c: c[1])
+                  if usable[i]]
+    counts = counts[usable, np.newaxis]
+    means = sums[usable] / counts
+    variances = (squares[usable] - counts * means ** 2) / (counts - 1)
+    spreads = np.maximum(np.sqrt(np.maximum(variances, 0)), MIN_SPREAD)
+    for row, pk in enumerate(candidates):
+        linked = types[minerals[pk]]
+        for column, oxide in enumerate(oxides):
+            if oxide not in linked:
+                means[row, column] = 0
+                spreads[row, column] = MIN_SPREAD
+    return References(candidates, oxides, means, spreads)
+
+
+_UPDATE_SQL = """
+    UPDATE chemical_analyses ca
+    SET suggested_mineral_id = s.mineral_id,
+        suggested_mineral_confidence = s.confidence
+    FROM unnest(%s::uuid[], %s::uuid[], %s::float8[])
+         AS s (id, mineral_id, confidence)
+    WHERE ca.id = s.id
+"""
+
+
+def classify_all(batch_size=BATCH_SIZE, everything=False, progress=None):
+    """
+    Suggests a mineral for the analyses without one (or assigned one of
+    UNASSIGNED_MINERALS), or for every analysis with `everything`,
+    `batch_size` analyses (in id order) per transaction. Returns the number
+    of analyses given a suggestion, or None if there were no references to
+    learn.
+    """
+    references = learn(batch_size)
+    if references is None:
+        return None
+    unassigned = set(str(pk) for pk in Mineral.objects.filter(
+        name__in=UNASSIGNED_MINERALS).values_list('pk', flat=True))
+
+    suggested = 0
+    for last, upper in _batches(batch_size):
+        ids, mineral_ids, oxides, proportions = _proportions(last, upper)
+        if oxides != references.oxides:
+            raise ValueError('The oxides changed while classifying')
+        if not everything:
+            keep = [i for i, pk in enumerate(mineral_ids)
+                    if pk is None or pk in unassigned]
+            ids = [ids[i] for i in keep]
+            proportions = proportions[keep]
+        nearest, confidence = references.classify(proportions)
+        suggestions = [references.candidates[i] if i >= 0 else None
+                       for i in nearest]
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(_UPDATE_SQL, [
+                ids, suggestions,
+                [None if np.isnan(c) else float(c) for c in confidence]])
+        suggested += int((nearest >= 0).sum())
+        if progress is not None:
+            progress(upper)
+    return suggested
@@ -0,0 +1,21 @@
+from django.core.management import BaseCommand
+
+from apps.chemical_analyses import canonical
+
+
+class Command(BaseCommand):
+    help = ('Converts every element and oxide amount to the canonical unit '
+            'of its table (wt% for oxides, ppm for elements)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+                            default=canonical.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        def progress(table, last_id, changed):
+            self.stdout.write('{} up to {}: {} changed'
+                              .format(table, last_id, changed))
+
+        changed = canonical.backfill(options['batch_size'],
+                                     progress=progress)
+        self.stdout.write('{} amounts changed'.format(changed))
@@ -0,0 +1,28 @@
+from django.core.management import BaseCommand, CommandError
+
+from apps.chemical_analyses import classification
+
+
+class Command(BaseCommand):
+    help = ('Suggests a mineral for the chemical analyses without one, from '
+            'their oxide composition')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Classify every analysis, not only those '
+                                 'without a mineral or assigned Bulk Rock')
+        parser.add_argument('--batch-size', type=int,
+                            default=classification.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        def progress(last_id):
+            self.stdout.write('Up to {}'.format(last_id))
+
+        suggested = classification.classify_all(options['batch_size'],
+                                                everything=options['all'],
+                                                progress=progress)
+        if suggested is None:
+            raise CommandError(
+                'No mineral type has {} analyses assigned to its mineral to '
+                'learn from'.format(classification.MIN_REFERENCES))
+        self.stdout.write('{} analyses given a suggestion'.format(suggested))
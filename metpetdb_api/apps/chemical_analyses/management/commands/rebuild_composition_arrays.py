@@ -0,0 +1,22 @@
+from django.core.management import BaseCommand
+
+from apps.chemical_analyses import arrays
+
+
+class Command(BaseCommand):
+    help = ('Rewrites the composition arrays of all chemical analyses from '
+            'their oxide and element rows')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+                            default=arrays.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        def progress(last_id):
+            self.stdout.write('Up to {}'.format(last_id))
+
+        arrays.rebuild_all(options['batch_size'], progress=progress)
+        if arrays.layout() is None:
+            self.stderr.write('Some oxides or elements have no distinct '
+                              'order_id; the arrays will not be read until '
+                              'they do')
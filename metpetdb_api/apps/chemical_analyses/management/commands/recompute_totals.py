@@ -0,0 +1,22 @@
+from django.core.management import BaseCommand
+
+from apps.chemical_analyses import totals
+
+
+class Command(BaseCommand):
+    help = ('Recomputes the oxide totals of all chemical analyses and flags '
+            'those outside CHEMICAL_ANALYSIS_TOTAL_MIN/MAX')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+                            default=totals.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        def progress(last_id, changed):
+            self.stdout.write('Up to {}: {} changed'.format(last_id, changed))
+
+        changed = totals.recompute_all_totals(options['batch_size'],
+                                              progress=progress)
+        low, high = totals.total_window()
+        self.stdout.write('{} analyses changed; window {}-{} wt%'
+                          .format(changed, low, high))
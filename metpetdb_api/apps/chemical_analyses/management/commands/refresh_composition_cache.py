@@ -0,0 +1,37 @@
+import time
+
+from django.core.management import BaseCommand, CommandError
+
+from api.chemical_analyses.lib import cache
+
+
+class Command(BaseCommand):
+    help = ('Brings the composition cache in COMPOSITION_CACHE_DIR up to '
+            'date with the database')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Rebuild the cache instead of patching it')
+        parser.add_argument('--interval', type=int, default=None,
+                            help='Keep refreshing, every this many seconds')
+        parser.add_argument('--batch-size', type=int,
+                            default=cache.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        directory = cache.cache_directory()
+        if directory is None:
+            raise CommandError('COMPOSITION_CACHE_DIR is not set')
+
+        batch_size = options['batch_size']
+        if options['full']:
+            self.report('build', cache.build(directory, batch_size))
+        else:
+            self.report(*cache.refresh(directory, batch_size))
+
+        # With --interval, keeps running as the cache's refresher
+        while options['interval']:
+            time.sleep(options['interval'])
+            self.report(*cache.refresh(directory, batch_size))
+
+    def report(self, kind, rows):
+        self.stdout.write('{}: {} analyses'.format(kind, rows))
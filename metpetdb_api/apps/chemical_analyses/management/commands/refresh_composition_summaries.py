@@ -0,0 +1,18 @@
+from django.core.management import BaseCommand
+
+from apps.chemical_analyses import summaries
+
+
+class Command(BaseCommand):
+    help = ('Recomputes the per-sample, per-mineral oxide composition '
+            'summaries of all samples')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+                            default=summaries.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        def progress(last_id):
+            self.stdout.write('Up to {}'.format(last_id))
+
+        summaries.refresh_all(options['batch_size'], progress=progress)
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+# Indexes backing the filters in
+# api.chemical_analyses.lib.query.chemical_analysis_query
+INDEXES = [
+    ('chemical_analysis_elements_element_id_analysis_id',
+     'chemical_analysis_elements (element_id, chemical_analysis_id)'),
+    ('chemical_analysis_oxides_oxide_id_analysis_id',
+     'chemical_analysis_oxides (oxide_id, chemical_analysis_id)'),
+    ('chemical_analyses_public', 'chemical_analyses (id) WHERE public_data'),
+    ('chemical_analyses_mineral_id_subsample_id',
+     'chemical_analyses (mineral_id, subsample_id)'),
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chemical_analyses', '0003_chemicalanalysis_stage_y'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX {} ON {}'.format(name, definition),
+            'DROP INDEX {}'.format(name)
+        )
+        for name, definition in INDEXES
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+# Indexes backing the amount range filters and ordering in
+# api.chemical_analyses.lib.query.chemical_analysis_query
+INDEXES = [
+    ('chemical_analysis_oxides_oxide_id_unit_amount',
+     'chemical_analysis_oxides '
+     '(oxide_id, measurement_unit, amount, chemical_analysis_id)'),
+    ('chemical_analysis_elements_element_id_unit_amount',
+     'chemical_analysis_elements '
+     '(element_id, measurement_unit, amount, chemical_analysis_id)'),
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chemical_analyses', '0004_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX {} ON {}'.format(name, definition),
+            'DROP INDEX {}'.format(name)
+        )
+        for name, definition in INDEXES
+    ]
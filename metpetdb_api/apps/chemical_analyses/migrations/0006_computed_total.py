@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chemical_analyses', '0005_amount_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chemicalanalysis',
+            name='computed_total',
+            field=models.FloatField(blank=True, null=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='chemicalanalysis',
+            name='total_ok',
+            field=models.NullBooleanField(db_index=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chemical_analyses', '0006_computed_total'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chemicalanalysis',
+            name='composition_updated',
+            field=models.DateTimeField(blank=True, null=True, db_index=True),
+        ),
+    ]
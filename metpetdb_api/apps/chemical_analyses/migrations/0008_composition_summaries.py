@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('samples', '0002_filter_indexes'),
+        ('chemical_analyses', '0007_composition_updated'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompositionSummary',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('count', models.IntegerField()),
+                ('mean', models.FloatField()),
+                ('stddev', models.FloatField(blank=True, null=True)),
+                ('mineral', models.ForeignKey(to='samples.Mineral')),
+                ('oxide', models.ForeignKey(to='chemical_analyses.Oxide')),
+                ('sample', models.ForeignKey(related_name='composition_summaries', to='samples.Sample')),
+            ],
+            options={
+                'db_table': 'composition_summaries',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='compositionsummary',
+            unique_together=set([('sample', 'mineral', 'oxide')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='compositionsummary',
+            index_together=set([('mineral', 'oxide', 'mean')]),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+# The amount range filters and ordering compare canonical amounts now, so
+# these replace the (measurement_unit, amount) indexes of 0005. The new
+# columns are filled before the old indexes go, so no existing amount drops
+# out of the filters, totals or summaries after deploying.
+INDEXES = [
+    ('chemical_analysis_oxides_oxide_id_canonical_amount',
+     'chemical_analysis_oxides '
+     '(oxide_id, canonical_amount, chemical_analysis_id)'),
+    ('chemical_analysis_elements_element_id_canonical_amount',
+     'chemical_analysis_elements '
+     '(element_id, canonical_amount, chemical_analysis_id)'),
+]
+
+REPLACED_INDEXES = [
+    ('chemical_analysis_oxides_oxide_id_unit_amount',
+     'chemical_analysis_oxides '
+     '(oxide_id, measurement_unit, amount, chemical_analysis_id)'),
+    ('chemical_analysis_elements_element_id_unit_amount',
+     'chemical_analysis_elements '
+     '(element_id, measurement_unit, amount, chemical_analysis_id)'),
+]
+
+
+def backfill_canonical_amounts(apps, schema_editor):
+    # plain SQL over the tables, so the current code is safe to run here
+    from apps.chemical_analyses import canonical
+    canonical.backfill()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chemical_analyses', '0008_composition_summaries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chemicalanalysiselement',
+            name='canonical_amount',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chemicalanalysisoxide',
+            name='canonical_amount',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_canonical_amounts,
+                             migrations.RunPython.noop),
+    ] + [
+        migrations.RunSQL(
+            'CREATE INDEX {} ON {}'.format(name, definition),
+            'DROP INDEX {}'.format(name)
+        )
+        for name, definition in INDEXES
+    ] + [
+        migrations.RunSQL(
+            'DROP INDEX {}'.format(name),
+            'CREATE INDEX {} ON {}'.format(name, definition)
+        )
+        for name, definition in REPLACED_INDEXES
+    ]
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields
+from django.db import models, migrations
+
+
+# The rows outside their detection limits, which readers of the composition
+# arrays look up to mask them. Fill the arrays with
+# `python manage.py rebuild_composition_arrays`.
+INDEXES = [
+    ('chemical_analysis_oxides_outside_detection',
+     'chemical_analysis_oxides (chemical_analysis_id, oxide_id) '
+     'WHERE amount < min_amount OR amount > max_amount'),
+    ('chemical_analysis_elements_outside_detection',
+     'chemical_analysis_elements (chemical_analysis_id, element_id) '
+     'WHERE amount < min_amount OR amount > max_amount'),
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chemical_analyses', '0009_canonical_amounts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chemicalanalysis',
+            name=name,
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(null=True), blank=True, null=True, size=None),
+        )
+        for name in ('oxide_amounts', 'oxide_precisions', 'element_amounts',
+                     'element_precisions')
+    ] + [
+        migrations.RunSQL(
+            'CREATE INDEX {} ON {}'.format(name, definition),
+            'DROP INDEX {}'.format(name)
+        )
+        for name, definition in INDEXES
+    ]
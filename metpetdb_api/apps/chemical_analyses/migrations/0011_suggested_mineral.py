@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('samples', '0002_filter_indexes'),
+        ('chemical_analyses', '0010_composition_arrays'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chemicalanalysis',
+            name='suggested_mineral',
+            field=models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.SET_NULL, blank=True, to='samples.Mineral', null=True),
+        ),
+        migrations.AddField(
+            model_name='chemicalanalysis',
+            name='suggested_mineral_confidence',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='chemicalanalysis',
+            index_together=set([('suggested_mineral', 'suggested_mineral_confidence')]),
+        ),
+    ]
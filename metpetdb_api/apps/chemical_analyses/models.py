@@ -3,6 +3,14 @@ from concurrency.fields import AutoIncVersionField
 
 from django.conf import settings
 from django.contrib.gis.db import models
+from django.contrib.postgres.fields import ArrayField
+
+from apps.chemical_analyses.units import (
+    DEFAULT_ELEMENT_UNIT,
+    DEFAULT_OXIDE_UNIT,
+    MOLAR_UNITS,
+    to_canonical,
+)
 
 
 class ChemicalAnalysis(models.Model):
@@ -20,11 +28,37 @@ class ChemicalAnalysis(models.Model):
     date_precision = models.SmallIntegerField(blank=True, null=True)
     description = models.CharField(max_length=1024, blank=True, null=True)
     total = models.FloatField(blank=True, null=True)
+    # The sum of the oxide amounts (wt%) and whether it falls within
+    # settings.CHEMICAL_ANALYSIS_TOTAL_MIN/MAX; maintained by
+    # apps.chemical_analyses.totals
+    computed_total = models.FloatField(blank=True, null=True, db_index=True)
+    total_ok = models.NullBooleanField(db_index=True)
+    # When the element/oxide amounts were last written through the API
+    composition_updated = models.DateTimeField(blank=True, null=True,
+                                               db_index=True)
+    # Copies of the canonical amounts and precisions of the oxide/element
+    # rows, the amount of the oxide/element with order_id n at index n (from
+    # 1); NULL without any rows. Maintained by apps.chemical_analyses.arrays
+    oxide_amounts = ArrayField(models.FloatField(null=True), blank=True,
+                               null=True)
+    oxide_precisions = ArrayField(models.FloatField(null=True), blank=True,
+                                  null=True)
+    element_amounts = ArrayField(models.FloatField(null=True), blank=True,
+                                 null=True)
+    element_precisions = ArrayField(models.FloatField(null=True), blank=True,
+                                    null=True)
     spot_id = models.BigIntegerField()
 
     subsample = models.ForeignKey('samples.Subsample',
                                   related_name='chemical_analyses')
     mineral = models.ForeignKey('samples.Mineral', blank=True, null=True)
+    # The mineral the analysis' oxide composition is closest to, and the
+    # probability of it among the candidates; written by
+    # apps.chemical_analyses.classification
+    suggested_mineral = models.ForeignKey('samples.Mineral', blank=True,
+                                          null=True, related_name='+',
+                                          on_delete=models.SET_NULL)
+    suggested_mineral_confidence = models.FloatField(blank=True, null=True)
     owner = models.ForeignKey(settings.AUTH_USER_MODEL,
                              related_name='chemical_analyses')
     elements = models.ManyToManyField('Element',
@@ -37,6 +71,8 @@ class ChemicalAnalysis(models.Model):
 
     class Meta:
         db_table = 'chemical_analyses'
+        index_together = (('suggested_mineral',
+                           'suggested_mineral_confidence'),)
 
 
 class Element(models.Model):
@@ -76,10 +112,25 @@ class ChemicalAnalysisElement(models.Model):
     measurement_unit = models.CharField(max_length=4, blank=True, null=True)
     min_amount = models.FloatField(blank=True, null=True)
     max_amount = models.FloatField(blank=True, null=True)
+    # `amount` in DEFAULT_ELEMENT_UNIT (ppm), set on save; see
+    # apps.chemical_analyses.canonical
+    canonical_amount = models.FloatField(blank=True, null=True)
 
     class Meta:
         db_table = 'chemical_analysis_elements'
 
+    def set_canonical_amount(self):
+        weight = None
+        if self.measurement_unit in MOLAR_UNITS:
+            weight = self.element.weight
+        self.canonical_amount = to_canonical(self.amount,
+                                             self.measurement_unit,
+                                             DEFAULT_ELEMENT_UNIT, weight)
+
+    def save(self, *args, **kwargs):
+        self.set_canonical_amount()
+        super().save(*args, **kwargs)
+
 
 class ChemicalAnalysisOxide(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -91,7 +142,40 @@ class ChemicalAnalysisOxide(models.Model):
     measurement_unit = models.CharField(max_length=4, blank=True, null=True)
     min_amount = models.FloatField(blank=True, null=True)
     max_amount = models.FloatField(blank=True, null=True)
+    # `amount` in DEFAULT_OXIDE_UNIT (wt%), set on save; see
+    # apps.chemical_analyses.canonical
+    canonical_amount = models.FloatField(blank=True, null=True)
 
     class Meta:
         db_table = 'chemical_analysis_oxides'
         unique_together = (('chemical_analysis', 'oxide'),)
+
+    def set_canonical_amount(self):
+        weight = None
+        if self.measurement_unit in MOLAR_UNITS:
+            weight = self.oxide.weight
+        self.canonical_amount = to_canonical(self.amount,
+                                             self.measurement_unit,
+                                             DEFAULT_OXIDE_UNIT, weight)
+
+    def save(self, *args, **kwargs):
+        self.set_canonical_amount()
+        super().save(*args, **kwargs)
+
+
+class CompositionSummary(models.Model):
+    # The count, mean and standard deviation (wt%) of an oxide over the
+    # public analyses of a mineral in a sample; maintained by
+    # apps.chemical_analyses.summaries
+    sample = models.ForeignKey('samples.Sample',
+                               related_name='composition_summaries')
+    mineral = models.ForeignKey('samples.Mineral')
+    oxide = models.ForeignKey('Oxide')
+    count = models.IntegerField()
+    mean = models.FloatField()
+    stddev = models.FloatField(blank=True, null=True)
+
+    class Meta:
+        db_table = 'composition_summaries'
+        unique_together = (('sample', 'mineral', 'oxide'),)
+        index_together = (('mineral', 'oxide', 'mean'),)
@@ -0,0 +1,102 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+
+from apps.chemical_analyses import arrays, canonical, summaries
+from apps.chemical_analyses.models import (
+    ChemicalAnalysis,
+    ChemicalAnalysisElement,
+    ChemicalAnalysisOxide,
+    Element,
+    Oxide,
+)
+from apps.chemical_analyses.totals import recompute_totals
+from apps.samples.models import Subsample
+
+
+# Sent after the element or oxide amounts, or the mineral, subsample or
+# public_data, of chemical analyses were written
+composition_changed = Signal(providing_args=['chemical_analysis_ids'])
+
+
+@receiver(composition_changed)
+def update_totals(sender, chemical_analysis_ids, **kwargs):
+    recompute_totals(chemical_analysis_ids)
+
+
+@receiver(composition_changed)
+def touch_composition_updated(sender, chemical_analysis_ids, **kwargs):
+    # lets every process' similarity index, and the composition cache,
+    # pick up the change
+    (ChemicalAnalysis
+     .objects
+     .filter(pk__in=chemical_analysis_ids)
+     .update(composition_updated=timezone.now()))
+
+
+@receiver(composition_changed)
+def update_composition_arrays(sender, chemical_analysis_ids, **kwargs):
+    arrays.sync_arrays(chemical_analysis_ids)
+
+
+@receiver(post_save, sender=ChemicalAnalysisOxide)
+@receiver(post_save, sender=ChemicalAnalysisElement)
+def update_composition_arrays_of_row(sender, instance, **kwargs):
+    # rows saved one at a time, outside the API's bulk writes
+    arrays.sync_arrays([instance.chemical_analysis_id])
+
+
+@receiver(post_delete, sender=ChemicalAnalysisOxide)
+@receiver(post_delete, sender=ChemicalAnalysisElement)
+def remove_from_composition_arrays(sender, instance, **kwargs):
+    arrays.sync_arrays([instance.chemical_analysis_id])
+
+
+@receiver(pre_save, sender=Oxide)
+@receiver(pre_save, sender=Element)
+def remember_order_id(sender, instance, **kwargs):
+    instance._saved_order_id = (sender
+                                .objects
+                                .filter(pk=instance.pk)
+                                .values_list('order_id', flat=True)
+                                .first())
+
+
+@receiver(post_save, sender=Oxide)
+@receiver(post_save, sender=Element)
+def rebuild_composition_arrays(sender, instance, created, **kwargs):
+    # the arrays hold the oxide or element with order_id n at index n, so
+    # renumbering one moves a slot of every analysis
+    if not created and instance.order_id != instance._saved_order_id:
+        arrays.rebuild_all()
+
+
+@receiver(composition_changed)
+def update_composition_summaries(sender, chemical_analysis_ids, **kwargs):
+    summaries.refresh_analyses(chemical_analysis_ids)
+
+
+@receiver(post_delete, sender=ChemicalAnalysis)
+def remove_from_composition_summaries(sender, instance, **kwargs):
+    summaries.refresh_samples(
+        Subsample
+        .objects
+        .filter(pk=instance.subsample_id)
+        .values_list('sample_id', flat=True))
+
+
+def _reference_weight_changed(table, reference_id):
+    ids = canonical.refresh_reference(table, reference_id)
+    if ids:
+        composition_changed.send(sender=ChemicalAnalysis,
+                                 chemical_analysis_ids=ids)
+
+
+@receiver(post_save, sender=Oxide)
+def update_oxide_canonical_amounts(sender, instance, **kwargs):
+    _reference_weight_changed(canonical.TABLES[0], instance.pk)
+
+
+@receiver(post_save, sender=Element)
+def update_element_canonical_amounts(sender, instance, **kwargs):
+    _reference_weight_changed(canonical.TABLES[1], instance.pk)
@@ -0,0 +1,98 @@
+"""
+Maintains CompositionSummary: per sample, mineral and oxide, the count, mean
+and standard deviation of the oxide amounts (wt%) of the sample's public
+analyses of that mineral.
+
+A sample's summaries are recomputed as a whole, so an analysis changing
+mineral within its sample is picked up along with its amounts. The sample
+rows are locked first, so that concurrent writes to analyses of the same
+sample recompute its summaries one after the other instead of inserting
+them twice.
+"""
+from django.db import connection, transaction
+
+
+BATCH_SIZE = 1000
+
+_MIN_ID = '00000000-0000-0000-0000-000000000000'
+_MAX_ID = 'ffffffff-ffff-ffff-ffff-ffffffffffff'
+
+
+def _refresh_sql(where):
+    lock = 'SELECT id FROM samples WHERE {} ORDER BY id FOR UPDATE'.format(
+        where.format(sample_id='id'))
+    delete = 'DELETE FROM composition_summaries s WHERE {}'.format(
+        where.format(sample_id='s.sample_id'))
+    insert = """
+        INSERT INTO composition_summaries
+            (sample_id, mineral_id, oxide_id, count, mean, stddev)
+        SELECT ss.sample_id, ca.mineral_id, cao.oxide_id,
+               COUNT(*), AVG(cao.canonical_amount),
+               STDDEV_SAMP(cao.canonical_amount)
+        FROM chemical_analysis_oxides cao
+        INNER JOIN chemical_analyses ca ON ca.id = cao.chemical_analysis_id
+        INNER JOIN subsamples ss ON ss.id = ca.subsample_id
+        WHERE {where}
+        AND ca.public_data
+        AND ca.mineral_id IS NOT NULL
+        AND cao.canonical_amount IS NOT NULL
+        GROUP BY ss.sample_id, ca.mineral_id, cao.oxide_id
+    """.format(where=where.format(sample_id='ss.sample_id'))
+    return lock, delete, insert
+
+
+def refresh_samples(sample_ids):
+    """
+    Recomputes the summaries of the samples with the given ids.
+    """
+    if not sample_ids:
+        return
+    lock, delete, insert = _refresh_sql('{sample_id} = ANY(%s::uuid[])')
+    ids = [str(pk) for pk in sample_ids]
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(lock, [ids])
+        cursor.execute(delete, [ids])
+        cursor.execute(insert, [ids])
+
+
+def refresh_analyses(chemical_analysis_ids):
+    """
+    Recomputes the summaries of the samples of the given analyses.
+    """
+    if not chemical_analysis_ids:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT DISTINCT ss.sample_id
+            FROM chemical_analyses ca
+            INNER JOIN subsamples ss ON ss.id = ca.subsample_id
+            WHERE ca.id = ANY(%s::uuid[])
+        """, [[str(pk) for pk in chemical_analysis_ids]])
+        sample_ids = [row[0] for row in cursor.fetchall()]
+    refresh_samples(sample_ids)
+
+
+def refresh_all(batch_size=BATCH_SIZE, progress=None):
+    """
+    Recomputes every sample's summaries, `batch_size` samples (in id order)
+    per transaction.
+    """
+    lock, delete, insert = _refresh_sql(
+        '{sample_id} > %s AND {sample_id} <= %s')
+    last = _MIN_ID
+    with connection.cursor() as cursor:
+        while True:
+            cursor.execute('SELECT id FROM samples WHERE id > %s '
+                           'ORDER BY id OFFSET %s LIMIT 1',
+                           [last, batch_size - 1])
+            row = cursor.fetchone()
+            upper = str(row[0]) if row else _MAX_ID
+            with transaction.atomic():
+                cursor.execute(lock, [last, upper])
+                cursor.execute(delete, [last, upper])
+                cursor.execute(insert, [last, upper])
+            if progress is not None:
+                progress(upper)
+            if row is None:
+                return
+            last = upper
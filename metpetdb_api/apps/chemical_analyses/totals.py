@@ -0,0 +1,78 @@
+"""
+Recomputes ChemicalAnalysis.computed_total from the oxide amounts and flags
+the analyses whose total is outside the configured window.
+"""
+from django.conf import settings
+from django.db import connection, transaction
+
+
+BATCH_SIZE = 10000
+
+_MIN_ID = '00000000-0000-0000-0000-000000000000'
+_MAX_ID = 'ffffffff-ffff-ffff-ffff-ffffffffffff'
+
+
+def total_window():
+    return (float(settings.CHEMICAL_ANALYSIS_TOTAL_MIN),
+            float(settings.CHEMICAL_ANALYSIS_TOTAL_MAX))
+
+
+def _update_sql(where):
+    sql = """
+        UPDATE chemical_analyses ca
+        SET computed_total = totals.total,
+            total_ok = totals.total BETWEEN %s AND %s
+        FROM (
+            SELECT ca.id, SUM(cao.canonical_amount) AS total
+            FROM chemical_analyses ca
+            LEFT JOIN chemical_analysis_oxides cao
+            ON cao.chemical_analysis_id = ca.id
+            WHERE {where}
+            GROUP BY ca.id
+        ) totals
+        WHERE ca.id = totals.id
+        AND (ca.computed_total IS DISTINCT FROM totals.total
+             OR ca.total_ok IS DISTINCT FROM
+                (totals.total BETWEEN %s AND %s))
+    """.format(where=where)
+    return sql
+
+
+def recompute_totals(ids):
+    """
+    Recomputes the totals of the analyses with the given ids in one
+    statement; returns the number of analyses that changed.
+    """
+    if not ids:
+        return 0
+    low, high = total_window()
+    sql = _update_sql('ca.id = ANY(%s::uuid[])')
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [low, high, [str(pk) for pk in ids], low, high])
+        return cursor.rowcount
+
+
+def recompute_all_totals(batch_size=BATCH_SIZE, progress=None):
+    """
+    Recomputes every analysis' total, `batch_size` analyses (in id order)
+    per transaction; returns the number of analyses that changed.
+    """
+    low, high = total_window()
+    sql = _update_sql('ca.id > %s AND ca.id <= %s')
+    changed = 0
+    last = _MIN_ID
+    with connection.cursor() as cursor:
+        while True:
+            cursor.execute('SELECT id FROM chemical_analyses WHERE id > %s '
+                           'ORDER BY id OFFSET %s LIMIT 1',
+                           [last, batch_size - 1])
+            row = cursor.fetchone()
+            upper = str(row[0]) if row else _MAX_ID
+            with transaction.atomic():
+                cursor.execute(sql, [low, high, last, upper, low, high])
+                changed += cursor.rowcount
+            if progress is not None:
+                progress(upper, changed)
+            if row is None:
+                return changed
+            last = upper
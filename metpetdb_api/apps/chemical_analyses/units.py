@@ -0,0 +1,74 @@
+"""
+Measurement units of element and oxide amounts.
+"""
+
+# Amounts are reported as mass fractions; these are the factors that
+# convert each unit to ppm.
+MASS_FRACTION_UNITS = {
+    'wt%': 10000.0,
+    'ppm': 1.0,
+    'ppb': 0.001,
+}
+
+# Molar units; an amount in one of these times the molar mass (g/mol) of
+# the element or oxide is in ppm
+MOLAR_UNITS = {
+    'umol': 1.0,  # umol/g
+}
+
+# The unit an amount is assumed to be in when measurement_unit is empty,
+# which is also the canonical unit ChemicalAnalysisOxide/Element
+# .canonical_amount are stored in
+DEFAULT_OXIDE_UNIT = 'wt%'
+DEFAULT_ELEMENT_UNIT = 'ppm'
+
+
+def convert(amount, from_unit, to_unit):
+    """
+    Converts a mass fraction between two of MASS_FRACTION_UNITS.
+    """
+    try:
+        return (amount * MASS_FRACTION_UNITS[from_unit] /
+                MASS_FRACTION_UNITS[to_unit])
+    except KeyError as err:
+        raise ValueError('Unknown measurement unit: {}'.format(err.args[0]))
+
+
+def to_canonical(amount, unit, default_unit, weight=None):
+    """
+    Converts an amount reported in `unit` (`default_unit` if empty) to
+    `default_unit`; molar amounts need the molar mass `weight`. Returns None
+    for amounts that can't be converted.
+    """
+    unit = unit or default_unit
+    if amount is None:
+        return None
+    if unit in MOLAR_UNITS:
+        if not weight:
+            return None
+        return (amount * MOLAR_UNITS[unit] * weight /
+                MASS_FRACTION_UNITS[default_unit])
+    if unit in MASS_FRACTION_UNITS:
+        return convert(amount, unit, default_unit)
+    return None
+
+
+def sql_to_unit(amount, unit, default_unit, to_unit, weight=None):
+    """
+    Returns (sql, params) for an expression converting the amount column
+    `amount`, reported in the unit column `unit` (`default_unit` if NULL or
+    empty, as in to_canonical), to `to_unit`; amounts in an unknown unit
+    become NULL. With a molar mass column `weight`, molar amounts are
+    converted too.
+    """
+    cases, params = [], [default_unit]
+    for name, factor in sorted(MASS_FRACTION_UNITS.items()):
+        cases.append('WHEN %s THEN %s')
+        params.extend([name, factor / MASS_FRACTION_UNITS[to_unit]])
+    if weight is not None:
+        for name, factor in sorted(MOLAR_UNITS.items()):
+            cases.append('WHEN %s THEN %s * {}'.format(weight))
+            params.extend([name, factor / MASS_FRACTION_UNITS[to_unit]])
+    sql = "{} * CASE COALESCE(NULLIF({}, ''), %s) {} END".format(
+        amount, unit, ' '.join(cases))
+    return sql, params
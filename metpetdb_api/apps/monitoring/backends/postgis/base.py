@@ -0,0 +1,49 @@
+from time import time
+
+from django.contrib.gis.db.backends.postgis.base import (
+    DatabaseWrapper as PostGISDatabaseWrapper,
+)
+from django.db.backends.utils import CursorDebugWrapper, CursorWrapper
+
+from apps.monitoring import context, slow_queries
+
+
+class TimedCursorMixin(object):
+    """
+    Times every statement and hands it to the slow query recorder, and counts
+    the statements made by the current request.
+    """
+
+    def execute(self, sql, params=None):
+        context.count_query()
+        start = time()
+        try:
+            return super().execute(sql, params)
+        finally:
+            slow_queries.observe(self.db, self.cursor, sql, params,
+                                 time() - start)
+
+    def executemany(self, sql, param_list):
+        context.count_query()
+        start = time()
+        try:
+            return super().executemany(sql, param_list)
+        finally:
+            slow_queries.observe(self.db, self.cursor, sql, None,
+                                 time() - start)
+
+
+class TimedCursorWrapper(TimedCursorMixin, CursorWrapper):
+    pass
+
+
+class TimedCursorDebugWrapper(TimedCursorMixin, CursorDebugWrapper):
+    pass
+
+
+class DatabaseWrapper(PostGISDatabaseWrapper):
+    def make_cursor(self, cursor):
+        return TimedCursorWrapper(cursor, self)
+
+    def make_debug_cursor(self, cursor):
+        return TimedCursorDebugWrapper(cursor, self)
@@ -0,0 +1,108 @@
+import threading
+
+
+_local = threading.local()
+
+# Router-generated viewset URLs don't tell us which action is being run until
+# the view has been instantiated, so we derive it the same way the router
+# does: from the URL name and the HTTP method.
+LIST_ACTIONS = {'get': 'list', 'post': 'create'}
+DETAIL_ACTIONS = {'get': 'retrieve', 'put': 'update',
+                  'patch': 'partial_update', 'delete': 'destroy'}
+
+
+def view_name(request, view_func):
+    """
+    Returns a short, stable name for the view handling a request, e.g.
+    `SampleViewSet.list` or `SampleNumbersView.get`.
+    """
+    method = request.method.lower()
+    cls = getattr(view_func, 'cls', None)
+    if cls is None:
+        return getattr(view_func, '__name__', 'unknown')
+
+    url_name = getattr(getattr(request, 'resolver_match', None),
+                       'url_name', None) or ''
+    route = url_name.rsplit('-', 1)[-1]
+    if route == 'list':
+        action = LIST_ACTIONS.get(method, method)
+    elif route == 'detail':
+        action = DETAIL_ACTIONS.get(method, method)
+    elif '-' in url_name:
+        # list_route/detail_route extras, e.g. `chemicalanalysis-matrix`
+        action = route
+    else:
+        action = method
+    return '{}.{}'.format(cls.__name__, action)
+
+
+# Parameters which change how a response is paged or rendered, but not which
+# rows are filtered.
+NON_FILTER_PARAMS = ('page', 'page_size', 'fields', 'include', 'format',
+                     '_profile')
+
+# The filters of the sample and chemical analysis queries. Any other
+# parameter is reported as `other` in filter shapes, so that clients can't
+# create new metric series by sending made-up parameter names.
+FILTER_PARAMS = frozenset((
+    'abundance_ranges', 'collectors', 'composition_ranges', 'countries',
+    'element_order', 'element_ranges', 'elements', 'elements_and', 'emails',
+    'end_date', 'good_totals', 'ids', 'location_bbox', 'location_names',
+    'metamorphic_grades', 'metamorphic_regions', 'min_suggestion_confidence',
+    'minerals', 'minerals_and', 'minerals_expand', 'numbers',
+    'numbers_or_aliases', 'owners', 'oxide_order', 'oxide_ranges', 'oxides',
+    'oxides_and', 'polygon_coords', 'references', 'regions', 'rock_types',
+    'sesar_number', 'start_date', 'subsample_ids', 'suggested_minerals',
+    'text_match',
+))
+
+
+# The size of SlowQuery.query_shape
+MAX_QUERY_SHAPE_LENGTH = 500
+
+
+def query_shape(params):
+    """
+    Reduces a query string to its shape: the sorted parameter names, without
+    their values, so that `?minerals=garnet&owners=x` and
+    `?owners=y&minerals=kyanite` are reported as the same request. Shapes
+    are cut to MAX_QUERY_SHAPE_LENGTH characters.
+    """
+    return '&'.join(sorted(params.keys()))[:MAX_QUERY_SHAPE_LENGTH]
+
+
+def filter_shape(params):
+    """
+    Like `query_shape`, but only considers the parameters that filter rows,
+    and reports the ones not in FILTER_PARAMS as `other`.
+    """
+    return '&'.join(sorted(set(key if key in FILTER_PARAMS else 'other'
+                               for key in params.keys()
+                               if key not in NON_FILTER_PARAMS)))
+
+
+def set_request_context(view_name, query_shape):
+    _local.view_name = view_name
+    _local.query_shape = query_shape
+
+
+def get_request_context():
+    return (getattr(_local, 'view_name', None),
+            getattr(_local, 'query_shape', None))
+
+
+def clear_request_context():
+    _local.view_name = None
+    _local.query_shape = None
+
+
+def reset_query_count():
+    _local.query_count = 0
+
+
+def count_query():
+    _local.query_count = getattr(_local, 'query_count', 0) + 1
+
+
+def get_query_count():
+    return getattr(_local, 'query_count', 0)
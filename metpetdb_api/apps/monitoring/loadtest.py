@@ -0,0 +1,287 @@
+"""
+A small load-testing harness: scripted scenarios and access-log replay,
+issued concurrently against a running API (or one served in-process under
+WSGI), with latency percentiles and throughput reported per endpoint.
+"""
+import json
+import random
+import re
+import socketserver
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+from rest_framework.authtoken.models import Token
+
+from apps.chemical_analyses.models import ChemicalAnalysis, Oxide
+from apps.samples.models import Country, Mineral, Region, RockType, Sample
+
+
+_UUID_RE = re.compile(
+    r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
+_LOG_REQUEST_RE = re.compile(r'"(GET|HEAD) (\S+) HTTP/[\d.]+"')
+
+
+def endpoint(path):
+    """
+    Groups a request path with others of the same endpoint, e.g.
+    `/api/samples/<uuid>/?fields=x` becomes `/api/samples/{id}/`.
+    """
+    return _UUID_RE.sub('{id}', urllib.parse.urlsplit(path).path)
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+class Vocabulary(object):
+    """
+    Values to build realistic requests from, read from the target database.
+    """
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.minerals = list(Mineral.objects.values_list('name', flat=True))
+        self.countries = list(Country.objects.values_list('name', flat=True))
+        self.regions = list(Region.objects.values_list('name', flat=True))
+        self.rock_types = list(RockType.objects.values_list('name',
+                                                            flat=True))
+        self.oxides = list(Oxide.objects.exclude(species=None)
+                           .values_list('species', flat=True))
+        self.sample_ids = [str(pk) for pk in Sample.objects.filter(
+            public_data=True).values_list('pk', flat=True)[:10000]]
+        self.analysis_ids = [str(pk) for pk in ChemicalAnalysis.objects.filter(
+            public_data=True).values_list('pk', flat=True)[:10000]]
+        self.tokens = list(Token.objects.values_list('key', flat=True)[:100])
+        self.coords = [p.coords for p in Sample.objects.values_list(
+            'location_coords', flat=True)[:10000]]
+
+    def some(self, values, low=1, high=3):
+        if not values:
+            return ''
+        k = min(len(values), self.rng.randint(low, high))
+        return ','.join(self.rng.sample(values, k))
+
+    def bbox(self):
+        """
+        A map viewport around a known sample, at a random zoom level.
+        """
+        lon, lat = (self.rng.choice(self.coords) if self.coords
+                    else (0.0, 0.0))
+        half = self.rng.choice((0.1, 0.5, 2.0, 10.0, 60.0))
+        return '{:.4f},{:.4f},{:.4f},{:.4f}'.format(
+            max(-180, lon - half), max(-90, lat - half / 2),
+            min(180, lon + half), min(90, lat + half / 2))
+
+
+# A scenario returns (method, path, body) tuples describing one user action.
+
+def map_browsing(vocab):
+    return ('GET', '/api/samples/?' + urllib.parse.urlencode({
+        'location_bbox': vocab.bbox(),
+        'fields': 'id,number,location_coords,public_data',
+        'page_size': 500,
+    }), None)
+
+
+def faceted_search(vocab):
+    params = {}
+    facets = (('minerals', vocab.minerals), ('countries', vocab.countries),
+              ('regions', vocab.regions), ('rock_types', vocab.rock_types))
+    for name, values in vocab.rng.sample(facets, vocab.rng.randint(1, 3)):
+        params[name] = vocab.some(values)
+    if 'minerals' in params and vocab.rng.random() < 0.3:
+        params['minerals_and'] = 'True'
+    if vocab.rng.random() < 0.2 and vocab.sample_ids:
+        return ('GET', '/api/samples/{}/'.format(
+            vocab.rng.choice(vocab.sample_ids)), None)
+    return ('GET', '/api/samples/?' + urllib.parse.urlencode(params), None)
+
+
+def chemical_analysis_downloads(vocab):
+    params = {'page_size': 2000}
+    if vocab.rng.random() < 0.7:
+        params['minerals'] = vocab.some(vocab.minerals, 1, 2)
+    if vocab.rng.random() < 0.5:
+        params['oxides'] = vocab.some(vocab.oxides, 1, 3)
+        params['oxides_and'] = 'True'
+    return ('GET', '/api/chemical_analyses/?' + urllib.parse.urlencode(params),
+            None)
+
+
+def bulk_uploads(vocab, upload_url):
+    return ('POST', '/api/bulk_upload/', {
+        'template': 'SampleTemplate',
+        'url': upload_url,
+    })
+
+
+SCENARIOS = ('map_browsing', 'faceted_search', 'chemical_analysis_downloads',
+             'bulk_uploads')
+
+
+class _UploadFileHandler(BaseHTTPRequestHandler):
+    """
+    Serves a generated sample CSV for the bulk upload scenario.
+    """
+    rows = 100
+
+    def do_GET(self):
+        lines = ['number,location_coords,rock_type_id,comment']
+        for i in range(self.rows):
+            lines.append('LT-{0},"POINT(-73.{0} 43.{0})",,load test'
+                         .format(i))
+        body = ('\n'.join(lines) + '\n').encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/csv')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class _ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+def serve_wsgi(application, port=0):
+    """
+    Serves `application` in a background thread; returns its base URL.
+    """
+    server = _ThreadingWSGIServer(('127.0.0.1', port), _QuietHandler)
+    server.set_app(application)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+
+def serve_upload_file():
+    server = HTTPServer(('127.0.0.1', 0), _UploadFileHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    # the bulk upload parser replaces the URL's last character with a `1`
+    # (to turn Dropbox `?dl=0` links into downloads), so end with one.
+    return 'http://127.0.0.1:{}/upload.csv?dl=0'.format(
+        server.server_address[1])
+
+
+def read_access_log(path):
+    """
+    Returns the API request paths of the GET requests in an access log in
+    the common/combined log format.
+    """
+    paths = []
+    with open(path) as f:
+        for line in f:
+            match = _LOG_REQUEST_RE.search(line)
+            if match and match.group(2).startswith('/api/'):
+                paths.append(match.group(2))
+    return paths
+
+
+class LoadTest(object):
+    def __init__(self, base_url, concurrency=4, token=None, seed=0):
+        self.base_url = base_url.rstrip('/')
+        self.concurrency = concurrency
+        self.token = token
+        self.rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.results = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def request(self, method, path, body=None):
+        data = None
+        headers = {'Accept': 'application/json'}
+        if body is not None:
+            data = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        if self.token:
+            headers['Authorization'] = 'Token ' + self.token
+
+        req = urllib.request.Request(self.base_url + path, data=data,
+                                     headers=headers, method=method)
+        start = time.time()
+        try:
+            with urllib.request.urlopen(req) as response:
+                response.read()
+                ok = True
+        except (urllib.error.URLError, OSError):
+            ok = False
+        elapsed = time.time() - start
+
+        key = '{} {}'.format(method, endpoint(path))
+        with self._lock:
+            self.results[key].append(elapsed)
+            if not ok:
+                self.errors[key] += 1
+
+    def run(self, next_request, duration=None, requests=None):
+        """
+        Issues requests from `next_request()` until `duration` seconds have
+        passed or `requests` requests have been made.
+        """
+        deadline = time.time() + duration if duration else None
+        counter = iter(range(requests)) if requests else None
+        counter_lock = threading.Lock()
+
+        def worker():
+            while True:
+                if deadline is not None and time.time() >= deadline:
+                    return
+                if counter is not None:
+                    with counter_lock:
+                        if next(counter, None) is None:
+                            return
+                self.request(*next_request())
+
+        start = time.time()
+        with ThreadPoolExecutor(self.concurrency) as pool:
+            for _ in range(self.concurrency):
+                pool.submit(worker)
+        self.elapsed = time.time() - start
+
+    def report(self):
+        endpoints = {}
+        for key, latencies in sorted(self.results.items()):
+            endpoints[key] = {
+                'requests': len(latencies),
+                'errors': self.errors.get(key, 0),
+                'throughput': len(latencies) / self.elapsed,
+                'p50': percentile(latencies, 0.50),
+                'p95': percentile(latencies, 0.95),
+                'p99': percentile(latencies, 0.99),
+            }
+        return {'elapsed': self.elapsed,
+                'concurrency': self.concurrency,
+                'endpoints': endpoints}
+
+
+def compare(before, after):
+    """
+    Returns, per endpoint found in both reports, the relative change of the
+    latency percentiles and throughput (negative latency changes are
+    improvements).
+    """
+    changes = {}
+    for key in sorted(set(before['endpoints']) & set(after['endpoints'])):
+        a, b = before['endpoints'][key], after['endpoints'][key]
+        changes[key] = {
+            metric: ((b[metric] - a[metric]) / a[metric] if a[metric] else None)
+            for metric in ('p50', 'p95', 'p99', 'throughput')
+        }
+    return changes
@@ -0,0 +1,70 @@
+import time
+
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+
+from api.chemical_analyses.lib.matrix import composition_matrix
+from apps.chemical_analyses.arrays import layout
+from apps.chemical_analyses.models import ChemicalAnalysis
+
+
+AMOUNT_TABLES = ('chemical_analysis_oxides', 'chemical_analysis_elements')
+ARRAY_COLUMNS = ('oxide_amounts', 'oxide_precisions', 'element_amounts',
+                 'element_precisions')
+
+
+def _megabytes(size):
+    return '{:10.1f} MB'.format((size or 0) / 1024.0 / 1024.0)
+
+
+class Command(BaseCommand):
+    help = ('Compares the storage and scan time of chemical analysis '
+            'compositions in the amounts tables and in the composition '
+            'arrays')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--analyses', type=int, default=10000,
+                            help='Number of analyses to read per scan')
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='Scans per source; the fastest is reported')
+
+    def handle(self, *args, **options):
+        if layout() is None:
+            raise CommandError('Every oxide and element needs a distinct '
+                               'order_id to use the composition arrays')
+
+        with connection.cursor() as cursor:
+            rows = 0
+            for table in AMOUNT_TABLES:
+                cursor.execute('SELECT pg_total_relation_size(%s)', [table])
+                size, = cursor.fetchone()
+                rows += size
+                self.stdout.write('{:32s}{}'.format(table, _megabytes(size)))
+            self.stdout.write('{:32s}{}'.format('amounts tables',
+                                                _megabytes(rows)))
+
+            cursor.execute('SELECT SUM({}) FROM chemical_analyses'.format(
+                ' + '.join('COALESCE(pg_column_size({}), 0)'.format(column)
+                           for column in ARRAY_COLUMNS)))
+            size, = cursor.fetchone()
+            self.stdout.write('{:32s}{}'.format('composition arrays',
+                                                _megabytes(size)))
+
+        ids = list(ChemicalAnalysis
+                   .objects
+                   .order_by('pk')
+                   .values_list('pk', flat=True)[:options['analyses']])
+        qs = ChemicalAnalysis.objects.filter(pk__in=ids)
+        for detection_limits in (False, True):
+            for source in ('rows', 'arrays'):
+                timings = []
+                for _ in range(options['repeat']):
+                    start = time.time()
+                    composition_matrix(qs, detection_limits=detection_limits,
+                                       source=source)
+                    timings.append(time.time() - start)
+                self.stdout.write(
+                    'scan {:6s} {:22s} {:6d} analyses {:10.1f} ms'.format(
+                        source,
+                        'with detection limits' if detection_limits else '',
+                        len(ids), min(timings) * 1000))
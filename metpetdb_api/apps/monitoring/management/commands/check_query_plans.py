@@ -0,0 +1,76 @@
+import json
+import os
+
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+
+from apps.monitoring import query_plans
+
+
+DEFAULT_SNAPSHOTS = os.path.join(os.path.dirname(query_plans.__file__),
+                                 'plan_snapshots.json')
+
+
+class Command(BaseCommand):
+    help = ('EXPLAINs every sample and chemical analysis filter and fails if '
+            'a plan gained a sequential scan on a large table since the '
+            'stored snapshots, or a selective filter lost its index')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--snapshots', default=DEFAULT_SNAPSHOTS)
+        parser.add_argument('--update', action='store_true',
+                            help='Store the current plans as the snapshots')
+        parser.add_argument('--analyze', action='store_true',
+                            help='ANALYZE the watched tables first')
+        parser.add_argument('--verbose-plans', action='store_true',
+                            help='Print changed plans in full')
+
+    def handle(self, *args, **options):
+        if options['analyze']:
+            with connection.cursor() as cursor:
+                for table in query_plans.WATCHED_TABLES:
+                    cursor.execute('ANALYZE {}'.format(table))
+
+        snapshots = {}
+        if os.path.exists(options['snapshots']):
+            with open(options['snapshots']) as f:
+                snapshots = json.load(f)
+        elif not options['update']:
+            self.stderr.write('No snapshots at {}; failing on every '
+                              'sequential scan on a watched table that '
+                              'EXPECTED_SEQUENTIAL_SCANS does not allow. '
+                              'Run with --update on the synthetic dataset '
+                              'to store them.'.format(options['snapshots']))
+
+        results, regressions, changes, missing = query_plans.run(snapshots)
+
+        for name in sorted(set(results) - set(snapshots)):
+            scans = query_plans.sequential_scans(results[name]['plan'])
+            self.stdout.write('new case {}{}'.format(
+                name, ' (seq scan on {})'.format(', '.join(sorted(scans)))
+                if scans else ''))
+        for name, (before, after) in sorted(changes.items()):
+            self.stdout.write('plan changed: {}'.format(name))
+            if options['verbose_plans']:
+                self.stdout.write('  before:\n    ' + '\n    '.join(before))
+                self.stdout.write('  after:\n    ' + '\n    '.join(after))
+        for name, tables in sorted(regressions.items()):
+            self.stderr.write('new sequential scan on {}: {}'.format(
+                ', '.join(tables), name))
+        for name, index in sorted(missing.items()):
+            self.stderr.write('not using {}: {}'.format(index, name))
+
+        if missing:
+            raise CommandError('{} filter(s) are planned without their index'
+                               .format(len(missing)))
+        if options['update']:
+            with open(options['snapshots'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+            self.stdout.write('Stored {} plans in {}'.format(
+                len(results), options['snapshots']))
+        elif regressions:
+            raise CommandError('{} filter(s) scan a watched table'
+                               .format(len(regressions)))
+        else:
+            self.stdout.write('{} plans checked, {} changed'.format(
+                len(results), len(changes)))
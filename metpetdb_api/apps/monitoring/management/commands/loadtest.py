@@ -0,0 +1,107 @@
+import json
+import random
+
+from django.core.management import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+
+from apps.monitoring import loadtest
+
+
+class Command(BaseCommand):
+    help = ('Runs load-test scenarios, or replays an access log, against the '
+            'API and reports latency percentiles and throughput per endpoint')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url',
+                            help='Base URL of a running API; by default the '
+                                 'API is served in-process under WSGI')
+        parser.add_argument('--scenario', action='append',
+                            choices=loadtest.SCENARIOS,
+                            help='May be given more than once; defaults to '
+                                 'all scenarios but bulk_uploads')
+        parser.add_argument('--replay', metavar='ACCESS_LOG',
+                            help='Replay the GET requests of an access log '
+                                 'instead of running scenarios')
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--duration', type=int, default=60,
+                            help='Seconds to run for')
+        parser.add_argument('--requests', type=int,
+                            help='Stop after this many requests instead')
+        parser.add_argument('--token', help='Auth token to send')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the report to this file')
+        parser.add_argument('--compare', nargs=2,
+                            metavar=('BEFORE', 'AFTER'),
+                            help='Compare two reports instead of running')
+
+    def handle(self, *args, **options):
+        if options['compare']:
+            return self._compare(*options['compare'])
+
+        rng = random.Random(options['seed'])
+        base_url = options['url'] or loadtest.serve_wsgi(
+            get_wsgi_application())
+        token = options['token']
+
+        if options['replay']:
+            paths = loadtest.read_access_log(options['replay'])
+            if not paths:
+                raise CommandError('No API requests found in {}'
+                                   .format(options['replay']))
+            # sampling with replacement keeps the log's distribution of
+            # endpoints and query strings
+            next_request = lambda: ('GET', rng.choice(paths), None)
+        else:
+            vocab = loadtest.Vocabulary(rng)
+            scenarios = options['scenario'] or [
+                name for name in loadtest.SCENARIOS if name != 'bulk_uploads']
+            if 'bulk_uploads' in scenarios:
+                upload_url = loadtest.serve_upload_file()
+                token = token or (vocab.tokens[0] if vocab.tokens else None)
+            functions = []
+            for name in scenarios:
+                if name == 'bulk_uploads':
+                    functions.append(
+                        lambda v: loadtest.bulk_uploads(v, upload_url))
+                else:
+                    functions.append(getattr(loadtest, name))
+            next_request = lambda: rng.choice(functions)(vocab)
+
+        test = loadtest.LoadTest(base_url, options['concurrency'], token,
+                                 options['seed'])
+        test.run(next_request,
+                 duration=None if options['requests'] else options['duration'],
+                 requests=options['requests'])
+        report = test.report()
+
+        self._print_report(report)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+
+    def _print_report(self, report):
+        self.stdout.write('{:50} {:>8} {:>6} {:>8} {:>8} {:>8} {:>8}'.format(
+            'endpoint', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms',
+            'p99 ms'))
+        for key, stats in sorted(report['endpoints'].items()):
+            self.stdout.write(
+                '{:50} {:8d} {:6d} {:8.1f} {:8.1f} {:8.1f} {:8.1f}'.format(
+                    key[:50], stats['requests'], stats['errors'],
+                    stats['throughput'], stats['p50'] * 1000,
+                    stats['p95'] * 1000, stats['p99'] * 1000))
+
+    def _compare(self, before_path, after_path):
+        with open(before_path) as f:
+            before = json.load(f)
+        with open(after_path) as f:
+            after = json.load(f)
+
+        self.stdout.write('{:50} {:>8} {:>8} {:>8} {:>10}'.format(
+            'endpoint', 'p50', 'p95', 'p99', 'req/s'))
+        for key, changes in loadtest.compare(before, after).items():
+            self.stdout.write('{:50} {:>8} {:>8} {:>8} {:>10}'.format(
+                key[:50], *[
+                    '{:+.1%}'.format(changes[metric])
+                    if changes[metric] is not None else '-'
+                    for metric in ('p50', 'p95', 'p99', 'throughput')
+                ]))
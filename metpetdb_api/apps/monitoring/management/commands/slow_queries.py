@@ -0,0 +1,39 @@
+from datetime import timedelta
+
+from django.core.management import BaseCommand
+from django.utils import timezone
+
+from apps.monitoring.models import SlowQuery
+from apps.monitoring.slow_queries import worst_query_shapes
+
+
+class Command(BaseCommand):
+    help = 'Lists the recorded slow query shapes, worst first by total time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--days', type=int,
+                            help='Only consider queries from the last N days; '
+                                 'with --clear, only delete older ones')
+        parser.add_argument('--clear', action='store_true',
+                            help='Delete the recorded queries instead')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['days']:
+            since = timezone.now() - timedelta(days=options['days'])
+
+        if options['clear']:
+            qs = SlowQuery.objects.all()
+            if since is not None:
+                qs = qs.filter(created__lt=since)
+            qs.delete()
+            return
+
+        for shape in worst_query_shapes(options['limit'], since):
+            self.stdout.write(
+                '{total_duration:12.1f} ms total  {count:6d} calls  '
+                '{max_duration:10.1f} ms max  {view_name}  [{query_shape}]'
+                .format(**shape)
+            )
+            self.stdout.write('    {}'.format(shape['sql'][:300]))
@@ -0,0 +1,257 @@
+"""
+In-process metrics, exposed in the Prometheus text format at /api/_metrics.
+
+Every worker process writes its counters into its own memory-mapped file in
+METRICS_DIR, so updating a metric never has to wait on another process; the
+exposition view reads every file in the directory and adds them together.
+The directory should be emptied whenever the application server is
+(re)started, otherwise values from old processes are counted as well.
+
+A value file is a sequence of entries following an 8-byte header holding the
+number of bytes in use:
+
+    <uint32 key length> <utf-8 key, padded to 8 bytes> <float64 value>
+"""
+import glob
+import json
+import mmap
+import os
+import struct
+import threading
+
+from django.conf import settings
+
+
+_INITIAL_SIZE = 1 << 16
+_HEADER = struct.Struct('i4x')
+_KEY_LENGTH = struct.Struct('i')
+_VALUE = struct.Struct('d')
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0, float('inf'))
+
+
+def _metrics_dir():
+    return getattr(settings, 'METRICS_DIR', '/tmp/metpetdb_metrics')
+
+
+def _padded_key(key):
+    encoded = key.encode('utf-8')
+    # pad so that the value following the key is 8-byte aligned
+    padding = 8 - (_KEY_LENGTH.size + len(encoded)) % 8
+    return encoded + b' ' * padding
+
+
+def _read_entries(data):
+    used = _HEADER.unpack_from(data, 0)[0]
+    pos = _HEADER.size
+    while pos < used:
+        length = _KEY_LENGTH.unpack_from(data, pos)[0]
+        pos += _KEY_LENGTH.size
+        key = bytes(data[pos:pos + length]).decode('utf-8')
+        pos += length + 8 - (_KEY_LENGTH.size + length) % 8
+        value = _VALUE.unpack_from(data, pos)[0]
+        pos += _VALUE.size
+        yield key, value, pos - _VALUE.size
+
+
+class _ValueFile(object):
+    """
+    A string -> float64 map backed by a memory-mapped file, written to by a
+    single process only.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'a+b')
+        if os.fstat(self._file.fileno()).st_size == 0:
+            self._file.truncate(_INITIAL_SIZE)
+        self._capacity = os.fstat(self._file.fileno()).st_size
+        self._mmap = mmap.mmap(self._file.fileno(), self._capacity)
+
+        self._positions = {}
+        self._used = _HEADER.unpack_from(self._mmap, 0)[0]
+        if self._used == 0:
+            self._used = _HEADER.size
+            _HEADER.pack_into(self._mmap, 0, self._used)
+        else:
+            for key, _, pos in _read_entries(self._mmap):
+                self._positions[key] = pos
+
+    def _init_value(self, key):
+        encoded = _padded_key(key)
+        entry_size = _KEY_LENGTH.size + len(encoded) + _VALUE.size
+        while self._used + entry_size > self._capacity:
+            self._capacity *= 2
+            self._file.truncate(self._capacity)
+            self._mmap = mmap.mmap(self._file.fileno(), self._capacity)
+
+        pos = self._used
+        _KEY_LENGTH.pack_into(self._mmap, pos,
+                              len(key.encode('utf-8')))
+        pos += _KEY_LENGTH.size
+        self._mmap[pos:pos + len(encoded)] = encoded
+        pos += len(encoded)
+        _VALUE.pack_into(self._mmap, pos, 0.0)
+        self._positions[key] = pos
+
+        # only publish the entry once it has been completely written
+        self._used += entry_size
+        _HEADER.pack_into(self._mmap, 0, self._used)
+
+    def inc(self, key, amount):
+        if key not in self._positions:
+            self._init_value(key)
+        pos = self._positions[key]
+        value = _VALUE.unpack_from(self._mmap, pos)[0]
+        _VALUE.pack_into(self._mmap, pos, value + amount)
+
+
+_lock = threading.Lock()
+_values = None
+_values_pid = None
+
+
+def _inc(key, amount):
+    global _values, _values_pid
+    with _lock:
+        # a forked worker must not share its parent's file
+        if _values is None or _values_pid != os.getpid():
+            os.makedirs(_metrics_dir(), exist_ok=True)
+            _values_pid = os.getpid()
+            _values = _ValueFile(os.path.join(
+                _metrics_dir(), 'values_{}.db'.format(_values_pid)))
+        _values.inc(key, amount)
+
+
+def _key(name, labels):
+    return json.dumps([name, sorted(labels.items())])
+
+
+class Counter(object):
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        REGISTRY.append(self)
+
+    def inc(self, amount=1, **labels):
+        _inc(_key(self.name, labels), amount)
+
+
+class Histogram(object):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        REGISTRY.append(self)
+
+    def observe(self, value, **labels):
+        for bound in self.buckets:
+            if value <= bound:
+                bucket_labels = dict(labels, le=_format_value(bound))
+                _inc(_key(self.name + '_bucket', bucket_labels), 1)
+        _inc(_key(self.name + '_sum', labels), value)
+        _inc(_key(self.name + '_count', labels), 1)
+
+
+REGISTRY = []
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+def _escape(value):
+    return (str(value)
+            .replace('\\', r'\\')
+            .replace('\n', r'\n')
+            .replace('"', r'\"'))
+
+
+def collect():
+    """
+    Returns the sum of every process's values, keyed by (sample name, labels).
+    """
+    totals = {}
+    for path in glob.glob(os.path.join(_metrics_dir(), 'values_*.db')):
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) < _HEADER.size:
+            continue
+        for key, value, _ in _read_entries(data):
+            name, labels = json.loads(key)
+            key = (name, tuple(tuple(label) for label in labels))
+            totals[key] = totals.get(key, 0.0) + value
+    return totals
+
+
+def exposition():
+    """
+    Renders all registered metrics in the Prometheus text format.
+    """
+    totals = collect()
+    lines = []
+    for metric in REGISTRY:
+        lines.append('# HELP {} {}'.format(metric.name, metric.documentation))
+        lines.append('# TYPE {} {}'.format(metric.name, metric.type))
+
+        samples = [(name, labels, value)
+                   for (name, labels), value in totals.items()
+                   if name == metric.name or
+                   (metric.type == 'histogram' and
+                    name in (metric.name + '_bucket', metric.name + '_sum',
+                             metric.name + '_count'))]
+        samples.sort(key=_sample_order)
+        for name, labels, value in samples:
+            if labels:
+                label_str = '{' + ','.join(
+                    '{}="{}"'.format(k, _escape(v)) for k, v in labels
+                ) + '}'
+            else:
+                label_str = ''
+            lines.append('{}{} {}'.format(name, label_str,
+                                          _format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+
+def _sample_order(sample):
+    name, labels, _ = sample
+    series = tuple(label for label in labels if label[0] != 'le')
+    le = dict(labels).get('le')
+    return (series, name, float(le) if le is not None else 0.0)
+
+
+REQUEST_LATENCY = Histogram(
+    'metpetdb_request_duration_seconds',
+    'Request latency per view action and filter shape',
+    ('view', 'filter_shape'),
+)
+DB_QUERIES = Histogram(
+    'metpetdb_request_db_queries',
+    'Number of database queries made per request',
+    ('view',),
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, float('inf')),
+)
+CACHE_REQUESTS = Counter(
+    'metpetdb_cache_requests_total',
+    'Cache lookups, by cache and result (hit or miss)',
+    ('cache', 'result'),
+)
+BULK_UPLOAD_ROWS = Counter(
+    'metpetdb_bulk_upload_rows_total',
+    'Rows processed by bulk uploads, by template',
+    ('template',),
+)
+EXPORT_BYTES = Counter(
+    'metpetdb_export_bytes_total',
+    'Bytes of exported data streamed to clients, by view',
+    ('view',),
+)
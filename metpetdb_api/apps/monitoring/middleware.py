@@ -0,0 +1,102 @@
+from time import time
+
+from django.http import JsonResponse
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from apps.monitoring import context, metrics, profiling
+
+
+class RequestContextMiddleware(object):
+    """
+    Records which view is handling the current request, and the shape of its
+    query string, so that anything recorded further down the stack (e.g. slow
+    queries) can be attributed to it.
+    """
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        context.set_request_context(context.view_name(request, view_func),
+                                    context.query_shape(request.GET))
+
+    def process_response(self, request, response):
+        context.clear_request_context()
+        return response
+
+
+class MetricsMiddleware(object):
+    """
+    Records the latency and number of database queries of each request. This
+    should be the first middleware, so that it times the entire stack.
+    """
+
+    def process_request(self, request):
+        request._metrics_start = time()
+        context.reset_query_count()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._metrics_view = context.view_name(request, view_func)
+
+    def process_response(self, request, response):
+        view = getattr(request, '_metrics_view', None)
+        start = getattr(request, '_metrics_start', None)
+        if view is not None and start is not None:
+            metrics.REQUEST_LATENCY.observe(
+                time() - start,
+                view=view,
+                filter_shape=context.filter_shape(request.GET),
+            )
+            metrics.DB_QUERIES.observe(context.get_query_count(), view=view)
+        return response
+
+
+class ProfilerMiddleware(object):
+    """
+    Runs a request under the profiler when a superuser asks for it with an
+    `X-Profile: cpu` header or a `_profile=cpu` query parameter; `memory` also
+    traces allocations, one request at a time. The id of the stored profile
+    is returned in the `X-Profile-Id` response header, see
+    /api/_profiles/<id>/.
+    """
+
+    def process_request(self, request):
+        profiling.ensure_sampler()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        mode = (request.META.get('HTTP_X_PROFILE') or
+                request.GET.get('_profile'))
+        if not mode or not self._is_superuser(request):
+            return None
+        if mode not in profiling.PROFILE_KINDS:
+            expected = ', '.join(sorted(profiling.PROFILE_KINDS))
+            return JsonResponse(
+                {'error': 'Invalid profile mode: {}. Expected one of: '
+                          '{}'.format(mode, expected)},
+                status=400)
+
+        def run():
+            response = view_func(request, *view_args, **view_kwargs)
+            # DRF responses are rendered lazily; include rendering in the
+            # profile, since that's where serialization cost often shows up.
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.render()
+            return response
+
+        try:
+            response, profile_id = profiling.profile_call(
+                run, trace_memory=(mode == 'memory'))
+        except profiling.ProfilerBusy as err:
+            return JsonResponse({'error': str(err)}, status=409)
+        response['X-Profile-Id'] = profile_id
+        return response
+
+    def _is_superuser(self, request):
+        # Token authentication normally happens inside the view, so we have
+        # to do it ourselves here.
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_authenticated():
+            try:
+                auth = TokenAuthentication().authenticate(request)
+            except AuthenticationFailed:
+                return False
+            user = auth[0] if auth else None
+        return bool(user and user.is_superuser)
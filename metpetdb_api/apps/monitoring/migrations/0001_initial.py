@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlowQuery',
+            fields=[
+                ('id', models.UUIDField(serialize=False, primary_key=True, editable=False, default=uuid.uuid4)),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('duration', models.FloatField()),
+                ('sql', models.TextField()),
+                ('params', models.TextField(null=True, blank=True)),
+                ('fingerprint', models.CharField(max_length=40, db_index=True)),
+                ('view_name', models.CharField(null=True, max_length=100, blank=True)),
+                ('query_shape', models.CharField(null=True, max_length=500, blank=True)),
+                ('plan', models.TextField(null=True, blank=True)),
+            ],
+            options={
+                'db_table': 'slow_queries',
+            },
+        ),
+    ]
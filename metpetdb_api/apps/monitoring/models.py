@@ -0,0 +1,22 @@
+import uuid
+
+from django.db import models
+
+
+class SlowQuery(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+    duration = models.FloatField()
+    sql = models.TextField()
+    params = models.TextField(blank=True, null=True)
+
+    # A hash of the SQL with its literals and IN-lists collapsed, so that the
+    # same query issued with different filter values is grouped together.
+    fingerprint = models.CharField(max_length=40, db_index=True)
+
+    view_name = models.CharField(max_length=100, blank=True, null=True)
+    query_shape = models.CharField(max_length=500, blank=True, null=True)
+    plan = models.TextField(blank=True, null=True)
+
+    class Meta:
+        db_table = 'slow_queries'
@@ -0,0 +1,219 @@
+"""
+Per-request profiling for superusers, and an optional low-overhead sampling
+profiler which aggregates stacks across all requests.
+
+Profiles are written to PROFILE_DIR as `<id>.prof` (a pstats file, which can
+be opened with snakeviz or turned into a flamegraph with flameprof) and, when
+memory tracing was requested, `<id>.tracemalloc` (a tracemalloc snapshot);
+only the latest PROFILE_MAX_COUNT profiles are kept.
+Sampled stacks are written as `sampled_<pid>.folded`, in the folded format
+read by flamegraph.pl.
+"""
+import cProfile
+import glob
+import io
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+
+from django.conf import settings
+
+
+PROFILE_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+PROFILE_KINDS = {'cpu': 'prof', 'memory': 'tracemalloc'}
+
+# tracemalloc traces the whole process, so only one request at a time can be
+# profiled with it
+_memory_lock = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def _profile_dir():
+    path = getattr(settings, 'PROFILE_DIR', '/tmp/metpetdb_profiles')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def profile_path(profile_id, kind='cpu'):
+    """
+    Returns the path of a stored profile, or None if `profile_id` or `kind`
+    aren't valid.
+    """
+    if not PROFILE_ID_RE.match(profile_id or '') or kind not in PROFILE_KINDS:
+        return None
+    return os.path.join(_profile_dir(),
+                        '{}.{}'.format(profile_id, PROFILE_KINDS[kind]))
+
+
+def profile_call(func, trace_memory=False):
+    """
+    Runs `func` under cProfile (and tracemalloc, if `trace_memory`), stores
+    the results and returns `(result, profile_id)`. Raises ProfilerBusy
+    instead of running `func` if memory is already being traced.
+    """
+    profile_id = uuid.uuid4().hex
+    profiler = cProfile.Profile()
+
+    if trace_memory:
+        if not _memory_lock.acquire(blocking=False):
+            raise ProfilerBusy('Another request is being memory profiled')
+        if tracemalloc.is_tracing():
+            _memory_lock.release()
+            raise ProfilerBusy('Memory is already being traced')
+        tracemalloc.start(25)
+    try:
+        result = profiler.runcall(func)
+    finally:
+        if trace_memory:
+            try:
+                snapshot = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+            finally:
+                _memory_lock.release()
+            snapshot.dump(profile_path(profile_id, 'memory'))
+        profiler.dump_stats(profile_path(profile_id, 'cpu'))
+        _remove_old_profiles()
+
+    return result, profile_id
+
+
+def _remove_old_profiles():
+    # keeps the latest PROFILE_MAX_COUNT profiles
+    max_count = getattr(settings, 'PROFILE_MAX_COUNT', 100)
+    profiles = {}
+    for extension in PROFILE_KINDS.values():
+        for path in glob.glob(os.path.join(_profile_dir(),
+                                           '*.' + extension)):
+            profile_id = os.path.basename(path).partition('.')[0]
+            if PROFILE_ID_RE.match(profile_id):
+                profiles.setdefault(profile_id, []).append(path)
+    if len(profiles) <= max_count:
+        return
+
+    def modified(paths):
+        try:
+            return max(os.path.getmtime(path) for path in paths)
+        except OSError:
+            return 0
+
+    oldest = sorted(profiles.values(), key=modified)
+    for paths in oldest[:len(profiles) - max_count]:
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                # removed by another worker
+                pass
+
+
+def summary(profile_id, kind='cpu', limit=40):
+    """
+    Returns a plain-text summary of a stored profile: the most expensive
+    functions by cumulative time, or the largest allocation sites.
+    """
+    path = profile_path(profile_id, kind)
+    if kind == 'memory':
+        snapshot = tracemalloc.Snapshot.load(path)
+        return '\n'.join(str(stat) for stat
+                         in snapshot.statistics('lineno')[:limit])
+
+    out = io.StringIO()
+    stats = pstats.Stats(path, stream=out)
+    stats.sort_stats('cumulative').print_stats(limit)
+    return out.getvalue()
+
+
+class StackSampler(object):
+    """
+    Samples the stacks of every other thread in this process at a fixed
+    interval and counts them in the folded format; the counts are flushed to
+    PROFILE_DIR periodically, so that they survive the process and can be
+    merged across workers.
+    """
+
+    def __init__(self, interval, flush_interval=30):
+        self.interval = interval
+        self.flush_interval = flush_interval
+        self.stacks = Counter()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run,
+                                        name='stack-sampler',
+                                        daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        path = os.path.join(_profile_dir(),
+                            'sampled_{}.folded'.format(os.getpid()))
+        last_flush = time.time()
+        while True:
+            time.sleep(self.interval)
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    self.stacks[self._fold(frame)] += 1
+
+            if time.time() - last_flush > self.flush_interval:
+                self._flush(path)
+                last_flush = time.time()
+
+    @staticmethod
+    def _fold(frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append('{}:{}'.format(
+                os.path.basename(code.co_filename), code.co_name))
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def _flush(self, path):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            for stack, count in self.stacks.items():
+                f.write('{} {}\n'.format(stack, count))
+        os.replace(tmp_path, path)
+
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def ensure_sampler():
+    """
+    Starts this process's stack sampler, if PROFILER_SAMPLING_INTERVAL_MS is
+    set.
+    """
+    global _sampler
+    interval = getattr(settings, 'PROFILER_SAMPLING_INTERVAL_MS', 0)
+    if not interval or _sampler is not None:
+        return
+    with _sampler_lock:
+        if _sampler is None:
+            _sampler = StackSampler(interval / 1000.0)
+            _sampler.start()
+
+
+def sampled_stacks():
+    """
+    Merges the sampled stacks flushed by every worker process.
+    """
+    stacks = Counter()
+    for path in glob.glob(os.path.join(_profile_dir(), 'sampled_*.folded')):
+        with open(path) as f:
+            for line in f:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                if stack:
+                    stacks[stack] += int(count)
+    return ''.join('{} {}\n'.format(stack, count)
+                   for stack, count in stacks.most_common())
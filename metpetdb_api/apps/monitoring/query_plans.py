@@ -0,0 +1,277 @@
+"""
+Query-plan regression checks for the sample and chemical analysis filters.
+
+Every filter parameter, alone and in the combinations the clients commonly
+send, is turned into the queryset the list views would run and EXPLAINed.
+The resulting plan shapes (node types, relations and indexes, without
+costs) are compared against stored snapshots, and sequential scans on the
+large tables that weren't in the snapshot are reported as regressions, as
+are the selective filters planned without the index they were given. A case
+without a snapshot may only scan the tables EXPECTED_SEQUENTIAL_SCANS lists
+for it.
+"""
+import json
+
+from django.contrib.auth.models import AnonymousUser
+from django.db import connection
+
+from api.chemical_analyses.lib.query import chemical_analysis_query
+from api.samples.lib.query import sample_query
+from apps.chemical_analyses.models import ChemicalAnalysis, Element, Oxide
+from apps.samples.models import (
+    GeoReference,
+    MetamorphicGrade,
+    MetamorphicRegion,
+    Mineral,
+    RockType,
+    Sample,
+)
+from apps.users.models import User
+
+
+WATCHED_TABLES = ('samples', 'sample_minerals', 'chemical_analyses',
+                  'chemical_analysis_elements', 'chemical_analysis_oxides')
+
+PAGE_SIZE = 20
+
+
+def _first(qs, field):
+    return qs.order_by(field).values_list(field, flat=True).first() or ''
+
+
+def _sample_value(field):
+    return _first(Sample.objects.exclude(**{field: None}), field)
+
+
+def default_params():
+    """
+    A value for every filter parameter, read from the target database so
+    the planner sees realistic selectivities.
+    """
+    minerals = list(Mineral.objects.order_by('name')
+                    .values_list('name', flat=True)[:2])
+    oxides = list(Oxide.objects.exclude(species=None).order_by('species')
+                  .values_list('species', flat=True)[:2])
+    elements = list(Element.objects.order_by('name')
+                    .values_list('name', flat=True)[:2])
+    sample = Sample.objects.order_by('id').first()
+    lon, lat = sample.location_coords.coords if sample else (0, 0)
+    regions = Sample.objects.exclude(regions=None).values_list(
+        'regions', flat=True).first()
+
+    return {
+        'ids': str(sample.pk) if sample else '',
+        'collectors': _sample_value('collector_name'),
+        'numbers': _sample_value('number'),
+        'numbers_or_aliases': _sample_value('number'),
+        'countries': _sample_value('country'),
+        'location_names': _sample_value('location_name'),
+        'location_bbox': '{},{},{},{}'.format(lon - 1, lat - 1,
+                                              lon + 1, lat + 1),
+        'polygon_coords': json.dumps([[lon - 1, lat - 1], [lon + 1, lat - 1],
+                                      [lon + 1, lat + 1], [lon - 1, lat + 1],
+                                      [lon - 1, lat - 1]]),
+        'metamorphic_grades': _first(MetamorphicGrade.objects, 'name'),
+        'metamorphic_regions': _first(MetamorphicRegion.objects, 'name'),
+        'minerals': ','.join(minerals),
+        'owners': _first(User.objects, 'name'),
+        'emails': _first(User.objects, 'email'),
+        'references': _first(GeoReference.objects, 'name'),
+        'regions': regions[0] if regions else '',
+        'rock_types': _first(RockType.objects, 'name'),
+        'start_date': '2000-01-01',
+        'end_date': '2010-01-01',
+        'sesar_number': _sample_value('sesar_number'),
+        'abundance_ranges': '{}:10:'.format(minerals[0] if minerals
+                                            else 'Garnet'),
+        'elements': ','.join(elements),
+        'oxides': ','.join(oxides),
+        'oxide_ranges': '{}:1:10'.format(oxides[0] if oxides else 'SiO2'),
+        'element_ranges': '{}:10:'.format(elements[0] if elements else 'Ni'),
+        'oxide_order': '-{}'.format(oxides[0] if oxides else 'SiO2'),
+        'subsample_ids': str(_first(ChemicalAnalysis.objects,
+                                    'subsample_id')),
+        'suggested_minerals': ','.join(minerals),
+        'min_suggestion_confidence': '0.8',
+    }
+
+
+SAMPLE_FILTERS = ('ids', 'collectors', 'numbers', 'numbers_or_aliases',
+                  'countries', 'location_names', 'location_bbox',
+                  'polygon_coords', 'metamorphic_grades',
+                  'metamorphic_regions', 'minerals', 'owners', 'emails',
+                  'references', 'regions', 'rock_types', 'start_date',
+                  'end_date', 'sesar_number', 'abundance_ranges')
+
+CHEMICAL_ANALYSIS_FILTERS = ('minerals', 'elements', 'oxides',
+                             'oxide_ranges', 'element_ranges', 'oxide_order',
+                             'good_totals', 'subsample_ids',
+                             'suggested_minerals')
+
+# Combinations the web client and the load-test scenarios send; extra
+# parameters that aren't filters are passed through as-is.
+SAMPLE_COMBINATIONS = (
+    ('minerals', 'minerals_and'),
+    ('minerals', 'rock_types'),
+    ('countries', 'rock_types'),
+    ('location_bbox', 'minerals'),
+    ('location_bbox', 'rock_types', 'metamorphic_grades'),
+    ('regions', 'minerals', 'minerals_and'),
+    ('minerals', 'minerals_expand'),
+    ('start_date', 'end_date'),
+    ('owners', 'minerals'),
+    ('collectors', 'text_match'),
+    ('countries', 'text_match'),
+    ('location_names', 'text_match'),
+    ('regions', 'text_match'),
+)
+
+CHEMICAL_ANALYSIS_COMBINATIONS = (
+    ('elements', 'elements_and'),
+    ('oxides', 'oxides_and'),
+    ('minerals', 'oxides'),
+    ('minerals', 'oxides', 'oxides_and'),
+    ('minerals', 'elements', 'oxides'),
+    ('minerals', 'oxide_ranges'),
+    ('minerals', 'oxide_ranges', 'oxide_order'),
+    ('minerals', 'good_totals'),
+    ('minerals', 'minerals_expand'),
+    ('suggested_minerals', 'min_suggestion_confidence'),
+)
+
+# Filters matching a handful of rows on the synthetic dataset, and the index
+# each one must be planned with, snapshots or not
+REQUIRED_INDEXES = {
+    'samples:ids': 'samples_pkey',
+    'samples:numbers': 'samples_number',
+    'samples:numbers_or_aliases': 'samples_identifiers_gin',
+    'samples:collectors+text_match': 'samples_collector_name_trgm',
+    'samples:location_names+text_match': 'samples_location_name_trgm',
+}
+
+# Cases without a snapshot whose plans may scan these watched tables on the
+# synthetic dataset: the unfiltered first pages and the open-ended or
+# boolean filters that match most rows. Every other sequential scan on a
+# watched table is a regression until the snapshots say otherwise.
+EXPECTED_SEQUENTIAL_SCANS = {
+    'samples:': {'samples'},
+    'samples:start_date': {'samples'},
+    'samples:end_date': {'samples'},
+    'chemical_analyses:': {'chemical_analyses'},
+    'chemical_analyses:good_totals': {'chemical_analyses'},
+}
+
+_FLAGS = {'minerals_and': 'True', 'minerals_expand': 'True',
+          'elements_and': 'True', 'oxides_and': 'True', 'good_totals': 'True',
+          'text_match': 'fuzzy'}
+
+
+def cases(values):
+    """
+    Returns {case name: (target, params)} for every filter alone and every
+    combination.
+    """
+    def build(target, names):
+        params = {name: _FLAGS.get(name) or values[name] for name in names}
+        return '{}:{}'.format(target, '+'.join(names)), (target, params)
+
+    result = dict([build('samples', ())])
+    result.update(build('samples', (name,)) for name in SAMPLE_FILTERS)
+    result.update(build('samples', names) for names in SAMPLE_COMBINATIONS)
+    result.update([build('chemical_analyses', ())])
+    result.update(build('chemical_analyses', (name,))
+                  for name in CHEMICAL_ANALYSIS_FILTERS)
+    result.update(build('chemical_analyses', names)
+                  for names in CHEMICAL_ANALYSIS_COMBINATIONS)
+    return result
+
+
+def queryset(target, params, user=None):
+    """
+    The first page of the queryset the list view for `target` would run.
+    """
+    user = user or AnonymousUser()
+    if target == 'samples':
+        qs = sample_query(user, params, Sample.objects.all().distinct())
+    else:
+        qs = chemical_analysis_query(user, params,
+                                     ChemicalAnalysis.objects.all().distinct())
+    return qs[:PAGE_SIZE]
+
+
+def explain(qs):
+    sql, params = qs.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']
+
+
+def shape(plan, depth=0):
+    """
+    Flattens a plan into one line per node, e.g.
+    `  Index Scan on samples using samples_country`.
+    """
+    line = plan['Node Type']
+    if 'Relation Name' in plan:
+        line += ' on ' + plan['Relation Name']
+    if 'Index Name' in plan:
+        line += ' using ' + plan['Index Name']
+    lines = ['  ' * depth + line]
+    for child in plan.get('Plans', ()):
+        lines.extend(shape(child, depth + 1))
+    return lines
+
+
+def indexes(lines):
+    return set(line.rpartition(' using ')[2] for line in lines
+               if ' using ' in line)
+
+
+def sequential_scans(lines):
+    scans = set()
+    for line in lines:
+        line = line.strip()
+        if line.startswith('Seq Scan on '):
+            table = line[len('Seq Scan on '):]
+            if table in WATCHED_TABLES:
+                scans.add(table)
+    return scans
+
+
+def run(snapshots):
+    """
+    Explains every case and compares it with `snapshots` (as returned by a
+    previous run). Returns (results, regressions, changes, missing): the new
+    snapshots, the cases with new sequential scans on watched tables (or,
+    without a snapshot, ones EXPECTED_SEQUENTIAL_SCANS doesn't allow), the
+    cases whose plan shape changed otherwise, and the cases planned without
+    their REQUIRED_INDEXES.
+    """
+    values = default_params()
+    results, regressions, changes, missing = {}, {}, {}, {}
+    for name, (target, params) in sorted(cases(values).items()):
+        if name in snapshots:
+            # re-use the stored values so plans are compared like for like
+            params = snapshots[name]['params']
+        lines = shape(explain(queryset(target, params)))
+        results[name] = {'target': target, 'params': params, 'plan': lines}
+
+        if (name in REQUIRED_INDEXES and
+                REQUIRED_INDEXES[name] not in indexes(lines)):
+            missing[name] = REQUIRED_INDEXES[name]
+        if name not in snapshots:
+            scans = (sequential_scans(lines) -
+                     EXPECTED_SEQUENTIAL_SCANS.get(name, set()))
+            if scans:
+                regressions[name] = sorted(scans)
+            continue
+        before = snapshots[name]['plan']
+        new_scans = sequential_scans(lines) - sequential_scans(before)
+        if new_scans:
+            regressions[name] = sorted(new_scans)
+        elif lines != before:
+            changes[name] = (before, lines)
+    return results, regressions, changes, missing
@@ -0,0 +1,158 @@
+import hashlib
+import json
+import logging
+import queue
+import re
+import threading
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Count, Max, Sum
+
+from apps.monitoring import context
+
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+_queue = queue.Queue(maxsize=1000)
+_worker = None
+_worker_lock = threading.Lock()
+
+_IN_LIST_RE = re.compile(r'IN \((?:%s, )*%s\)')
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def threshold():
+    return getattr(settings, 'SLOW_QUERY_THRESHOLD_MS', 500) / 1000.0
+
+
+def fingerprint(sql):
+    """
+    Returns a hash identifying the shape of a query, regardless of the values
+    it was run with or the number of items in its IN-lists.
+    """
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = _IN_LIST_RE.sub('IN (...)', sql)
+    sql = _WHITESPACE_RE.sub(' ', sql).strip()
+    return hashlib.sha1(sql.encode('utf-8')).hexdigest()
+
+
+def observe(connection, cursor, sql, params, duration):
+    """
+    Called by the cursor wrapper after every query; queues the query for
+    storage if it ran for longer than SLOW_QUERY_THRESHOLD_MS.
+    """
+    if duration < threshold() or getattr(_local, 'suppressed', False):
+        return
+
+    view_name, query_shape = context.get_request_context()
+    record = {
+        'alias': connection.alias,
+        'duration': duration * 1000,
+        'sql': sql,
+        'params': json.dumps(params, default=str) if params else None,
+        # the exact statement psycopg2 sent, for re-running under EXPLAIN
+        'statement': getattr(cursor, 'query', None),
+        'view_name': view_name,
+        'query_shape': query_shape,
+    }
+    try:
+        _queue.put_nowait(record)
+    except queue.Full:
+        logger.warning('Slow query queue is full; dropping a record')
+        return
+    _ensure_worker()
+
+
+def _ensure_worker():
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_work,
+                                       name='slow-query-recorder',
+                                       daemon=True)
+            _worker.start()
+
+
+def _work():
+    # Queries made while storing a record must not be recorded themselves.
+    _local.suppressed = True
+    while True:
+        record = _queue.get()
+        try:
+            _store(record)
+        except Exception:
+            logger.exception('Unable to store a slow query record')
+            connections[record['alias']].close()
+
+
+def _explain(alias, statement):
+    """
+    Re-runs a SELECT under EXPLAIN (ANALYZE, BUFFERS) on this thread's own
+    connection and rolls it back afterwards.
+    """
+    if isinstance(statement, bytes):
+        statement = statement.decode('utf-8')
+    if not statement.lstrip().upper().startswith('SELECT'):
+        return None
+
+    timeout = getattr(settings, 'SLOW_QUERY_EXPLAIN_TIMEOUT_MS', 30000)
+    with transaction.atomic(using=alias):
+        cursor = connections[alias].cursor()
+        cursor.execute('SET LOCAL statement_timeout = %s', [timeout])
+        # The statement has already been interpolated by psycopg2, so any
+        # literal percent signs in it must not be read as placeholders.
+        cursor.execute('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' +
+                       statement.replace('%', '%%'), [])
+        plan = cursor.fetchone()[0]
+        transaction.set_rollback(True, using=alias)
+    return json.dumps(plan)
+
+
+def _store(record):
+    from apps.monitoring.models import SlowQuery
+
+    plan = None
+    if (getattr(settings, 'SLOW_QUERY_EXPLAIN', False) and
+            record['statement']):
+        try:
+            plan = _explain(record['alias'], record['statement'])
+        except Exception:
+            logger.exception('Unable to EXPLAIN a slow query')
+
+    SlowQuery.objects.create(
+        duration=record['duration'],
+        sql=record['sql'],
+        params=record['params'],
+        fingerprint=fingerprint(record['sql']),
+        view_name=record['view_name'],
+        query_shape=record['query_shape'],
+        plan=plan,
+    )
+
+
+def worst_query_shapes(limit=20, since=None):
+    """
+    Returns the recorded query shapes, worst first by total time spent.
+    """
+    from apps.monitoring.models import SlowQuery
+
+    qs = SlowQuery.objects.all()
+    if since is not None:
+        qs = qs.filter(created__gte=since)
+    return (qs
+            .values('fingerprint')
+            .annotate(total_duration=Sum('duration'),
+                      max_duration=Max('duration'),
+                      count=Count('id'),
+                      last_seen=Max('created'),
+                      sql=Max('sql'),
+                      view_name=Max('view_name'),
+                      query_shape=Max('query_shape'))
+            .order_by('-total_duration')[:limit])
@@ -1 +1,3 @@
 __author__ = 'krishnaaradhi'
+
+default_app_config = 'apps.samples.apps.SamplesConfig'
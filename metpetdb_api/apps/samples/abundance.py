@@ -0,0 +1,96 @@
+"""
+Normalizes the free-text modal abundances of SampleMineral.amount ("10%",
+"5-10", "<5", "tr", ...) into the bounds amount_min and amount_max, in
+volume percent, that sample_query filters on.
+"""
+import re
+
+from django.db import connection, transaction
+
+
+BATCH_SIZE = 10000
+
+_MIN_ID = '00000000-0000-0000-0000-000000000000'
+
+# What a trace amount is taken to be at most, in percent
+TRACE = 1.0
+
+TRACE_WORDS = ('tr', 'tr.', 'trace', 'traces', 'acc', 'acc.', 'accessory')
+
+_NUMBER = r'(\d+(?:\.\d+)?)'
+_PERCENT = r'\s*(?:%|vol\.?\s*%|vol\.?|percent)?'
+
+# (pattern, bounds from the matched numbers)
+_FORMS = (
+    # 10%, ~10 %, ca. 10
+    (re.compile(r'(?:~|ca\.?|approx\.?|about)?\s*' + _NUMBER + _PERCENT),
+     lambda n: (n[0], n[0])),
+    # 5-10%, 5 - 10, 5 to 10 %
+    (re.compile(_NUMBER + _PERCENT + r'\s*(?:-|–|to)\s*' + _NUMBER +
+                _PERCENT),
+     lambda n: (n[0], n[1])),
+    # 10+/-2, 10 ± 2 %
+    (re.compile(_NUMBER + r'\s*(?:\+/-|\+-|±)\s*' + _NUMBER + _PERCENT),
+     lambda n: (n[0] - n[1], n[0] + n[1])),
+    # <5%, <= 5
+    (re.compile(r'(?:<|<=|≤)\s*' + _NUMBER + _PERCENT),
+     lambda n: (0.0, n[0])),
+    # >20%, >= 20
+    (re.compile(r'(?:>|>=|≥)\s*' + _NUMBER + _PERCENT),
+     lambda n: (n[0], 100.0)),
+)
+
+
+def parse_abundance(text):
+    """
+    The (lower, upper) bounds in percent of a modal abundance, or (None,
+    None) when it can't be read as one.
+    """
+    if text is None:
+        return None, None
+    text = text.strip().lower()
+    if text in TRACE_WORDS:
+        return 0.0, TRACE
+    for pattern, bounds in _FORMS:
+        match = pattern.fullmatch(text)
+        if match:
+            low, high = bounds([float(group) for group in match.groups()])
+            low, high = max(low, 0.0), min(high, 100.0)
+            if low > high:
+                return None, None
+            return low, high
+    return None, None
+
+
+_UPDATE_SQL = """
+    UPDATE sample_minerals sm
+    SET amount_min = s.amount_min, amount_max = s.amount_max
+    FROM unnest(%s::uuid[], %s::float8[], %s::float8[])
+         AS s (id, amount_min, amount_max)
+    WHERE sm.id = s.id
+"""
+
+
+def backfill(batch_size=BATCH_SIZE, progress=None):
+    """
+    Sets the bounds of every sample mineral from its amount, `batch_size`
+    rows (in id order) per transaction.
+    """
+    last = _MIN_ID
+    with connection.cursor() as cursor:
+        while True:
+            cursor.execute('SELECT id, amount FROM sample_minerals '
+                           'WHERE id > %s ORDER BY id LIMIT %s',
+                           [last, batch_size])
+            rows = cursor.fetchall()
+            if not rows:
+                return
+            bounds = [parse_abundance(amount) for _, amount in rows]
+            with transaction.atomic():
+                cursor.execute(_UPDATE_SQL, [
+                    [str(pk) for pk, _ in rows],
+                    [low for low, _ in bounds],
+                    [high for _, high in bounds]])
+            last = str(rows[-1][0])
+            if progress is not None:
+                progress(last)
@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class SamplesConfig(AppConfig):
+    name = 'apps.samples'
+
+    def ready(self):
+        # connect the signal receivers
+        from apps.samples import signals  # noqa
@@ -0,0 +1,49 @@
+"""
+Maintains MineralClosure, the transitive closure of the mineral hierarchy,
+so a filter on a mineral group can match the group, its members and their
+synonyms with one indexed join.
+
+The hierarchy is small, so it is recomputed as a whole whenever a
+mineral or a relationship changes.
+"""
+from django.db import connection, transaction
+
+
+# Edges from a mineral to the minerals it stands for: a group to its
+# members, and a mineral to its synonyms and back
+_REFRESH_SQL = """
+    INSERT INTO mineral_closure (ancestor_id, descendant_id, depth)
+    WITH RECURSIVE edges (parent_id, child_id) AS (
+        SELECT parent_mineral_id, child_mineral_id
+        FROM mineral_relationships
+        UNION
+        SELECT real_mineral_id, id
+        FROM minerals
+        WHERE real_mineral_id IS NOT NULL AND real_mineral_id <> id
+        UNION
+        SELECT id, real_mineral_id
+        FROM minerals
+        WHERE real_mineral_id IS NOT NULL AND real_mineral_id <> id
+    ), closure (ancestor_id, descendant_id, depth, path) AS (
+        SELECT id, id, 0, ARRAY[id]
+        FROM minerals
+        UNION ALL
+        SELECT c.ancestor_id, e.child_id, c.depth + 1, c.path || e.child_id
+        FROM closure c
+        INNER JOIN edges e ON e.parent_id = c.descendant_id
+        WHERE e.child_id <> ALL(c.path)
+    )
+    SELECT ancestor_id, descendant_id, MIN(depth)
+    FROM closure
+    GROUP BY ancestor_id, descendant_id
+"""
+
+
+def refresh_closure():
+    """
+    Recomputes the closure from MineralRelationship and
+    Mineral.real_mineral.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('DELETE FROM mineral_closure')
+        cursor.execute(_REFRESH_SQL)
@@ -0,0 +1,18 @@
+from django.core.management import BaseCommand
+
+from apps.samples import abundance
+
+
+class Command(BaseCommand):
+    help = ('Sets the numeric bounds of every sample mineral amount from its '
+            'text')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+                            default=abundance.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        def progress(last_id):
+            self.stdout.write('Up to {}'.format(last_id))
+
+        abundance.backfill(options['batch_size'], progress=progress)
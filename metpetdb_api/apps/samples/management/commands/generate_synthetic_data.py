@@ -0,0 +1,562 @@
+import io
+import random
+import uuid
+from datetime import datetime, timedelta
+
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import BaseCommand, call_command
+from django.db import connection, transaction
+from rest_framework.authtoken.models import Token
+
+from apps.chemical_analyses.models import Element, Oxide
+from apps.samples.abundance import parse_abundance
+from apps.samples.models import (
+    Collector,
+    Country,
+    GeoReference,
+    MetamorphicGrade,
+    MetamorphicRegion,
+    Mineral,
+    MineralRelationship,
+    MineralType,
+    Reference,
+    Region,
+    RockType,
+    SubsampleType,
+)
+
+
+# (species, element, symbol, atomic number, element weight,
+#  oxidation state, oxide weight, cations per oxide, order)
+OXIDES = (
+    ('SiO2', 'Silicon', 'Si', 14, 28.086, 4, 60.084, 1, 1),
+    ('TiO2', 'Titanium', 'Ti', 22, 47.867, 4, 79.866, 1, 2),
+    ('Al2O3', 'Aluminum', 'Al', 13, 26.982, 3, 101.961, 2, 3),
+    ('Cr2O3', 'Chromium', 'Cr', 24, 51.996, 3, 151.990, 2, 4),
+    ('FeO', 'Iron', 'Fe', 26, 55.845, 2, 71.844, 1, 5),
+    ('MnO', 'Manganese', 'Mn', 25, 54.938, 2, 70.937, 1, 6),
+    ('MgO', 'Magnesium', 'Mg', 12, 24.305, 2, 40.304, 1, 7),
+    ('CaO', 'Calcium', 'Ca', 20, 40.078, 2, 56.077, 1, 8),
+    ('Na2O', 'Sodium', 'Na', 11, 22.990, 1, 61.979, 2, 9),
+    ('K2O', 'Potassium', 'K', 19, 39.098, 1, 94.196, 2, 10),
+    ('P2O5', 'Phosphorus', 'P', 15, 30.974, 5, 141.943, 2, 11),
+)
+
+# (name, symbol, atomic number, weight, order); measured in ppm
+TRACE_ELEMENTS = (
+    ('Rubidium', 'Rb', 37, 85.468, 37),
+    ('Strontium', 'Sr', 38, 87.62, 38),
+    ('Yttrium', 'Y', 39, 88.906, 39),
+    ('Zirconium', 'Zr', 40, 91.224, 40),
+    ('Nickel', 'Ni', 28, 58.693, 28),
+    ('Barium', 'Ba', 56, 137.327, 56),
+    ('Lanthanum', 'La', 57, 138.905, 57),
+    ('Cerium', 'Ce', 58, 140.116, 58),
+)
+
+# Mean composition (wt%, in OXIDES order) and relative spread of each
+# mineral; the relative frequency is how often the mineral is analysed.
+MINERALS = (
+    # name, frequency, spread, SiO2 TiO2 Al2O3 Cr2O3 FeO MnO MgO CaO Na2O K2O P2O5
+    ('Almandine', 20, 0.10, (37.5, 0.05, 21.0, 0.02, 32.0, 2.0, 4.0, 3.0, 0.02, 0.0, 0.03)),
+    ('Pyrope', 4, 0.10, (41.5, 0.1, 23.0, 1.0, 9.0, 0.4, 20.0, 4.5, 0.03, 0.0, 0.03)),
+    ('Grossular', 3, 0.10, (39.0, 0.3, 21.5, 0.0, 3.0, 0.3, 0.5, 35.0, 0.0, 0.0, 0.0)),
+    ('Spessartine', 2, 0.10, (36.5, 0.1, 20.5, 0.0, 10.0, 30.0, 1.0, 1.5, 0.0, 0.0, 0.0)),
+    ('Biotite', 15, 0.12, (35.5, 2.5, 18.0, 0.05, 20.0, 0.2, 9.0, 0.05, 0.2, 9.0, 0.0)),
+    ('Muscovite', 8, 0.10, (46.0, 0.5, 35.0, 0.02, 1.0, 0.02, 0.7, 0.02, 0.8, 10.0, 0.0)),
+    ('Plagioclase', 12, 0.08, (60.0, 0.0, 25.0, 0.0, 0.1, 0.0, 0.0, 6.5, 8.0, 0.3, 0.0)),
+    ('K-feldspar', 4, 0.05, (64.5, 0.0, 18.5, 0.0, 0.05, 0.0, 0.0, 0.1, 1.0, 15.5, 0.0)),
+    ('Olivine', 5, 0.06, (40.0, 0.02, 0.05, 0.05, 11.0, 0.15, 48.0, 0.1, 0.0, 0.0, 0.0)),
+    ('Orthopyroxene', 5, 0.08, (54.0, 0.1, 2.0, 0.3, 13.0, 0.3, 30.0, 1.0, 0.05, 0.0, 0.0)),
+    ('Clinopyroxene', 6, 0.08, (52.0, 0.5, 3.0, 0.5, 8.0, 0.2, 15.0, 21.0, 0.8, 0.0, 0.0)),
+    ('Hornblende', 8, 0.10, (44.0, 1.5, 12.0, 0.1, 15.0, 0.3, 12.0, 11.0, 1.5, 0.5, 0.0)),
+    ('Staurolite', 3, 0.08, (27.5, 0.6, 54.0, 0.05, 13.0, 0.2, 2.0, 0.02, 0.0, 0.0, 0.0)),
+    ('Kyanite', 3, 0.02, (37.0, 0.02, 62.5, 0.05, 0.2, 0.0, 0.02, 0.0, 0.0, 0.0, 0.0)),
+    ('Chlorite', 4, 0.12, (26.0, 0.05, 21.0, 0.05, 25.0, 0.2, 15.0, 0.05, 0.02, 0.05, 0.0)),
+    ('Ilmenite', 3, 0.05, (0.05, 52.0, 0.05, 0.05, 46.0, 1.0, 0.5, 0.05, 0.0, 0.0, 0.0)),
+    ('Bulk Rock', 10, 0.20, (55.0, 1.0, 16.0, 0.03, 7.0, 0.15, 5.0, 6.0, 3.0, 2.5, 0.2)),
+)
+
+# Mean trace element contents (ppm, in TRACE_ELEMENTS order) of bulk rocks.
+BULK_ROCK_TRACES = (80.0, 350.0, 25.0, 180.0, 60.0, 500.0, 30.0, 60.0)
+
+MINERAL_GROUPS = {
+    'Garnet': ('Almandine', 'Pyrope', 'Grossular', 'Spessartine'),
+    'Mica': ('Biotite', 'Muscovite'),
+    'Feldspar': ('Plagioclase', 'K-feldspar'),
+    'Pyroxene': ('Orthopyroxene', 'Clinopyroxene'),
+    'Amphibole': ('Hornblende',),
+}
+
+# Legacy synonyms, mapped to their real mineral.
+MINERAL_SYNONYMS = {
+    'Almandite': 'Almandine',
+    'Alkali feldspar': 'K-feldspar',
+    'Enstatite': 'Orthopyroxene',
+}
+
+# Field areas: (longitude, latitude, spread in degrees, country, region,
+# metamorphic region, collectors)
+FIELD_AREAS = (
+    (-74.2, 44.1, 0.4, 'United States', 'Adirondacks', 'Grenville Province',
+     ('F. Spear', 'J. Selverstone', 'D. Wark')),
+    (-72.7, 44.0, 0.3, 'United States', 'Vermont', 'Northern Appalachians',
+     ('F. Spear', 'J. Thompson', 'E. Gurnis')),
+    (-71.8, 43.2, 0.3, 'United States', 'New Hampshire', 'Northern Appalachians',
+     ('F. Spear', 'P. Robinson')),
+    (-119.0, 37.5, 0.5, 'United States', 'Sierra Nevada', 'Sierra Nevada',
+     ('M. Kohn', 'J. Selverstone')),
+    (-78.0, 45.0, 0.6, 'Canada', 'Ontario', 'Grenville Province',
+     ('T. Carlson', 'M. Kohn')),
+    (-4.5, 57.0, 0.5, 'United Kingdom', 'Scottish Highlands', 'Dalradian',
+     ('G. Barrow', 'S. Harte')),
+    (8.0, 46.5, 0.4, 'Switzerland', 'Central Alps', 'Lepontine Dome',
+     ('A. Todd', 'R. Engi')),
+    (85.0, 28.0, 0.8, 'Nepal', 'Himalaya', 'Greater Himalayan Sequence',
+     ('M. Kohn', 'K. Hodges', 'B. Hacker')),
+    (6.5, 62.0, 0.6, 'Norway', 'Western Gneiss Region', 'Western Gneiss Region',
+     ('B. Hacker', 'T. Andersen')),
+    (116.0, 31.0, 0.5, 'China', 'Dabie Shan', 'Dabie-Sulu',
+     ('B. Hacker', 'L. Ratschbacher')),
+    (25.45, 37.1, 0.1, 'Greece', 'Naxos', 'Attic-Cycladic Belt',
+     ('A. Bolhar', 'C. Schenk')),
+    (29.0, -22.5, 0.7, 'South Africa', 'Limpopo', 'Limpopo Belt',
+     ('D. van Reenen', 'C. Smit')),
+)
+
+ROCK_TYPES = ('Schist', 'Gneiss', 'Amphibolite', 'Eclogite', 'Granulite',
+              'Marble', 'Quartzite', 'Migmatite', 'Phyllite', 'Blueschist')
+
+METAMORPHIC_GRADES = ('Greenschist facies', 'Amphibolite facies',
+                      'Granulite facies', 'Eclogite facies',
+                      'Blueschist facies', 'Sillimanite zone',
+                      'Kyanite zone', 'Staurolite zone', 'Garnet zone',
+                      'Biotite zone')
+
+SUBSAMPLE_TYPES = ('Polished thin section', 'Thin section', 'Mineral separate',
+                   'Rock chip', 'Powder')
+
+ANALYSIS_METHODS = ('EPMA', 'EPMA', 'EPMA', 'LA-ICP-MS', 'XRF', 'SEM-EDS')
+
+# How modal abundances are written in the wild.
+AMOUNT_FORMATS = ('{}%', '{}', '{} %', '{}-{}', '~{}%', '<{}', 'tr', None, '')
+
+WORDS = ('garnet', 'porphyroblast', 'schistose', 'foliated', 'coarse',
+         'fine-grained', 'retrogressed', 'matrix', 'inclusion', 'rim',
+         'core', 'zoned', 'outcrop', 'roadcut', 'float', 'layered', 'vein',
+         'pelitic', 'mafic', 'calcareous', 'kyanite-bearing', 'sheared',
+         'mylonitic', 'boudinaged', 'partially', 'melted', 'contact')
+
+JOURNALS = ('Journal of Metamorphic Geology', 'Journal of Petrology',
+            'Contributions to Mineralogy and Petrology', 'American Mineralogist',
+            'Lithos', 'Geology')
+
+
+def _copy(cursor, table, columns, lines):
+    """
+    Loads tab-separated lines into `table` with COPY.
+    """
+    if not lines:
+        return
+    buf = io.StringIO('\n'.join(lines) + '\n')
+    cursor.copy_expert('COPY "{}" ({}) FROM STDIN'
+                       .format(table, ', '.join(columns)), buf)
+
+
+def _value(value):
+    if value is None:
+        return r'\N'
+    return str(value).replace('\\', '\\\\').replace('\t', ' ')
+
+
+def _array(values):
+    if values is None:
+        return r'\N'
+    return '{' + ','.join('"{}"'.format(v.replace('"', '')) for v in values) + '}'
+
+
+class Command(BaseCommand):
+    help = ('Fills the database with a reproducible synthetic dataset of '
+            'samples and chemical analyses')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--samples', type=int, default=1000)
+        parser.add_argument('--subsamples-per-sample', type=int, default=2)
+        parser.add_argument('--analyses-per-subsample', type=int, default=5)
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Number of samples loaded per transaction')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.np_random = np.random.RandomState(options['seed'])
+
+        with transaction.atomic():
+            self._create_reference_data()
+            self._create_users(options['users'])
+
+        self.spot_id = 0
+        total = options['samples']
+        for start in range(0, total, options['batch_size']):
+            count = min(options['batch_size'], total - start)
+            with transaction.atomic():
+                self._generate_samples(start, count,
+                                       options['subsamples_per_sample'],
+                                       options['analyses_per_subsample'])
+            self.stdout.write('Generated {} of {} samples'
+                              .format(start + count, total))
+
+        call_command('recompute_totals', stdout=self.stdout)
+        call_command('refresh_composition_summaries', stdout=self.stdout)
+        call_command('rebuild_composition_arrays', stdout=self.stdout)
+        call_command('refresh_mineral_closure', stdout=self.stdout)
+
+    def _uuids(self, count):
+        data = self.np_random.bytes(16 * count)
+        return [str(uuid.UUID(bytes=data[i:i + 16], version=4))
+                for i in range(0, 16 * count, 16)]
+
+    def _get_or_create(self, model, names, **extra):
+        existing = {obj.name: obj
+                    for obj in model.objects.filter(name__in=names)}
+        model.objects.bulk_create([model(name=name, **extra)
+                                   for name in names if name not in existing])
+        return {obj.name: obj for obj in model.objects.filter(name__in=names)}
+
+    def _create_reference_data(self):
+        self.rock_types = list(self._get_or_create(RockType,
+                                                   ROCK_TYPES).values())
+        self.grades = list(self._get_or_create(MetamorphicGrade,
+                                               METAMORPHIC_GRADES).values())
+        self.regions = self._get_or_create(
+            MetamorphicRegion, sorted(set(area[5] for area in FIELD_AREAS)))
+        self.subsample_types = list(self._get_or_create(
+            SubsampleType, SUBSAMPLE_TYPES).values())
+
+        self._get_or_create(Country, sorted(set(a[3] for a in FIELD_AREAS)))
+        self._get_or_create(Region, sorted(set(a[4] for a in FIELD_AREAS)))
+        self._get_or_create(Collector, sorted(set(
+            name for area in FIELD_AREAS for name in area[6])))
+
+        # elements and oxides
+        element_names = ([o[1] for o in OXIDES] +
+                         [e[0] for e in TRACE_ELEMENTS])
+        existing = set(Element.objects.filter(name__in=element_names)
+                       .values_list('name', flat=True))
+        Element.objects.bulk_create(
+            [Element(name=o[1], symbol=o[2], atomic_number=o[3],
+                     weight=o[4], order_id=o[3])
+             for o in OXIDES if o[1] not in existing] +
+            [Element(name=e[0], symbol=e[1], atomic_number=e[2],
+                     weight=e[3], order_id=e[4])
+             for e in TRACE_ELEMENTS if e[0] not in existing]
+        )
+        elements = {e.name: e
+                    for e in Element.objects.filter(name__in=element_names)}
+
+        existing = set(Oxide.objects.filter(species__in=[o[0] for o in OXIDES])
+                       .values_list('species', flat=True))
+        Oxide.objects.bulk_create([
+            Oxide(species=o[0], element=elements[o[1]], oxidation_state=o[5],
+                  weight=o[6], cations_per_oxide=o[7],
+                  conversion_factor=o[7] * o[4] / o[6], order_id=o[8])
+            for o in OXIDES if o[0] not in existing
+        ])
+        oxides = {o.species: o for o in
+                  Oxide.objects.filter(species__in=[o[0] for o in OXIDES])}
+        self.oxide_ids = [str(oxides[o[0]].pk) for o in OXIDES]
+        self.trace_element_ids = [str(elements[e[0]].pk)
+                                  for e in TRACE_ELEMENTS]
+
+        # minerals, their groups, synonyms and mineral types
+        names = ([m[0] for m in MINERALS] + list(MINERAL_GROUPS) +
+                 list(MINERAL_SYNONYMS))
+        minerals = self._get_or_create(Mineral, names)
+        for synonym, real in MINERAL_SYNONYMS.items():
+            minerals[synonym].real_mineral = minerals[real]
+            minerals[synonym].save()
+        existing = set(MineralRelationship.objects.values_list(
+            'parent_mineral__name', 'child_mineral__name'))
+        MineralRelationship.objects.bulk_create([
+            MineralRelationship(parent_mineral=minerals[group],
+                                child_mineral=minerals[child])
+            for group, children in MINERAL_GROUPS.items()
+            for child in children if (group, child) not in existing
+        ])
+        for name, _, _, composition in MINERALS:
+            if MineralType.objects.filter(name=name).exists():
+                continue
+            mineral_type = MineralType.objects.create(name=name)
+            mineral_type.oxides.add(*[oxides[OXIDES[i][0]]
+                                      for i, amount in enumerate(composition)
+                                      if amount >= 0.1])
+
+        self.mineral_ids = [str(minerals[m[0]].pk) for m in MINERALS]
+        frequencies = np.array([m[1] for m in MINERALS], dtype=float)
+        self.mineral_weights = frequencies / frequencies.sum()
+        self.bulk_rock = len(MINERALS) - 1
+        self.mineral_means = np.array([m[3] for m in MINERALS])
+        self.mineral_spreads = np.array([m[2] for m in MINERALS])
+
+        # a pool of references shared between samples
+        georeferences = []
+        for i in range(200):
+            author = self.random.choice([name for area in FIELD_AREAS
+                                         for name in area[6]])
+            year = self.random.randint(1960, 2015)
+            name = '{}, {} ({})'.format(author, year, i)
+            georeferences.append(GeoReference(
+                name=name,
+                title=' '.join(self.random.sample(WORDS, 6)).capitalize(),
+                first_author=author,
+                journal_name=self.random.choice(JOURNALS),
+                doi='10.1111/synthetic.{}.{}'.format(year, i),
+                publication_year=str(year),
+            ))
+        existing = set(GeoReference.objects.filter(
+            name__in=[g.name for g in georeferences]
+        ).values_list('name', flat=True))
+        GeoReference.objects.bulk_create([g for g in georeferences
+                                          if g.name not in existing])
+        self._get_or_create(Reference, [g.name for g in georeferences])
+        self.georeference_ids = [str(pk) for pk in GeoReference.objects.filter(
+            name__in=[g.name for g in georeferences]
+        ).values_list('pk', flat=True)]
+
+    def _create_users(self, count):
+        User = get_user_model()
+        password = make_password('synthetic')
+        emails = ['synthetic{}@metpetdb.com'.format(i) for i in range(count)]
+        existing = set(User.objects.filter(email__in=emails)
+                       .values_list('email', flat=True))
+        users = User.objects.bulk_create([
+            User(email=email, name='Synthetic User {}'.format(i),
+                 password=password, is_active=True)
+            for i, email in enumerate(emails) if email not in existing
+        ])
+        Token.objects.bulk_create([
+            Token(user=user, key='{:040x}'.format(self.random.getrandbits(160)))
+            for user in users
+        ])
+        self.user_ids = [str(pk) for pk in User.objects.filter(
+            email__in=emails).order_by('email').values_list('pk', flat=True)]
+        # a few prolific owners own most of the samples
+        weights = 1.0 / np.arange(1, len(self.user_ids) + 1)
+        self.user_weights = weights / weights.sum()
+
+    def _generate_samples(self, offset, count, subsamples_per_sample,
+                          analyses_per_subsample):
+        rng = self.np_random
+        cursor = connection.cursor()
+
+        sample_ids = self._uuids(count)
+        areas = rng.choice(len(FIELD_AREAS), count,
+                           p=self._area_weights())
+        owners = rng.choice(len(self.user_ids), count, p=self.user_weights)
+        public = rng.random_sample(count) < 0.7
+
+        samples, sample_grades, sample_regions = [], [], []
+        sample_references, sample_minerals = [], []
+        sample_mineral_choices = []
+        for i, sample_id in enumerate(sample_ids):
+            area = FIELD_AREAS[areas[i]]
+            lon = area[0] + rng.normal(0, area[2])
+            lat = max(-89.9, min(89.9, area[1] + rng.normal(0, area[2])))
+            number = '{}-{}'.format(area[4][:3].upper(), offset + i)
+            aliases = None
+            if rng.random_sample() < 0.2:
+                aliases = ['{}{}'.format(area[4][:2].upper(),
+                                         rng.randint(1, 10 ** 6))
+                           for _ in range(rng.randint(1, 3))]
+
+            date, precision = None, None
+            if rng.random_sample() < 0.85:
+                date = (datetime(1960, 1, 1) +
+                        timedelta(days=int(rng.randint(0, 55 * 365))))
+                precision = self.random.choice((1, 1, 1, 31, 365))
+
+            regions = [area[4]]
+            if rng.random_sample() < 0.2:
+                regions.append(self.random.choice(FIELD_AREAS)[4])
+
+            samples.append('\t'.join((
+                sample_id, '1', 't' if public[i] else 'f', number,
+                self.user_ids[owners[i]], _array(aliases),
+                _value(date.strftime('%Y-%m-%d 00:00:00+00')
+                       if date else None),
+                ' '.join(self.random.sample(WORDS, rng.randint(3, 12))),
+                '{} {}'.format(area[4], rng.randint(1, 500)),
+                'SRID=4326;POINT({:.6f} {:.6f})'.format(lon, lat),
+                _value(round(rng.exponential(50), 1)
+                       if rng.random_sample() < 0.5 else None),
+                str(self.random.choice(self.rock_types).pk),
+                _value(precision),
+                area[3],
+                _array(regions),
+                self.random.choice(area[6]),
+            )))
+
+            sample_regions.append('{}\t{}'.format(
+                sample_id, self.regions[area[5]].pk))
+            for grade in self.random.sample(self.grades,
+                                            self.random.randint(1, 2)):
+                sample_grades.append('{}\t{}'.format(sample_id, grade.pk))
+            if rng.random_sample() < 0.3:
+                for ref in self.random.sample(self.georeference_ids,
+                                              self.random.randint(1, 2)):
+                    sample_references.append('{}\t{}'.format(sample_id, ref))
+
+            minerals = sorted(set(rng.choice(
+                len(MINERALS) - 1, rng.randint(3, 8),
+                p=self._mineral_weights_without_bulk_rock())))
+            sample_mineral_choices.append(minerals)
+            for mineral in minerals:
+                amount = self._modal_amount()
+                amount_min, amount_max = parse_abundance(amount)
+                sample_minerals.append('\t'.join((
+                    self._uuids(1)[0], sample_id, self.mineral_ids[mineral],
+                    _value(amount), _value(amount_min), _value(amount_max),
+                )))
+
+        _copy(cursor, 'samples',
+              ('id', 'version', 'public_data', 'number', 'owner_id',
+               'aliases', 'collection_date', 'description', 'location_name',
+               'location_coords', 'location_error', 'rock_type_id',
+               'date_precision', 'country', 'regions', 'collector_name'),
+              samples)
+        _copy(cursor, 'samples_metamorphic_regions',
+              ('sample_id', 'metamorphicregion_id'), sample_regions)
+        _copy(cursor, 'samples_metamorphic_grades',
+              ('sample_id', 'metamorphicgrade_id'), sample_grades)
+        _copy(cursor, 'samples_references',
+              ('sample_id', 'georeference_id'), sample_references)
+        _copy(cursor, 'sample_minerals',
+              ('id', 'sample_id', 'mineral_id', 'amount', 'amount_min',
+               'amount_max'), sample_minerals)
+
+        # subsamples
+        subsample_count = count * subsamples_per_sample
+        subsample_ids = self._uuids(subsample_count)
+        subsample_samples = np.repeat(np.arange(count), subsamples_per_sample)
+        _copy(cursor, 'subsamples',
+              ('id', 'name', 'version', 'sample_id', 'public_data',
+               'owner_id', 'subsample_type_id'),
+              ['\t'.join((
+                  subsample_id, 'Subsample {}'.format(i % subsamples_per_sample
+                                                      + 1),
+                  '1', sample_ids[subsample_samples[i]],
+                  't' if public[subsample_samples[i]] else 'f',
+                  self.user_ids[owners[subsample_samples[i]]],
+                  str(self.random.choice(self.subsample_types).pk),
+              )) for i, subsample_id in enumerate(subsample_ids)])
+
+        self._generate_analyses(cursor, subsample_ids, subsample_samples,
+                                analyses_per_subsample, owners, public,
+                                sample_mineral_choices)
+
+    def _generate_analyses(self, cursor, subsample_ids, subsample_samples,
+                           analyses_per_subsample, owners, public,
+                           sample_mineral_choices):
+        rng = self.np_random
+        count = len(subsample_ids) * analyses_per_subsample
+        if not count:
+            return
+
+        analysis_ids = self._uuids(count)
+        analysis_subsamples = np.repeat(np.arange(len(subsample_ids)),
+                                        analyses_per_subsample)
+        analysis_samples = subsample_samples[analysis_subsamples]
+
+        # one in ten analyses is of the bulk rock, the rest are of one of
+        # the minerals found in the sample
+        minerals = np.array([
+            self.bulk_rock if rng.random_sample() < 0.1 else
+            self.random.choice(sample_mineral_choices[sample])
+            for sample in analysis_samples
+        ])
+
+        means = self.mineral_means[minerals]
+        spreads = self.mineral_spreads[minerals][:, np.newaxis]
+        amounts = np.clip(
+            means * (1 + spreads * rng.standard_normal(means.shape)), 0, None)
+        # not every species is measured in every analysis
+        measured = (means > 0) & (rng.random_sample(means.shape) > 0.05)
+        amounts = np.where(measured, amounts, 0.0)
+
+        totals = amounts.sum(axis=1) * rng.normal(1.0, 0.005, count)
+        # a few analyses have badly transcribed totals
+        bad = rng.random_sample(count) < 0.02
+        totals[bad] = rng.uniform(60, 130, bad.sum())
+
+        analyses = []
+        for i, analysis_id in enumerate(analysis_ids):
+            sample = analysis_samples[i]
+            self.spot_id += 1
+            method = self.random.choice(ANALYSIS_METHODS)
+            analyses.append('\t'.join((
+                analysis_id, '1', 't' if public[sample] else 'f',
+                '{:.2f}'.format(rng.uniform(0, 100)),
+                '{:.2f}'.format(rng.uniform(0, 100)),
+                '{:.2f}'.format(rng.uniform(0, 30000)),
+                '{:.2f}'.format(rng.uniform(0, 30000)),
+                method, 'Rensselaer Polytechnic Institute',
+                self.random.choice(FIELD_AREAS[0][6]),
+                '{:.2f}'.format(totals[i]),
+                str(self.spot_id),
+                subsample_ids[analysis_subsamples[i]],
+                self.mineral_ids[minerals[i]],
+                self.user_ids[owners[sample]],
+            )))
+        _copy(cursor, 'chemical_analyses',
+              ('id', 'version', 'public_data', 'reference_x', 'reference_y',
+               'stage_x', 'stage_y', 'analysis_method', 'where_done',
+               'analyst', 'total', 'spot_id', 'subsample_id', 'mineral_id',
+               'owner_id'),
+              analyses)
+
+        rows, columns = np.nonzero(measured)
+        row_ids = self._uuids(len(rows))
+        _copy(cursor, 'chemical_analysis_oxides',
+              ('id', 'chemical_analysis_id', 'oxide_id', 'amount',
+               'precision', 'precision_type', 'measurement_unit',
+               'min_amount', 'canonical_amount'),
+              ['{}\t{}\t{}\t{:.3f}\t{:.3f}\tABS\twt%\t0.01\t{:.3f}'.format(
+                  row_ids[n], analysis_ids[row], self.oxide_ids[column],
+                  amounts[row, column], amounts[row, column] * 0.02,
+                  amounts[row, column])
+               for n, (row, column) in enumerate(zip(rows, columns))])
+
+        # trace elements, for bulk rock analyses
+        bulk = np.nonzero(minerals == self.bulk_rock)[0]
+        traces = (np.array(BULK_ROCK_TRACES) *
+                  rng.lognormal(0, 0.5, (len(bulk), len(BULK_ROCK_TRACES))))
+        row_ids = self._uuids(traces.size)
+        _copy(cursor, 'chemical_analysis_elements',
+              ('id', 'chemical_analysis_id', 'element_id', 'amount',
+               'precision', 'precision_type', 'measurement_unit',
+               'min_amount', 'canonical_amount'),
+              ['{}\t{}\t{}\t{:.2f}\t{:.2f}\tABS\tppm\t0.5\t{:.2f}'.format(
+                  row_ids[n * traces.shape[1] + j], analysis_ids[row],
+                  self.trace_element_ids[j], traces[n, j],
+                  traces[n, j] * 0.05, traces[n, j])
+               for n, row in enumerate(bulk)
+               for j in range(traces.shape[1])])
+
+    def _area_weights(self):
+        # a few field areas are much more heavily sampled than others
+        weights = 1.0 / np.arange(1, len(FIELD_AREAS) + 1) ** 0.8
+        return weights / weights.sum()
+
+    def _mineral_weights_without_bulk_rock(self):
+        weights = self.mineral_weights[:-1]
+        return weights / weights.sum()
+
+    def _modal_amount(self):
+        fmt = self.random.choice(AMOUNT_FORMATS)
+        if fmt is None:
+            return None
+        low = self.random.randint(1, 40)
+        return fmt.format(low, low + self.random.randint(1, 15))
@@ -0,0 +1,11 @@
+from django.core.management import BaseCommand
+
+from apps.samples.closure import refresh_closure
+
+
+class Command(BaseCommand):
+    help = ('Recomputes the mineral hierarchy closure from the mineral '
+            'relationships and synonyms')
+
+    def handle(self, *args, **options):
+        refresh_closure()
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+# Indexes backing the filters in api.samples.lib.query.sample_query
+INDEXES = [
+    ('sample_minerals_mineral_id_sample_id',
+     'sample_minerals (mineral_id, sample_id)'),
+    ('samples_regions_gin', 'samples USING gin (regions)'),
+    ('samples_collection_date', 'samples (collection_date)'),
+    ('samples_country', 'samples (country)'),
+    ('samples_collector_name', 'samples (collector_name)'),
+    ('samples_number', 'samples (number)'),
+    ('samples_sesar_number', 'samples (sesar_number) '
+                             'WHERE sesar_number IS NOT NULL'),
+    ('samples_public', 'samples (id) WHERE public_data'),
+    ('samples_metamorphic_grades_grade_id_sample_id',
+     'samples_metamorphic_grades (metamorphicgrade_id, sample_id)'),
+    ('samples_metamorphic_regions_region_id_sample_id',
+     'samples_metamorphic_regions (metamorphicregion_id, sample_id)'),
+    ('samples_references_georeference_id_sample_id',
+     'samples_references (georeference_id, sample_id)'),
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('samples', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX {} ON {}'.format(name, definition),
+            'DROP INDEX {}'.format(name)
+        )
+        for name, definition in INDEXES
+    ]
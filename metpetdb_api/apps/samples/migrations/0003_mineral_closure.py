@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+# Fill the table with `python manage.py refresh_mineral_closure`.
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('samples', '0002_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MineralClosure',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('depth', models.IntegerField()),
+                ('ancestor', models.ForeignKey(related_name='+', to='samples.Mineral')),
+                ('descendant', models.ForeignKey(related_name='+', to='samples.Mineral')),
+            ],
+            options={
+                'db_table': 'mineral_closure',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='mineralclosure',
+            unique_together=set([('ancestor', 'descendant')]),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+# Back the abundance range filter of sample_query, by either bound. Fill the
+# new columns with `python manage.py backfill_mineral_abundances`.
+INDEXES = [
+    ('sample_minerals_mineral_id_amount_min',
+     'sample_minerals (mineral_id, amount_min, sample_id)'),
+    ('sample_minerals_mineral_id_amount_max',
+     'sample_minerals (mineral_id, amount_max, sample_id)'),
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('samples', '0003_mineral_closure'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='samplemineral',
+            name='amount_min',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='samplemineral',
+            name='amount_max',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ] + [
+        migrations.RunSQL(
+            'CREATE INDEX {} ON {}'.format(name, definition),
+            'DROP INDEX {}'.format(name)
+        )
+        for name, definition in INDEXES
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+# Backs the case-insensitive number-or-alias lookups of
+# api.samples.lib.query.match_identifiers, which compare
+# lower_array(array_append(aliases, number)) with `&&`.
+LOWER_ARRAY = """
+    CREATE FUNCTION lower_array(text[]) RETURNS text[] AS $$
+        SELECT array_agg(lower(value)) FROM unnest($1) value
+    $$ LANGUAGE sql IMMUTABLE STRICT
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('samples', '0004_mineral_abundances'),
+    ]
+
+    operations = [
+        migrations.RunSQL(LOWER_ARRAY, 'DROP FUNCTION lower_array(text[])'),
+        migrations.RunSQL(
+            'CREATE INDEX samples_identifiers_gin ON samples '
+            'USING gin (lower_array(array_append(aliases, number)))',
+            'DROP INDEX samples_identifiers_gin'
+        ),
+    ]
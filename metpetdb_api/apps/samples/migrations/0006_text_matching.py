@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+# Back the normalized and fuzzy (?text_match=) modes of the free-text
+# filters of api.samples.lib.query.sample_query: normalize_text folds case,
+# accents and whitespace; the btree and array GIN indexes serve equality of
+# normalized values and the pg_trgm ones trigram similarity (`%`).
+# unaccent() is only STABLE, so the wrappers name its dictionary to be
+# declared IMMUTABLE and usable in indexes.
+EXTENSIONS = ('unaccent', 'pg_trgm')
+
+FUNCTIONS = [
+    ('normalize_text(text)', r"""
+        CREATE FUNCTION normalize_text(text) RETURNS text AS $$
+            SELECT lower(btrim(regexp_replace(
+                public.unaccent('public.unaccent', $1), '\s+', ' ', 'g')))
+        $$ LANGUAGE sql IMMUTABLE STRICT
+    """),
+    ('normalize_text_array(text[])', """
+        CREATE FUNCTION normalize_text_array(text[]) RETURNS text[] AS $$
+            SELECT array_agg(normalize_text(value)) FROM unnest($1) value
+        $$ LANGUAGE sql IMMUTABLE STRICT
+    """),
+]
+
+INDEXES = [
+    ('samples_collector_name_normalized',
+     'samples (normalize_text(collector_name))'),
+    ('samples_country_normalized', 'samples (normalize_text(country))'),
+    ('samples_location_name_normalized',
+     'samples (normalize_text(location_name))'),
+    ('samples_regions_normalized_gin',
+     'samples USING gin (normalize_text_array(regions))'),
+    ('samples_collector_name_trgm',
+     'samples USING gin (normalize_text(collector_name) gin_trgm_ops)'),
+    ('samples_country_trgm',
+     'samples USING gin (normalize_text(country) gin_trgm_ops)'),
+    ('samples_location_name_trgm',
+     'samples USING gin (normalize_text(location_name) gin_trgm_ops)'),
+    ('regions_name_trgm',
+     'regions USING gin (normalize_text(name) gin_trgm_ops)'),
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('samples', '0005_sample_identifiers_index'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE EXTENSION IF NOT EXISTS {}'.format(extension),
+            migrations.RunSQL.noop
+        )
+        for extension in EXTENSIONS
+    ] + [
+        migrations.RunSQL(sql, 'DROP FUNCTION {}'.format(signature))
+        for signature, sql in FUNCTIONS
+    ] + [
+        migrations.RunSQL(
+            'CREATE INDEX {} ON {}'.format(name, definition),
+            'DROP INDEX {}'.format(name)
+        )
+        for name, definition in INDEXES
+    ]
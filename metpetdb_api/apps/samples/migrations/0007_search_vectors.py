@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+# The search_vector columns behind api.search.lib.search: kept up to date by
+# a trigger per table, filled here for the existing rows and GIN indexed.
+# Identifiers and names use the 'simple' configuration, prose 'english'.
+# (table, [(column, configuration, weight)])
+VECTORS = [
+    ('samples', [
+        ('number', 'simple', 'A'),
+        ('location_name', 'simple', 'B'),
+        ('description', 'english', 'C'),
+    ]),
+    ('georeferences', [
+        ('title', 'english', 'A'),
+        ('doi', 'simple', 'A'),
+        ('first_author', 'simple', 'B'),
+        ('journal_name', 'simple', 'C'),
+        ('full_text', 'english', 'D'),
+    ]),
+    ('minerals', [
+        ('name', 'simple', 'A'),
+    ]),
+    ('rock_types', [
+        ('name', 'simple', 'A'),
+    ]),
+]
+
+
+def _vector(columns, row=''):
+    return ' || '.join(
+        "setweight(to_tsvector('{}', coalesce({}{}, '')), '{}')".format(
+            configuration, row, column, weight)
+        for column, configuration, weight in columns)
+
+
+def _operations(table, columns):
+    function = '{}_search_vector_update'.format(table)
+    return [
+        migrations.RunSQL(
+            'ALTER TABLE {} ADD COLUMN search_vector tsvector'.format(table),
+            'ALTER TABLE {} DROP COLUMN search_vector'.format(table)
+        ),
+        migrations.RunSQL(
+            'UPDATE {} SET search_vector = {}'.format(table,
+                                                      _vector(columns)),
+            migrations.RunSQL.noop
+        ),
+        migrations.RunSQL(
+            """
+            CREATE FUNCTION {function}() RETURNS trigger AS $$
+            BEGIN
+                NEW.search_vector := {vector};
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql;
+            CREATE TRIGGER {function}
+            BEFORE INSERT OR UPDATE OF {columns} ON {table}
+            FOR EACH ROW EXECUTE PROCEDURE {function}();
+            """.format(function=function, table=table,
+                       columns=', '.join(column for column, _, _ in columns),
+                       vector=_vector(columns, 'NEW.')),
+            """
+            DROP TRIGGER {function} ON {table};
+            DROP FUNCTION {function}();
+            """.format(function=function, table=table)
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX {0}_search_vector_gin ON {0} '
+            'USING gin (search_vector)'.format(table),
+            'DROP INDEX {}_search_vector_gin'.format(table)
+        ),
+    ]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('samples', '0006_text_matching'),
+    ]
+
+    operations = [
+        operation
+        for table, columns in VECTORS
+        for operation in _operations(table, columns)
+    ]
@@ -5,6 +5,7 @@ from django.conf import settings
 from django.contrib.gis.db import models
 from django.contrib.postgres.fields import ArrayField
 from apps.chemical_analyses.models import Element, Oxide
+from apps.samples.abundance import parse_abundance
 
 
 class RockType(models.Model):
@@ -135,10 +136,21 @@ class SampleMineral(models.Model):
     sample = models.ForeignKey(Sample)
     mineral = models.ForeignKey(Mineral)
     amount = models.CharField(max_length=30, blank=True, null=True)
+    # The bounds of `amount` in volume percent, set on save; see
+    # apps.samples.abundance
+    amount_min = models.FloatField(blank=True, null=True)
+    amount_max = models.FloatField(blank=True, null=True)
 
     class Meta:
         db_table = 'sample_minerals'
 
+    def set_amount_bounds(self):
+        self.amount_min, self.amount_max = parse_abundance(self.amount)
+
+    def save(self, *args, **kwargs):
+        self.set_amount_bounds()
+        super().save(*args, **kwargs)
+
 
 class MineralRelationship(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -150,6 +162,20 @@ class MineralRelationship(models.Model):
         unique_together = (('parent_mineral', 'child_mineral'),)
 
 
+# Every (ancestor, descendant) pair of the mineral hierarchy, following
+# MineralRelationship from parent to child and Mineral.real_mineral both
+# ways, at the fewest steps apart; each mineral is its own descendant at
+# depth 0. Maintained by apps.samples.closure
+class MineralClosure(models.Model):
+    ancestor = models.ForeignKey(Mineral, related_name='+')
+    descendant = models.ForeignKey(Mineral, related_name='+')
+    depth = models.IntegerField()
+
+    class Meta:
+        db_table = 'mineral_closure'
+        unique_together = (('ancestor', 'descendant'),)
+
+
 class MineralType(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     name = models.CharField(max_length=50)
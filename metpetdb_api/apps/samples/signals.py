@@ -0,0 +1,13 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from apps.samples.closure import refresh_closure
+from apps.samples.models import Mineral, MineralRelationship
+
+
+@receiver(post_save, sender=Mineral)
+@receiver(post_delete, sender=Mineral)
+@receiver(post_save, sender=MineralRelationship)
+@receiver(post_delete, sender=MineralRelationship)
+def update_mineral_closure(sender, **kwargs):
+    refresh_closure()
@@ -44,8 +44,15 @@ from api.samples.v1.views import (
     SampleOwnerNamesView,
 )
 from api.users.v1.views import UserViewSet
+from api.monitoring.v1.views import (
+    MetricsView,
+    ProfileView,
+    SampledStacksView,
+    SlowQueryView,
+)
 
 from api.bulk_upload.v1.views import BulkUploadSampleViewSet
+from api.search.v1.views import SearchView
 
 router = routers.DefaultRouter()
 router.register(r'users', UserViewSet)
@@ -73,4 +80,11 @@ urlpatterns = [
     url(r'^api/sample_numbers/$', SampleNumbersView.as_view()),
     url(r'^api/country_names/$', CountryNamesView.as_view()),
     url(r'^api/sample_owner_names/$', SampleOwnerNamesView.as_view()),
+    url(r'^api/search/$', SearchView.as_view()),
+
+    url(r'^api/_slow_queries/$', SlowQueryView.as_view()),
+    url(r'^api/_metrics$', MetricsView.as_view()),
+    url(r'^api/_profiles/sampled/$', SampledStacksView.as_view()),
+    url(r'^api/_profiles/(?P<profile_id>[0-9a-f]{32})/$',
+        ProfileView.as_view()),
 ]
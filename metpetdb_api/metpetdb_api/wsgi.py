@@ -23,3 +23,7 @@ p = Path(str(Path.cwd()))
 sys.path.insert(-1, os.path.join(str(p), 'vendor/djoser'))
 
 application = get_wsgi_application()
+
+# build the similarity indexes before the first request needs them
+from api.chemical_analyses.lib.similarity import start_refreshing
+start_refreshing()
@@ -54,9 +54,11 @@ INSTALLED_APPS = (
     'apps.chemical_analyses',
     'apps.samples',
     'apps.users',
+    'apps.monitoring',
 )
 
 MIDDLEWARE_CLASSES = (
+    'apps.monitoring.middleware.MetricsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -65,6 +67,8 @@ MIDDLEWARE_CLASSES = (
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'apps.monitoring.middleware.RequestContextMiddleware',
+    'apps.monitoring.middleware.ProfilerMiddleware',
 )
 
 ROOT_URLCONF = 'metpetdb_api.urls'
@@ -93,7 +97,8 @@ WSGI_APPLICATION = 'metpetdb_api.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.contrib.gis.db.backends.postgis',
+        # PostGIS, with every statement timed for the slow query log
+        'ENGINE': 'apps.monitoring.backends.postgis',
         'NAME': env('DB_NAME'),
         'USER': env('DB_USERNAME'),
         'PASSWORD': env('DB_PASSWORD'),
@@ -145,6 +150,52 @@ LOGGING = {
     },
 }
 
+# Queries slower than this are stored in the slow_queries table, see
+# `python manage.py slow_queries`. With SLOW_QUERY_EXPLAIN, slow SELECTs are
+# also re-run in the background under EXPLAIN (ANALYZE, BUFFERS).
+SLOW_QUERY_THRESHOLD_MS = env('SLOW_QUERY_THRESHOLD_MS', 500)
+SLOW_QUERY_EXPLAIN = env('SLOW_QUERY_EXPLAIN', False)
+SLOW_QUERY_EXPLAIN_TIMEOUT_MS = 30000
+
+# Every worker process keeps its metrics in a memory-mapped file in this
+# directory; empty it when restarting the application server.
+METRICS_DIR = env('METRICS_DIR', '/tmp/metpetdb_metrics')
+
+# /api/_metrics is only served to superusers, and to scrapers sending this
+# token as an `Authorization: Bearer <token>` header.
+METRICS_TOKEN = env('METRICS_TOKEN', '')
+
+# Superusers can profile a request with an `X-Profile: cpu` (or `memory`)
+# header; the latest PROFILE_MAX_COUNT profiles are stored here. Setting
+# PROFILER_SAMPLING_INTERVAL_MS also samples the stacks of every request, see
+# /api/_profiles/sampled/.
+PROFILE_DIR = env('PROFILE_DIR', '/tmp/metpetdb_profiles')
+PROFILE_MAX_COUNT = env('PROFILE_MAX_COUNT', 100)
+PROFILER_SAMPLING_INTERVAL_MS = env('PROFILER_SAMPLING_INTERVAL_MS', 0)
+
+# Chemical analyses whose oxides add up to a total (in wt%) outside this
+# window are flagged; see `python manage.py recompute_totals`.
+CHEMICAL_ANALYSIS_TOTAL_MIN = env('CHEMICAL_ANALYSIS_TOTAL_MIN', 98.0)
+CHEMICAL_ANALYSIS_TOTAL_MAX = env('CHEMICAL_ANALYSIS_TOTAL_MAX', 102.0)
+
+# The matrix and structural_formula endpoints build their response in memory
+# and refuse requests matching more analyses than this.
+CHEMICAL_ANALYSIS_MATRIX_MAX_ROWS = env('CHEMICAL_ANALYSIS_MATRIX_MAX_ROWS',
+                                        100000)
+
+# The stats, similar and projection endpoints read compositions from NumPy
+# files memory-mapped from this directory once `python manage.py
+# refresh_composition_cache` has built them there; empty disables the cache.
+COMPOSITION_CACHE_DIR = env('COMPOSITION_CACHE_DIR', '')
+
+# Every worker builds the similarity indexes of /api/chemical_analyses/similar/
+# in a background thread, started with the worker, and brings them up to date
+# this often; 0 disables the thread.
+SIMILARITY_INDEX_REFRESH_SECONDS = env('SIMILARITY_INDEX_REFRESH_SECONDS', 30)
+
+# How long /api/samples/timeline/ keeps the counts of a filter
+SAMPLE_TIMELINE_CACHE_SECONDS = env('SAMPLE_TIMELINE_CACHE_SECONDS', 300)
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.8/topics/i18n/
 